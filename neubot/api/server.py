@@ -39,7 +39,7 @@ from neubot.http.message import Message
 from neubot.http.server import ServerHTTP
 from neubot.log import LOG
 from neubot.marshal import qs_to_dictionary
-from neubot.net.poller import POLLER
+from neubot.net.poller import PRIORITY_LOW
 from neubot.notify import NOTIFIER
 from neubot.rootdir import WWW
 from neubot.state import STATECHANGE
@@ -70,6 +70,17 @@ class ServerAPI(ServerHTTP):
             "/api/version": self._api_version,
         }
 
+    #
+    # API streams have low priority, so that a burst of requests
+    # from the web user interface does not delay the streams that
+    # are performing a test.  We lower the priority when a request
+    # is routed to us, because in the agent we are a child of the
+    # HTTP server and the stream is shared with the other childs.
+    #
+    def got_request_headers(self, stream, request):
+        stream.priority = PRIORITY_LOW
+        return ServerHTTP.got_request_headers(self, stream, request)
+
     #
     # Update the stream timestamp each time we receive a new
     # request.  Which means that the watchdog timeout will
@@ -179,7 +190,7 @@ class ServerAPI(ServerHTTP):
         response = Message()
         debuginfo = {}
         NOTIFIER.snap(debuginfo)
-        POLLER.snap(debuginfo)
+        self.poller.snap(debuginfo)
         debuginfo["queue_history"] = QUEUE_HISTORY
         debuginfo["WWW"] = WWW
         gc.collect()
@@ -286,7 +297,7 @@ class ServerAPI(ServerHTTP):
         stream.send_response(request, response)
 
     def _api_exit(self, stream, request, query):
-        POLLER.sched(0, POLLER.break_loop)
+        self.poller.sched(0, self.poller.break_loop)
         response = Message()
         stringio = StringIO.StringIO("See you, space cowboy\n")
         response.compose(code="200", reason="Ok", body=stringio,
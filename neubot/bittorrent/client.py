@@ -40,6 +40,8 @@ from neubot.database import DATABASE
 from neubot.database import table_bittorrent
 from neubot.utils.version import LibVersion
 from neubot.log import LOG
+from neubot.net import tcpinfo
+from neubot.net import tuning
 from neubot.notify import NOTIFIER
 from neubot.state import STATE
 
@@ -127,6 +129,11 @@ class BitTorrentClient(ClientHTTP):
 
     def peer_test_complete(self, stream, download_speed, rtt, target_bytes):
         self.success = True
+        summary = {}
+        for phase in ("download", "upload"):
+            summary.update(tcpinfo.summarize([], "tcp_%s_" % phase))
+        summary.update(stream.parent.tcp_info)
+        summary["tuning"] = tuning.summarize([stream])
         stream = self.http_stream
 
         # Update the downstream channel estimate
@@ -152,6 +159,7 @@ class BitTorrentClient(ClientHTTP):
             "neubot_version": LibVersion.to_numeric("0.4.6-rc3"),
             "platform": sys.platform,
         }
+        self.my_side.update(summary)
 
         LOG.start("BitTorrent: collecting")
         STATE.update("collect")
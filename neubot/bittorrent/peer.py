@@ -33,6 +33,7 @@ from neubot.bittorrent.bitfield import make_bitfield
 from neubot.bittorrent.sched import sched_req
 from neubot.bittorrent.stream import StreamBitTorrent
 from neubot.net.stream import StreamHandler
+from neubot.net import tcpinfo
 
 from neubot.bittorrent import estimate
 from neubot.log import LOG
@@ -70,6 +71,7 @@ class PeerNeubot(StreamHandler):
         self.saved_ticks = 0
         self.inflight = 0
         self.dload_speed = 0
+        self.tcp_info = {}
         self.repeat = MAX_REPEAT
         self.state = INITIAL
         self.infohash = None
@@ -129,6 +131,8 @@ class PeerNeubot(StreamHandler):
         stream.watchdog = self.conf["bittorrent.watchdog"]
 
     def connection_ready(self, stream):
+        stream.set_profile("bittorrent")
+        stream.start_tcp_info()
         stream.send_bitfield(str(self.bitfield))
         LOG.start("BitTorrent: receiving bitfield")
         if self.connector_side:
@@ -176,6 +180,7 @@ class PeerNeubot(StreamHandler):
         if self.state != UPLOADING:
             raise RuntimeError("NOT_INTERESTED when state != UPLOADING")
         LOG.complete()
+        self.summarize_tcp_info(stream, "upload")
         if self.connector_side:
             self.complete(stream, self.dload_speed, self.rtt,
                           self.target_bytes)
@@ -295,6 +300,7 @@ class PeerNeubot(StreamHandler):
                 self.repeat -= 1
                 if elapsed > LO_THRESH or self.repeat <= 0:
                     self.dload_speed = speed
+                    self.summarize_tcp_info(stream, "download")
                     self.state = SENT_NOT_INTERESTED
                     stream.send_not_interested()
                     if not self.connector_side:
@@ -312,5 +318,16 @@ class PeerNeubot(StreamHandler):
             elif self.inflight < 0:
                 raise RuntimeError("Inflight became negative")
 
+    #
+    # The same stream is used for both directions, so we
+    # summarize TCP_INFO at the end of each phase and we
+    # start again from scratch.
+    #
+    def summarize_tcp_info(self, stream, phase):
+        if stream.tcp_info:
+            self.tcp_info.update(tcpinfo.summarize([stream.tcp_info],
+                                                   "tcp_%s_" % phase))
+            stream.tcp_info.reset()
+
     def complete(self, stream, speed, rtt, target_bytes):
         pass
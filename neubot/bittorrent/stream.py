@@ -25,6 +25,7 @@ import struct
 
 from neubot.bittorrent.config import MAXMESSAGE
 
+from neubot.net.poller import PRIORITY_HIGH
 from neubot.net.stream import Stream
 from neubot.log import LOG
 
@@ -70,6 +71,7 @@ class StreamBitTorrent(Stream):
     def __init__(self, poller):
         ''' Initialize BitTorrent stream '''
         Stream.__init__(self, poller)
+        self.priority = PRIORITY_HIGH
         self.complete = False
         self.got_anything = False
         # This is the size of the handshake
@@ -88,6 +90,9 @@ class StreamBitTorrent(Stream):
         #
         if self.parent.infohash:
             self._send_handshake()
+        self.recv_into = self.conf["net.stream.recv_into"]
+        # Stop reading REQUESTs when the peer does not read PIECEs
+        self.enable_backpressure()
         self.start_recv()
 
     def _send_handshake(self):
@@ -120,12 +125,14 @@ class StreamBitTorrent(Stream):
 
     def send_request(self, index, begin, length):
         ''' Send the REQUEST message '''
-        LOG.debug("> REQUEST %d %d %d" % (index, begin, length))
+        if LOG.is_debug():
+            LOG.debug("> REQUEST %d %d %d" % (index, begin, length))
         self._send_message(struct.pack("!cIII", REQUEST, index, begin, length))
 
     def send_cancel(self, index, begin, length):
         ''' Send the CANCEL message '''
-        LOG.debug("> CANCEL %d %d %d" % (index, begin, length))
+        if LOG.is_debug():
+            LOG.debug("> CANCEL %d %d %d" % (index, begin, length))
         self._send_message(struct.pack("!cIII", CANCEL, index, begin, length))
 
     def send_bitfield(self, bitfield):
@@ -135,7 +142,8 @@ class StreamBitTorrent(Stream):
 
     def send_have(self, index):
         ''' Send the HAVE message '''
-        LOG.debug("> HAVE %d" % index)
+        if LOG.is_debug():
+            LOG.debug("> HAVE %d" % index)
         self._send_message(struct.pack("!cI", HAVE, index))
 
     def send_keepalive(self):
@@ -145,7 +153,8 @@ class StreamBitTorrent(Stream):
 
     def send_piece(self, index, begin, block):
         ''' Send the PIECE message '''
-        LOG.debug("> PIECE %d %d len=%d" % (index, begin, len(block)))
+        if LOG.is_debug():
+            LOG.debug("> PIECE %d %d len=%d" % (index, begin, len(block)))
         self._send_message(struct.pack("!cII%ss" % len(block), PIECE,
           index, begin, block))
 
@@ -164,18 +173,22 @@ class StreamBitTorrent(Stream):
     # size left to read in the next message, self.count is the amount
     # of bytes we've read so far, and self.buff contains a portion
     # of the next message.
+    # We receive into pooled buffers, so s is usually a memoryview
+    # that is valid only until we return: we slice it without copying
+    # and we copy only the bytes that we keep in self.buff.
     #
     def recv_complete(self, s):
 
         ''' Invoked when recv() completes '''
 
+        s = memoryview(s)
         while s and not (self.close_pending or self.close_complete):
 
             # If we don't know the length then read it
             if self.left == 0:
                 amt = min(len(s), 4 - self.count)
-                self.buff.append(s[:amt])
-                s = buffer(s, amt)
+                self.buff.append(s[:amt].tobytes())
+                s = s[amt:]
                 self.count += amt
 
                 if self.count == 4:
@@ -193,8 +206,8 @@ class StreamBitTorrent(Stream):
             # Bufferize and pass upstream messages
             elif self.left > 0:
                 amt = min(len(s), self.left)
-                self.buff.append(s[:amt])
-                s = buffer(s, amt)
+                self.buff.append(s[:amt].tobytes())
+                s = s[amt:]
                 self.left -= amt
                 self.count += amt
 
@@ -210,9 +223,15 @@ class StreamBitTorrent(Stream):
             else:
                 raise RuntimeError("Invalid self.left")
 
-        if not (self.close_pending or self.close_complete):
+        # Don't read more requests while the peer is slow
+        if not (self.close_pending or self.close_complete or
+                self.send_throttled):
             self.start_recv()
 
+    def send_resumed(self):
+        ''' Invoked when the send queue is below the low watermark '''
+        self.start_recv()
+
     def _got_message(self, message):
 
         ''' Invoked when we receive a complete message '''
@@ -270,7 +289,8 @@ class StreamBitTorrent(Stream):
             i = struct.unpack("!xI", message)[0]
             if i >= self.parent.numpieces:
                 raise RuntimeError("HAVE: index out of bounds")
-            LOG.debug("< HAVE %d" % i)
+            if LOG.is_debug():
+                LOG.debug("< HAVE %d" % i)
             self.parent.got_have(i)
 
         elif t == BITFIELD:
@@ -279,14 +299,16 @@ class StreamBitTorrent(Stream):
 
         elif t == REQUEST:
             i, a, b = struct.unpack("!xIII", message)
-            LOG.debug("< REQUEST %d %d %d" % (i, a, b))
+            if LOG.is_debug():
+                LOG.debug("< REQUEST %d %d %d" % (i, a, b))
             if i >= self.parent.numpieces:
                 raise RuntimeError("REQUEST: index out of bounds")
             self.parent.got_request(self, i, a, b)
 
         elif t == CANCEL:
             i, a, b = struct.unpack("!xIII", message)
-            LOG.debug("< CANCEL %d %d %d" % (i, a, b))
+            if LOG.is_debug():
+                LOG.debug("< CANCEL %d %d %d" % (i, a, b))
             if i >= self.parent.numpieces:
                 raise RuntimeError("CANCEL: index out of bounds")
             # NOTE Ignore CANCEL message
@@ -294,7 +316,8 @@ class StreamBitTorrent(Stream):
         elif t == PIECE:
             n = len(message) - 9
             i, a, b = struct.unpack("!xII%ss" % n, message)
-            LOG.debug("< PIECE %d %d len=%d" % (i, a, n))
+            if LOG.is_debug():
+                LOG.debug("< PIECE %d %d len=%d" % (i, a, n))
             if i >= self.parent.numpieces:
                 raise RuntimeError("PIECE: index out of bounds")
             self.parent.got_piece(self, i, a, b)
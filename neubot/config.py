@@ -75,7 +75,8 @@ class ConfigDict(dict):
             ovalue = "(none)"
             cast = utils.smart_cast(value)
         value = cast(value)
-        LOG.debug("config: %s: %s -> %s" % (key, ovalue, value))
+        if LOG.is_debug():
+            LOG.debug("config: %s: %s -> %s" % (key, ovalue, value))
         dict.__setitem__(self, key, value)
 
     def update(self, *args, **kwds):
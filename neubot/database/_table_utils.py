@@ -218,13 +218,21 @@ def rename_column(connection, table, template, mapping):
     table = __check(table)
     otable = "old_%s" % table
 
+    #
+    # Old and new names must be in the same order, and we can't
+    # rely on the order of two different dictionaries, so we build
+    # the lists of names at the same time.
+    #
+    names, nnames = [], []
     ntemplate = {}
     for key, value in template.items():
+        names.append(key)
         if key in mapping:
             key = mapping[key]
+        nnames.append(key)
         ntemplate[key] = value
 
     connection.execute("ALTER TABLE %s RENAME TO %s" % (table, otable))
     connection.execute(make_create_table(table, ntemplate))
-    connection.execute(rename_column_query(otable, template, table, ntemplate))
+    connection.execute(rename_column_query(otable, names, table, nnames))
     connection.execute("DROP TABLE %s;" % otable)
@@ -43,6 +43,39 @@ if __name__ == '__main__':
 from neubot.marshal import unmarshal_object
 from neubot.database import _table_utils
 
+#
+# Bump MINOR version number because we've added to speedtest
+# and bittorrent tables the summary of the TCP_INFO samples
+# taken during the download and the upload phase (average rtt
+# and rttvar, maximum congestion window, retransmits, delivery
+# and pacing rate) and the description of the TCP tuning
+# profiles used during the test.
+#
+def migrate_from__v4_2__to__v4_3(connection):
+    """Migrate database from version 4.2 to version 4.3"""
+
+    cursor = connection.cursor()
+    cursor.execute("SELECT value FROM config WHERE name='version';")
+    ver = cursor.fetchone()[0]
+    if ver == "4.2":
+        logging.info("* Migrating database from version 4.2 to 4.3")
+        cursor.execute("""UPDATE config SET value='4.3'
+                        WHERE name='version';""")
+
+        for table in ("speedtest", "bittorrent"):
+            for phase in ("download", "upload"):
+                for column, sqltype in (("rtt", "REAL"), ("rttvar", "REAL"),
+                                        ("snd_cwnd", "INTEGER"),
+                                        ("retransmits", "INTEGER"),
+                                        ("delivery_rate", "REAL"),
+                                        ("pacing_rate", "REAL")):
+                    cursor.execute("ALTER TABLE %s ADD tcp_%s_%s %s;" %
+                                   (table, phase, column, sqltype))
+            cursor.execute("ALTER TABLE %s ADD tuning TEXT;" % table)
+
+        connection.commit()
+    cursor.close()
+
 #
 # Rename 'privacy.can_share' to 'privacy.can_publish', because
 # the latter is more explicit and clear.
@@ -283,6 +316,7 @@ MIGRATORS = [
     migrate_from__v3_0__to__v4_0,
     migrate_from__v4_0__to__v4_1,
     migrate_from__v4_1__to__v4_2,
+    migrate_from__v4_2__to__v4_3,
 ]
 
 def migrate(connection):
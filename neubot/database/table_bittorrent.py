@@ -47,6 +47,22 @@ TEMPLATE = {
 
     "neubot_version": "",
     "platform": "",
+
+    "tcp_download_rtt": 0.0,
+    "tcp_download_rttvar": 0.0,
+    "tcp_download_snd_cwnd": 0,
+    "tcp_download_retransmits": 0,
+    "tcp_download_delivery_rate": 0.0,
+    "tcp_download_pacing_rate": 0.0,
+
+    "tcp_upload_rtt": 0.0,
+    "tcp_upload_rttvar": 0.0,
+    "tcp_upload_snd_cwnd": 0,
+    "tcp_upload_retransmits": 0,
+    "tcp_upload_delivery_rate": 0.0,
+    "tcp_upload_pacing_rate": 0.0,
+
+    "tuning": "",
 }
 
 CREATE_TABLE = _table_utils.make_create_table("bittorrent", TEMPLATE)
@@ -27,6 +27,7 @@ import email.utils
 import collections
 import urlparse
 import socket
+import time
 import os
 
 from neubot.log import LOG
@@ -45,6 +46,35 @@ REDIRECT = '''\
 </HTML>
 '''
 
+#
+# We use all-lowercase header names, and we capitalize them before
+# sending them on the wire.  Since we send the same few names over
+# and over, we capitalize each name once and we keep the result
+# (interned) in this cache, up to CANONICAL_MAX names.
+#
+CANONICAL_MAX = 1024
+CANONICAL = {}
+
+def canonical(key):
+    ''' Return the canonical (capitalized) version of a header name '''
+    value = CANONICAL.get(key)
+    if value is None:
+        value = intern("-".join([s.capitalize() for s in key.split("-")]))
+        if len(CANONICAL) < CANONICAL_MAX:
+            CANONICAL[key] = value
+    return value
+
+# The Date header changes once per second
+_DATE = [None, ""]
+
+def formatdate():
+    ''' Return the current date in the format of the Date header '''
+    now = int(time.time())
+    if now != _DATE[0]:
+        _DATE[0] = now
+        _DATE[1] = email.utils.formatdate(now, usegmt=True)
+    return _DATE[1]
+
 def urlsplit(uri):
     ''' Wrapper for urlparse.urlsplit() '''
     scheme, netloc, path, query, fragment = urlparse.urlsplit(uri)
@@ -100,45 +130,27 @@ class Message(object):
     #
     def serialize_headers(self):
         ''' Serialize message headers '''
-        vector = []
-
         if self.method:
-            vector.append(self.method)
-            vector.append(" ")
-            if self.pathquery:
-                vector.append(self.pathquery)
-            elif self.uri:
-                vector.append(self.uri)
-            else:
-                vector.append("/")
-            vector.append(" ")
-            vector.append(self.protocol)
-
+            vector = [self.method, " ", self.pathquery or self.uri or "/",
+                      " ", self.protocol, "\r\n"]
         else:
-            vector.append(self.protocol)
-            vector.append(" ")
-            vector.append(self.code)
-            vector.append(" ")
-            vector.append(self.reason)
+            vector = [self.protocol, " ", self.code, " ", self.reason,
+                      "\r\n"]
 
-        LOG.debug("> %s" % ("".join(vector)))
-        vector.append("\r\n")
-
-        for key, value in self.headers.items():
-            key = "-".join(map(lambda s: s.capitalize(), key.split("-")))
-            vector.append(key)
+        for key, value in self.headers.iteritems():
+            vector.append(canonical(key))
             vector.append(": ")
             vector.append(value)
-
-            LOG.debug("> %s: %s" % (key, value))
             vector.append("\r\n")
-
-        LOG.debug(">")
         vector.append("\r\n")
 
-        string = "".join(vector)
-        string = utils.stringify(string)
-        return StringIO.StringIO(string)
+        string = utils.stringify("".join(vector))
+
+        if LOG.is_debug():
+            for line in string.split("\r\n")[:-1]:
+                LOG.debug("> %s" % line)
+
+        return string
 
     def serialize_body(self):
         ''' Serialize message body '''
@@ -213,7 +225,7 @@ class Message(object):
             self["cache-control"] = "no-cache"
 
         if kwargs.get("date", True):
-            self["date"] = email.utils.formatdate(usegmt=True)
+            self["date"] = formatdate()
 
         if not kwargs.get("keepalive", True):
             self["connection"] = "close"
@@ -270,6 +282,9 @@ class Message(object):
 
     def prettyprintbody(self, prefix):
         ''' Pretty print body '''
+        # Don't decode and encode the body just to discard it
+        if not LOG.is_debug():
+            return
         if self["content-type"] not in ("application/json", "text/xml",
                                         "application/xml"):
             return
@@ -32,6 +32,9 @@ PROTOCOLS = [ "HTTP/1.0", "HTTP/1.1" ]
 # Maximum allowed line length
 MAXLINE = 1 << 15
 
+# Maximum allowed length of the first line plus headers
+MAXHEADERS = 1 << 17
+
 # Possible states of the receiver
 (IDLE, BOUNDED, UNBOUNDED, CHUNK, CHUNK_END, FIRSTLINE,
  HEADER, CHUNK_LENGTH, TRAILER, ERROR) = range(0,10)
@@ -40,13 +43,6 @@ MAXLINE = 1 << 15
 STATES = ["IDLE", "BOUNDED", "UNBOUNDED", "CHUNK", "CHUNK_END", "FIRSTLINE",
           "HEADER", "CHUNK_LENGTH", "TRAILER", "ERROR"]
 
-#
-# When messages are not bigger than SMALLMESSAGE we join headers
-# and body in a single buffer and we send that buffer.  If the buffer
-# happens to be very small, it might fit a single L2 packet.
-#
-SMALLMESSAGE = 8000
-
 class StreamHTTP(Stream):
 
     '''
@@ -58,12 +54,14 @@ class StreamHTTP(Stream):
     def __init__(self, poller):
         ''' Initialize the stream '''
         Stream.__init__(self, poller)
-        self.incoming = []
+        self.incoming = bytearray()
+        self.scanned = 0
         self.state = FIRSTLINE
         self.left = 0
 
     def connection_made(self):
         ''' Called when the connection is created '''
+        self.recv_into = self.conf["net.stream.recv_into"]
         self.start_recv()
 
     # Close
@@ -77,65 +75,76 @@ class StreamHTTP(Stream):
 
     # Send
 
-    def send_message(self, message, smallmessage=SMALLMESSAGE):
+    def send_message(self, message):
         ''' Send a message '''
-        if message.length >= 0 and message.length <= smallmessage:
-            vector = []
-            vector.append(message.serialize_headers().read())
-            body = message.serialize_body()
-            if not isinstance(body, basestring):
-                vector.append(body.read())
-            else:
-                vector.append(body)
-            data = "".join(vector)
-            self.start_send(data)
-        else:
-            self.start_send(message.serialize_headers())
-            self.start_send(message.serialize_body())
+        #
+        # The send path gathers headers and body into a single
+        # send, so a small message might fit a single L2 packet.
+        #
+        self.start_send(message.serialize_headers())
+        self.start_send(message.serialize_body())
 
     # Recv
 
+    #
+    # An incomplete header block (or line) waits in self.incoming,
+    # which grows in place, and we scan only the bytes we have not
+    # scanned yet for its end, so that headers split into many small
+    # segments cost linear time.  The whole header block is parsed
+    # in a single pass once its end is available.
+    # We receive into pooled buffers, so data is usually a memoryview
+    # that is valid only until we return, and we must copy what we
+    # keep.  Body pieces are copied out of it, because the bodies can't
+    # take a memoryview (StringIO would write its repr()), while we
+    # copy the rest of the data only when it contains headers or
+    # lines, which we parse as a string.  When data is a string, body
+    # pieces are buffer() slices of it, i.e. they are not copied.
+    #
     def recv_complete(self, data):
         ''' We've received successfully some data '''
         if self.close_complete or self.close_pending:
             return
 
-        #This one should be debug2 as well
-        #LOG.debug("HTTP receiver: got %d bytes" % len(data))
-
-        # merge with previous fragments (if any)
         if self.incoming:
-            self.incoming.append(data)
-            data = "".join(self.incoming)
+            self.incoming += data
+            if self._find_end(self.incoming, self.scanned) == -1:
+                self._check_incoming()
+                self.start_recv()
+                return
+            data = str(self.incoming)
             del self.incoming[:]
+            self.scanned = 0
+        view = isinstance(data, memoryview)
 
         # consume the current fragment
         offset = 0
         length = len(data)
-        while length > 0:
-            #ostate = self.state        # needed by commented-out code below
+        while offset < length:
 
             # when we know the length we're looking for a piece
             if self.left > 0:
-                count = min(self.left, length)
-                piece = buffer(data, offset, count)
+                count = min(self.left, length - offset)
+                if view:
+                    piece = data[offset:offset + count].tobytes()
+                else:
+                    piece = buffer(data, offset, count)
                 self.left -= count
                 offset += count
-                length -= count
                 self._got_piece(piece)
 
-            # otherwise we're looking for the next line
+            # otherwise we're looking for the next header block or line
             elif self.left == 0:
-                index = data.find("\n", offset)
+                if view:
+                    data, view = data[offset:].tobytes(), False
+                    offset, length = 0, len(data)
+                index = self._find_end(data, offset)
                 if index == -1:
-                    if length > MAXLINE:
-                        raise RuntimeError("Line too long")
                     break
-                index = index + 1
-                line = data[offset:index]
-                length -= (index - offset)
+                if self.state == FIRSTLINE:
+                    self._got_headers(data[offset:index])
+                else:
+                    self._got_line(data[offset:index])
                 offset = index
-                self._got_line(line)
 
             # robustness
             else:
@@ -145,43 +154,97 @@ class StreamHTTP(Stream):
             if self.close_complete or self.close_pending:
                 return
 
-#           Should be debug2() not debug()
-#           LOG.debug("HTTP receiver: %s -> %s" %
-#             (STATES[ostate], STATES[self.state]))
-
         # keep the eventual remainder for later
-        if length > 0:
-            remainder = data[offset:]
-            self.incoming.append(remainder)
-            LOG.debug("HTTP receiver: remainder %d" % len(remainder))
+        if offset < length:
+            if view:
+                self.incoming += data[offset:]
+            else:
+                self.incoming += buffer(data, offset)
+            self._check_incoming()
 
         # get the next fragment
         self.start_recv()
 
-    def _got_line(self, line):
-        ''' We've got a line... what do we do? '''
+    def _find_end(self, data, offset):
+        ''' Return the end of the next header block (or line) '''
         if self.state == FIRSTLINE:
-            line = line.strip()
+            return _find_end_of_headers(data, offset)
+        index = data.find("\n", offset)
+        if index >= 0:
+            index += 1
+        return index
+
+    def _check_incoming(self):
+        ''' Make sure the incomplete data is not too long '''
+        # The end of headers may straddle the next segment
+        self.scanned = max(len(self.incoming) - 2, 0)
+        if self.state == FIRSTLINE:
+            if len(self.incoming) > MAXHEADERS:
+                raise RuntimeError("Headers too long")
+        elif len(self.incoming) > MAXLINE:
+            raise RuntimeError("Line too long")
+
+    def _got_headers(self, block):
+        ''' We've got the first line and the headers '''
+        # The last two lines are the empty line and ""
+        lines = block.split("\n")
+        self._got_first_line(lines[0])
+        debug = LOG.is_debug()
+        for line in lines[1:-2]:
+            if self.close_complete or self.close_pending:
+                return
+            if debug:
+                LOG.debug("< %s" % line)
+            # not handling mime folding
+            key, colon, value = line.partition(":")
+            if not colon:
+                raise RuntimeError("Invalid header line")
+            self.got_header(key.strip(), value.strip())
+        if self.close_complete or self.close_pending:
+            return
+        self._got_end_of_headers()
+
+    def _got_first_line(self, line):
+        ''' We've got the first line '''
+        line = line.strip()
+        if LOG.is_debug():
             LOG.debug("< %s" % line)
-            vector = line.split(None, 2)
-            if len(vector) == 3:
-                if line.startswith("HTTP"):
-                    protocol, code, reason = vector
-                    if protocol in PROTOCOLS:
-                        self.got_response_line(protocol, code, reason)
-                else:
-                    method, uri, protocol = vector
-                    if protocol in PROTOCOLS:
-                        self.got_request_line(method, uri, protocol)
-                if protocol not in PROTOCOLS:
-                    raise RuntimeError("Invalid protocol")
-                else:
-                    self.state = HEADER
+        vector = line.split(None, 2)
+        if len(vector) == 3:
+            if line.startswith("HTTP"):
+                protocol, code, reason = vector
+                if protocol in PROTOCOLS:
+                    self.got_response_line(protocol, code, reason)
+            else:
+                method, uri, protocol = vector
+                if protocol in PROTOCOLS:
+                    self.got_request_line(method, uri, protocol)
+            if protocol not in PROTOCOLS:
+                raise RuntimeError("Invalid protocol")
             else:
-                raise RuntimeError("Invalid first line")
+                self.state = HEADER
+        else:
+            raise RuntimeError("Invalid first line")
+
+    def _got_end_of_headers(self):
+        ''' We've got the empty line after headers '''
+        LOG.debug("<")
+        self.state, self.left = self.got_end_of_headers()
+        if self.state == ERROR:
+            # allow upstream to filter out unwanted requests
+            self.close()
+        elif self.state == FIRSTLINE:
+            # this is the case of an empty body
+            self.got_end_of_body()
+
+    def _got_line(self, line):
+        ''' We've got a line... what do we do? '''
+        if self.state == FIRSTLINE:
+            self._got_first_line(line)
         elif self.state == HEADER:
             if line.strip():
-                LOG.debug("< %s" % line)
+                if LOG.is_debug():
+                    LOG.debug("< %s" % line)
                 # not handling mime folding
                 index = line.find(":")
                 if index >= 0:
@@ -190,14 +253,7 @@ class StreamHTTP(Stream):
                 else:
                     raise RuntimeError("Invalid header line")
             else:
-                LOG.debug("<")
-                self.state, self.left = self.got_end_of_headers()
-                if self.state == ERROR:
-                    # allow upstream to filter out unwanted requests
-                    self.close()
-                elif self.state == FIRSTLINE:
-                    # this is the case of an empty body
-                    self.got_end_of_body()
+                self._got_end_of_headers()
         elif self.state == CHUNK_LENGTH:
             vector = line.split()
             if vector:
@@ -286,6 +342,19 @@ class StreamHTTP(Stream):
 #    length."
 #
 
+def _find_end_of_headers(data, offset):
+    ''' Return the offset after the empty line that ends headers '''
+    index = data.find("\n\r\n", offset)
+    if index == -1:
+        index = data.find("\n\n", offset)
+        if index == -1:
+            return -1
+        return index + 2
+    other = data.find("\n\n", offset, index)
+    if other != -1:
+        return other + 2
+    return index + 3
+
 def _parselength(message):
     ''' Return next state depending on content-length '''
     value = message["content-length"]
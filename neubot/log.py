@@ -24,7 +24,7 @@ import sys
 import logging
 import traceback
 
-from neubot.net.poller import POLLER
+from neubot.net.poller import current_poller
 
 from neubot.database import DATABASE
 from neubot.database import table_log
@@ -73,8 +73,11 @@ class Logger(object):
         self._nocommit = NOCOMMIT
         self._use_database = False
         self._queue = []
+        self._poller = None
+        self._task = None
 
         self.streams = set()
+        self.dropped = {}
 
     #
     # Better not to touch the database when a test is in
@@ -85,7 +88,7 @@ class Logger(object):
     #
     def _maintain_database(self, *args, **kwargs):
 
-        POLLER.sched(INTERVAL, self._maintain_database)
+        self._task = self._poller.sched(INTERVAL, self._maintain_database)
 
         if (self._use_database and not NOTIFIER.is_subscribed("testdone")):
             self._writeback()
@@ -93,9 +96,16 @@ class Logger(object):
     #
     # We don't want to log into the database when we run
     # the server side or when we run from command line.
+    # The database maintenance runs in the context of the
+    # given poller, or of the poller of the current thread.
     #
-    def use_database(self):
-        POLLER.sched(INTERVAL, self._maintain_database)
+    def use_database(self, poller=None):
+        if not poller:
+            poller = current_poller()
+        if self._task:
+            self._task.cancel()
+        self._poller = poller
+        self._task = poller.sched(INTERVAL, self._maintain_database)
         self._use_database = True
 
     def verbose(self):
@@ -110,6 +120,7 @@ class Logger(object):
 
     def start_streaming(self, stream):
         ''' Attach stream to log messages '''
+        stream.enable_backpressure()
         self.streams.add(stream)
 
     def stop_streaming(self):
@@ -117,6 +128,7 @@ class Logger(object):
         for stream in self.streams:
             stream.poller.close(stream)
         self.streams.clear()
+        self.dropped.clear()
 
     #
     # Below there is convenience code for printing the beginning
@@ -172,8 +184,20 @@ class Logger(object):
     def info(self, message, *args):
         self._log("INFO", message, *args)
 
+    #
+    # DEBUG messages are discarded unless we are verbose or we
+    # are streaming logs, so debug() returns immediately in the
+    # common case.  Still, the caller pays for formatting the
+    # message, so hot paths should either pass arguments, which
+    # are formatted lazily, or check is_debug() first.
+    #
     def debug(self, message, *args):
-        self._log("DEBUG", message, *args)
+        if self.noisy or self.streams:
+            self._log("DEBUG", message, *args)
+
+    def is_debug(self):
+        ''' Returns True if DEBUG messages are not discarded '''
+        return self.noisy or bool(self.streams)
 
     def log_access(self, message, *args):
         #
@@ -231,6 +255,11 @@ class Logger(object):
         # Err, of course passing ACCESS logs down the stream
         # is pointless for a client that wants to follow a
         # remote test.
+        # Log lines are not essential, so we drop them when a
+        # stream is throttled, i.e. the client is too slow, and
+        # we tell the client how many lines it missed once the
+        # stream is not throttled anymore.
+        # We forget the streams that the client has closed.
         #
         if self.streams:
             # "Lazy" processing
@@ -242,7 +271,19 @@ class Logger(object):
                 if severity != 'ACCESS':
                     logline = "%s %s\r\n" % (severity, message)
                     logline = logline.encode("utf-8")
-                    for stream in self.streams:
+                    for stream in list(self.streams):
+                        if stream.close_complete or stream.close_pending:
+                            self.streams.discard(stream)
+                            self.dropped.pop(stream, None)
+                            continue
+                        if stream.send_throttled:
+                            self.dropped[stream] = (self.dropped.get(
+                                                    stream, 0) + 1)
+                            continue
+                        dropped = self.dropped.pop(stream, 0)
+                        if dropped:
+                            stream.start_send("WARNING log: dropped %d "
+                                              "lines\r\n" % dropped)
                         stream.start_send(logline)
             except (KeyboardInterrupt, SystemExit):
                 raise
@@ -37,6 +37,7 @@ if __name__ == "__main__":
 from neubot.config import CONFIG
 from neubot.database import DATABASE
 from neubot.log import LOG
+from neubot.net.poller import POLLER
 
 VERSION = "0.4.6-rc3"
 
@@ -57,10 +58,22 @@ Options:
 
 ''' % locals())
 
+CONFIG.register_defaults({
+    "net.poller.backend": "auto",
+    "net.poller.low_budget": 8,
+    "net.poller.stall_threshold": 0.1,
+})
+
 def main(name, descr, args):
     Eflag = False
     lflag = False
 
+    CONFIG.register_descriptions({
+        "net.poller.backend": "Set poller backend (auto, epoll, poll, select)",
+        "net.poller.low_budget": "Max low-priority events per loop iteration",
+        "net.poller.stall_threshold": "Log loop iterations slower than this",
+    })
+
     try:
         options, arguments = getopt.getopt(args[1:], "D:Ef:lVv", ["help"])
     except getopt.GetoptError:
@@ -101,6 +114,14 @@ def main(name, descr, args):
         CONFIG.print_descriptions(sys.stdout)
         sys.exit(0)
 
+    try:
+        POLLER.set_backend(CONFIG["net.poller.backend"])
+    except ValueError, error:
+        sys.stderr.write("%s\n" % error)
+        sys.exit(1)
+    POLLER.low_budget = CONFIG["net.poller.low_budget"]
+    POLLER.stats.stall_threshold = CONFIG["net.poller.stall_threshold"]
+
 if __name__ == "__main__":
     main("common.main", "Common main() for all Neubot commands", sys.argv)
     CONFIG.store_fp(sys.stdout)
@@ -0,0 +1,216 @@
+# neubot/net/aiopoller.py
+
+#
+# Copyright (c) 2012 Simone Basso <bassosimone@gmail.com>,
+#  NEXA Center for Internet & Society at Politecnico di Torino
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Poller that runs on top of an asyncio event loop, so that
+# Stream, Connector and Listener can share the loop of a larger
+# asyncio application (or of uvloop) without modifications.
+# With Python 2 we need trollius, the backport of asyncio.
+#
+
+import heapq
+
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
+
+from neubot.net.poller import Poller
+from neubot.net.poller import _CURRENT
+from neubot.utils import ticks
+
+#
+# The asyncio loop monitors the file descriptors and invokes the
+# poller dispatch code directly, so wait() is never called.  Note
+# that this means that stream priorities and the low-priority budget
+# are not enforced: events are serviced in asyncio order.
+#
+class AsyncioBackend(object):
+
+    name = "asyncio"
+
+    def __init__(self, poller):
+        self.poller = poller
+        self.masks = {}
+
+    #
+    # Like the poll() backend, we forget the file descriptors
+    # that the loop refuses, e.g. because they were closed before
+    # we had the chance to unregister them.  When we fail halfway,
+    # e.g. add_writer() fails after add_reader() succeeded, we also
+    # undo what the loop did accept, so that the loop does not keep
+    # a callback for a file descriptor we don't know anymore.
+    #
+    def modify(self, fileno, readable, writable):
+        aioloop = self.poller.aioloop
+        oldr, oldw = self.masks.get(fileno, (False, False))
+        try:
+            if readable and not oldr:
+                aioloop.add_reader(fileno, self.poller._call_handle_read,
+                                   fileno)
+            elif oldr and not readable:
+                aioloop.remove_reader(fileno)
+            if writable and not oldw:
+                aioloop.add_writer(fileno, self.poller._call_handle_write,
+                                   fileno)
+            elif oldw and not writable:
+                aioloop.remove_writer(fileno)
+        except (IOError, OSError, ValueError, KeyError):
+            self._forget(fileno)
+            return
+        if readable or writable:
+            self.masks[fileno] = (readable, writable)
+        else:
+            self.masks.pop(fileno, None)
+
+    def _forget(self, fileno):
+        aioloop = self.poller.aioloop
+        for remove in (aioloop.remove_reader, aioloop.remove_writer):
+            try:
+                remove(fileno)
+            except (IOError, OSError, ValueError, KeyError):
+                pass
+        self.masks.pop(fileno, None)
+
+    def close(self):
+        for fileno in list(self.masks):
+            self.modify(fileno, False, False)
+
+    def wait(self, timeout):
+        raise RuntimeError("The asyncio loop waits for I/O")
+
+class AsyncioPoller(Poller):
+
+    def __init__(self, select_timeout=1, aioloop=None):
+        if not asyncio:
+            raise RuntimeError("asyncio is not available")
+        if not aioloop:
+            aioloop = asyncio.get_event_loop()
+        self.aioloop = aioloop
+        self.timer = None
+        self.done = None
+        self.forever = False
+        Poller.__init__(self, select_timeout, "select")
+        self.backend.close()
+        self.backend = AsyncioBackend(self)
+
+    def set_backend(self, name):
+        raise ValueError("Cannot change the backend of an asyncio poller")
+
+    #
+    # Tasks are kept in the same heap of the ordinary poller, and
+    # a single asyncio timer is armed for the task at its head.  If
+    # the timer fires slightly early, because asyncio uses its own
+    # clock, no task is run and the timer is armed again.
+    #
+
+    def sched(self, delta, func):
+        task = Poller.sched(self, delta, func)
+        if self.tasks[0] is task:
+            self._arm()
+        return task
+
+    def _arm(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        while self.tasks and self.tasks[0].cancelled:
+            heapq.heappop(self.tasks)
+        if self.tasks:
+            self.timer = self.aioloop.call_later(max(0,
+              self.tasks[0].time - ticks()), self._fire)
+
+    def _fire(self):
+        self.timer = None
+        self._iteration(self._run_tasks)
+        self._arm()
+
+    #
+    # Other threads post functions to the asyncio loop, which is
+    # already thread safe, so we don't need a waker.
+    #
+
+    def enable_post(self):
+        pass
+
+    def post(self, func):
+        self.aioloop.call_soon_threadsafe(self._iteration, func)
+
+    #
+    # loop() and loop_forever() are here for the cases in which
+    # neubot owns the asyncio loop.  When neubot is embedded into
+    # an asyncio application there is no need to call them, because
+    # streams make progress while the application runs its loop.
+    #
+
+    def _call_handle_read(self, fileno):
+        self._iteration(Poller._call_handle_read, self, fileno)
+
+    def _call_handle_write(self, fileno):
+        self._iteration(Poller._call_handle_write, self, fileno)
+
+    #
+    # Each callback invoked by the asyncio loop counts as one
+    # iteration of the ordinary poller, so that the loop stats
+    # and the stall detection keep working.  We never wait for
+    # I/O within an iteration, so it is all busy time.
+    #
+    def _iteration(self, func, *args):
+        self.stats.begin_iteration()
+        try:
+            func(*args)
+        finally:
+            self.stats.end_iteration()
+            self._maybe_done()
+
+    def break_loop(self):
+        Poller.break_loop(self)
+        self._maybe_done()
+
+    def _maybe_done(self):
+        if self.done and not self.done.done():
+            if not self.again or (not self.forever and
+                                  not self._has_streams()):
+                self.done.set_result(None)
+
+    def _run(self, forever):
+        previous = getattr(_CURRENT, "poller", None)
+        _CURRENT.poller = self
+        self.forever = forever
+        self.done = asyncio.Future(loop=self.aioloop)
+        try:
+            self._maybe_done()
+            self.aioloop.run_until_complete(self.done)
+        finally:
+            self.done = None
+            _CURRENT.poller = previous
+
+    def loop(self):
+        if self.again and self._has_streams():
+            self._run(False)
+
+    def loop_forever(self):
+        if self.again:
+            self._run(True)
@@ -0,0 +1,199 @@
+# neubot/net/benchmark.py
+
+#
+# Copyright (c) 2012 Simone Basso <bassosimone@gmail.com>,
+#  NEXA Center for Internet & Society at Politecnico di Torino
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+''' Bulk transfer benchmark for `neubot stream` '''
+
+#
+# A run starts when the first connection is made and ends when
+# the last one is closed.  During the run we periodically print
+# the throughput of each connection and the aggregate one, and
+# at the end we print (and optionally save as JSON) a summary
+# that includes the CPU time per GB and the number of I/O calls
+# per MB, so that we can track the cost of our event loop from
+# release to release.  Throughput counts the bytes sent and the
+# bytes received, so echo moves twice the bytes it receives.
+#
+
+import os
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from neubot.compat import json
+from neubot.log import LOG
+from neubot import utils
+
+# Percentiles of the per-connection throughput in the summary
+PERCENTILES = (0, 10, 50, 90, 99, 100)
+
+def cpu_times():
+    ''' Return the user and system CPU time of this process '''
+    if resource:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime, usage.ru_stime
+    times = os.times()
+    return times[0], times[1]
+
+def percentile(vector, pct):
+    ''' Nearest-rank percentile of a sorted vector '''
+    if not vector:
+        return 0.0
+    index = int(round(pct / 100.0 * (len(vector) - 1)))
+    return vector[index]
+
+def _moved(stream):
+    ''' Number of bytes moved by @stream '''
+    return stream.bytes_sent_tot + stream.bytes_recv_tot
+
+class Benchmark(object):
+
+    ''' Measures the throughput and the cost of a bulk transfer '''
+
+    def __init__(self, poller, interval, path=""):
+        ''' Initialize the benchmark '''
+        self.poller = poller
+        self.interval = interval
+        self.path = path
+        self.active = {}
+        self.done = []
+        self.task = None
+        self.begin = 0.0
+        self.last = 0.0
+        self.cpu = (0.0, 0.0)
+        self.iterations = 0
+        self.summaries = []
+
+    def add(self, stream):
+        ''' Start measuring @stream '''
+        now = utils.ticks()
+        if not self.active:
+            self._start(now)
+        self.active[stream] = [now, _moved(stream), len(self.done) +
+                               len(self.active)]
+
+    def remove(self, stream):
+        ''' Stop measuring @stream '''
+        entry = self.active.pop(stream, None)
+        if entry is None:
+            return
+        begin, _, number = entry
+        elapsed = max(utils.ticks() - begin, 1e-06)
+        self.done.append({
+                          "connection": number,
+                          "bytes_sent": stream.bytes_sent_tot,
+                          "bytes_recv": stream.bytes_recv_tot,
+                          "io_calls": stream.io_calls,
+                          "elapsed": elapsed,
+                          "throughput": _moved(stream) / elapsed,
+                         })
+        if not self.active:
+            self._finish()
+
+    def _start(self, now):
+        ''' A new run begins '''
+        self.begin = self.last = now
+        self.cpu = cpu_times()
+        self.iterations = self.poller.stats.iterations
+        self.done = []
+        if self.interval > 0:
+            self.task = self.poller.sched(self.interval, self._report)
+
+    def _report(self, *args, **kwargs):
+        ''' Print periodic throughput '''
+        self.task = self.poller.sched(self.interval, self._report)
+        now = utils.ticks()
+        elapsed = max(now - self.last, 1e-06)
+        self.last = now
+        total = 0
+        for stream, entry in sorted(self.active.items(),
+                                    key=lambda item: item[1][2]):
+            moved = _moved(stream)
+            delta, entry[1] = moved - entry[1], moved
+            total += delta
+            LOG.info("stream: %.1f s: conn %d: %s" % (now - self.begin,
+                     entry[2], utils.speed_formatter(delta / elapsed)))
+        LOG.info("stream: %.1f s: aggregate (%d conns): %s" % (now -
+                 self.begin, len(self.active),
+                 utils.speed_formatter(total / elapsed)))
+
+    def _finish(self):
+        ''' The run is over: print and save the summary '''
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        summary = self.summarize()
+        self.summaries.append(summary)
+        LOG.info("stream: %d conns, %d bytes in %.2f s: %s, CPU %.2f s/GB,"
+                 " %.1f syscalls/MB" % (summary["connections"],
+                 summary["bytes"], summary["elapsed"],
+                 utils.speed_formatter(summary["throughput"]),
+                 summary["cpu_per_gb"], summary["syscalls_per_mb"]))
+        LOG.info("stream: per-conn throughput: %s" % ", ".join(
+                 "p%d %s" % (pct, utils.speed_formatter(summary[
+                 "throughput_percentiles"]["p%d" % pct]))
+                 for pct in PERCENTILES))
+        if self.path:
+            self._save(summary)
+
+    def summarize(self):
+        ''' Return the summary of the current run '''
+        elapsed = max(utils.ticks() - self.begin, 1e-06)
+        user, system = cpu_times()
+        user, system = user - self.cpu[0], system - self.cpu[1]
+        total = sum(entry["bytes_sent"] + entry["bytes_recv"]
+                    for entry in self.done)
+        io_calls = sum(entry["io_calls"] for entry in self.done)
+        iterations = self.poller.stats.iterations - self.iterations
+        throughputs = sorted(entry["throughput"] for entry in self.done)
+        gigabytes = max(total / 1e09, 1e-09)
+        megabytes = max(total / 1e06, 1e-06)
+        return {
+                "connections": len(self.done),
+                "elapsed": elapsed,
+                "bytes": total,
+                "throughput": total / elapsed,
+                "cpu_user": user,
+                "cpu_system": system,
+                "cpu_per_gb": (user + system) / gigabytes,
+                "io_calls": io_calls,
+                "poller_iterations": iterations,
+                "syscalls_per_mb": (io_calls + iterations) / megabytes,
+                "throughput_percentiles": dict(("p%d" % pct,
+                  percentile(throughputs, pct)) for pct in PERCENTILES),
+                "per_connection": sorted(self.done,
+                  key=lambda entry: entry["connection"]),
+               }
+
+    def _save(self, summary):
+        ''' Write the summary as JSON '''
+        if self.path == "-":
+            print json.dumps(summary, indent=4, sort_keys=True)
+            return
+        try:
+            filep = open(self.path, "w")
+            json.dump(summary, filep, indent=4, sort_keys=True)
+            filep.write("\n")
+            filep.close()
+        except IOError, exception:
+            LOG.error("stream: cannot save summary: %s" % exception)
@@ -20,24 +20,204 @@
 # along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import Queue
+import asyncore
+import collections
+import logging
 import socket
-from neubot import utils
+import sys
+import threading
 
-DNS_CACHE = {}
-DNS_TIMEOUT = 5
+from neubot import utils
 
 #
 # Cache recent lookups so that DNS lookup has no effect
 # on the measured RTT when we connect() more than one socket
-# at once, i.e. in speedtest.
+# at once, i.e. in speedtest.  Failures are cached too, for
+# a shorter time, so that a name that does not resolve does
+# not cost a lookup each time.  We don't know the real TTL,
+# because getaddrinfo() does not tell us, so we use a fixed
+# one.  The cache is ordered by last use and, when it is full,
+# we evict the least recently used entries.
+# Each entry maps the arguments of getaddrinfo() to a tuple
+# like (exception, addrinfo, expire).
+#
+DNS_CACHE = collections.OrderedDict()
+DNS_TIMEOUT = 60
+DNS_NEGATIVE_TIMEOUT = 10
+DNS_CACHE_SIZE = 256
+DNS_THREADS = 4
+
+_LOCK = threading.Lock()
+
+def _lookup(key):
+    _LOCK.acquire()
+    try:
+        entry = DNS_CACHE.pop(key, None)
+        if entry and entry[2] > utils.ticks():
+            DNS_CACHE[key] = entry
+            return entry
+        return None
+    finally:
+        _LOCK.release()
+
+def _store(key, exception, addrinfo):
+    if exception:
+        timeout = DNS_NEGATIVE_TIMEOUT
+    else:
+        timeout = DNS_TIMEOUT
+    entry = (exception, addrinfo, utils.ticks() + timeout)
+    _LOCK.acquire()
+    try:
+        DNS_CACHE.pop(key, None)
+        DNS_CACHE[key] = entry
+        while len(DNS_CACHE) > DNS_CACHE_SIZE:
+            DNS_CACHE.popitem(last=False)
+    finally:
+        _LOCK.release()
+    return entry
+
+def _resolve(key):
+    try:
+        return _store(key, None, socket.getaddrinfo(*key))
+    except socket.error, exception:
+        return _store(key, exception, None)
+
+#
+# Numeric addresses and the wildcard address don't need
+# to query the DNS, so we resolve them immediately.
+#
+def _resolve_local(key):
+    address, port, family, socktype, proto, flags = key
+    if not address:
+        return _resolve(key)
+    try:
+        return (None, socket.getaddrinfo(address, port, family, socktype,
+                  proto, flags|socket.AI_NUMERICHOST), 0)
+    except socket.error:
+        return None
+
 #
+# The family we pass to getaddrinfo() when connecting.  Whoever
+# warms up the cache must use the same family of the connector,
+# otherwise the key differs and the prefetched entry is not used.
+#
+def connect_family(conf):
+    if conf.get("net.stream.ipv6", False):
+        return socket.AF_INET6
+    if conf.get("net.stream.happy_eyeballs", False):
+        return socket.AF_UNSPEC
+    return socket.AF_INET
+
 def getaddrinfo(address, port, family=0, socktype=0, proto=0, flags=0):
-    now = utils.ticks()
-    if address in DNS_CACHE:
-        addrinfo, ticks = DNS_CACHE[(address, port)]
-        if now - ticks <= DNS_TIMEOUT:
-            return addrinfo
-    addrinfo = socket.getaddrinfo(address, port, family,
-                                  socktype, proto, flags)
-    DNS_CACHE[(address, port)] = (addrinfo, now)
-    return addrinfo
+    key = (address, port, family, socktype, proto, flags)
+    entry = _lookup(key) or _resolve_local(key) or _resolve(key)
+    if entry[0]:
+        raise entry[0]
+    return entry[1]
+
+#
+# Resolve names without blocking the poller loop.  The lookups
+# run in a small pool of threads and the result is posted back
+# to the poller that asked for it, so that the callback runs in
+# the context of the poller thread.  Concurrent lookups of the
+# same name share the same query.  The callback is invoked like
+# callback(exception, addrinfo), and it is invoked immediately
+# when the result is cached or no query is needed.
+#
+class Resolver(object):
+
+    def __init__(self, threads=DNS_THREADS):
+        self.threads = threads
+        self.workers = []
+        self.queue = Queue.Queue()
+        self.pending = {}
+
+    def resolve(self, poller, callback, address, port, family=0,
+                socktype=0, proto=0, flags=0):
+        key = (address, port, family, socktype, proto, flags)
+        entry = _lookup(key) or _resolve_local(key)
+        if entry:
+            callback(entry[0], entry[1])
+            return
+
+        # Make sure the loop does not exit while we're waiting
+        poller.enable_post()
+        poller.outstanding += 1
+
+        _LOCK.acquire()
+        try:
+            if key not in self.pending:
+                self.pending[key] = []
+                self.queue.put(key)
+            self.pending[key].append((poller, callback))
+            while len(self.workers) < self.threads:
+                worker = threading.Thread(target=self._work,
+                  name="resolver-%d" % len(self.workers))
+                worker.daemon = True
+                worker.start()
+                self.workers.append(worker)
+        finally:
+            _LOCK.release()
+
+    #
+    # Threads don't survive fork(), so the child must forget
+    # the workers and the pending lookups of the parent.
+    #
+    def after_fork(self):
+        global _LOCK
+        _LOCK = threading.Lock()
+        self.workers = []
+        self.queue = Queue.Queue()
+        self.pending = {}
+
+    #
+    # getaddrinfo() may raise more than socket.error, e.g. it
+    # raises UnicodeError for certain bad names.  Whatever goes
+    # wrong we must deliver a result, otherwise the worker dies
+    # and the waiters and the poller wait forever.
+    #
+    def _work(self):
+        while True:
+            key = self.queue.get()
+            try:
+                entry = _resolve(key)
+            except:
+                logging.error(str(asyncore.compact_traceback()))
+                entry = (sys.exc_info()[1], None, 0)
+            _LOCK.acquire()
+            try:
+                waiters = self.pending.pop(key)
+            finally:
+                _LOCK.release()
+            for poller, callback in waiters:
+                poller.post(lambda poller=poller, callback=callback:
+                  self._deliver(poller, callback, entry))
+
+    @staticmethod
+    def _deliver(poller, callback, entry):
+        poller.outstanding -= 1
+        callback(entry[0], entry[1])
+
+    #
+    # Warm up the cache with the given list of (address, port,
+    # family) tuples, e.g. with the names of the servers we will
+    # connect to shortly.
+    #
+    def prefetch(self, poller, endpoints):
+        for address, port, family in endpoints:
+            self.resolve(poller, _ignore, address, port, family,
+                         socket.SOCK_STREAM)
+
+def _ignore(exception, addrinfo):
+    pass
+
+RESOLVER = Resolver()
+
+def resolve(poller, callback, address, port, family=0, socktype=0,
+            proto=0, flags=0):
+    RESOLVER.resolve(poller, callback, address, port, family, socktype,
+                     proto, flags)
+
+def prefetch(poller, endpoints):
+    RESOLVER.prefetch(poller, endpoints)
@@ -21,9 +21,15 @@
 #
 
 import asyncore
+import collections
+import heapq
+import itertools
 import logging
 import errno
 import select
+import socket
+import sys
+import threading
 import time
 
 from neubot.utils import ticks
@@ -42,11 +48,101 @@ CHECK_TIMEOUT = 10
 #
 WATCHDOG = 300
 
+#
+# The idle timeout, i.e. the maximum time without I/O events, is
+# disabled by default.  Streams that want to be reclaimed when they
+# are inactive, regardless of how long they have been running, should
+# set it to a nonnegative value.
+#
+IDLE = -1
+
+#
+# Priority classes of pollables.  At each iteration the poller
+# services ready pollables in priority order, and it services at
+# most LOW_BUDGET events of low priority pollables, deferring the
+# others to the next iteration.  This way, for example, a burst
+# of API requests cannot delay the streams that are measuring.
+#
+PRIORITIES = [PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW] = range(3)
+LOW_BUDGET = 8
+
+#
+# Number of seconds after which we consider a loop iteration
+# a stall.  We only count the time spent running tasks and I/O
+# callbacks, not the time spent waiting for I/O.
+#
+STALL_THRESHOLD = 0.1
+
+#
+# Number of buckets of our histograms.  Each bucket counts the
+# values that have the same bit length, i.e. the i-th bucket counts
+# the values in [2^(i-1), 2^i), so the last bucket is for values
+# of about 2^31 microseconds or more.
+#
+BUCKETS = 32
+
 class Pollable(object):
 
     def __init__(self):
-        self.created = ticks()
-        self.watchdog = WATCHDOG
+        self.observer = None
+        self.priority = PRIORITY_NORMAL
+        self._created = ticks()
+        self._watchdog = WATCHDOG
+        self._idle = IDLE
+        self.last_activity = self._created
+
+    #
+    # The poller indexes pollables by deadline, i.e. the earliest
+    # of created plus watchdog and last activity plus idle, so it
+    # must be told when created, watchdog or idle changes, for
+    # example when a stream that is still active refreshes created
+    # in order not to be reclaimed by the watchdog.
+    # The poller updates last_activity each time it dispatches an
+    # I/O event, and this does not touch the index: activity only
+    # moves the deadline forward, so when the indexed deadline
+    # expires handle_periodic() notices that the stream has been
+    # active in the meantime and the stream is indexed again.
+    #
+
+    def _get_created(self):
+        return self._created
+
+    def _set_created(self, value):
+        self._created = value
+        if self.observer:
+            self.observer.update_deadline(self)
+
+    created = property(_get_created, _set_created)
+
+    def _get_watchdog(self):
+        return self._watchdog
+
+    def _set_watchdog(self, value):
+        self._watchdog = value
+        if self.observer:
+            self.observer.update_deadline(self)
+
+    watchdog = property(_get_watchdog, _set_watchdog)
+
+    def _get_idle(self):
+        return self._idle
+
+    def _set_idle(self, value):
+        self._idle = value
+        if self.observer:
+            self.observer.update_deadline(self)
+
+    idle = property(_get_idle, _set_idle)
+
+    def deadline(self):
+        deadlines = []
+        if self._watchdog >= 0:
+            deadlines.append(self._created + self._watchdog)
+        if self._idle >= 0:
+            deadlines.append(self.last_activity + self._idle)
+        if not deadlines:
+            return None
+        return min(deadlines)
 
     def fileno(self):
         raise NotImplementedError
@@ -61,7 +157,18 @@ class Pollable(object):
         pass
 
     def handle_periodic(self, timenow):
-        return self.watchdog >= 0 and timenow - self.created > self.watchdog
+        if self._watchdog >= 0 and timenow - self._created > self._watchdog:
+            return True
+        return self._idle >= 0 and timenow - self.last_activity > self._idle
+
+#
+# Tasks are kept in a binary heap ordered by deadline, and the
+# sequence number makes sure that tasks with the same deadline
+# are run in the same order in which they were scheduled.
+# Cancelled tasks are not removed from the heap, which would
+# cost O(n), but they are skipped when they expire.
+#
+SEQNO = itertools.count()
 
 class Task(object):
 
@@ -75,44 +182,522 @@ class Task(object):
         self.time = ticks() + delta
         self.timestamp = timestamp() + int(delta)
         self.func = func
+        self.seqno = SEQNO.next()
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.time, self.seqno) < (other.time, other.seqno)
+
+    #
+    # Drop the reference to func because usually it is a bound
+    # method or a closure and we don't want to keep alive the
+    # related objects until the deadline.
+    #
+    def cancel(self):
+        self.cancelled = True
+        self.func = None
 
     def __repr__(self):
         return ("Task: time=%(time)f timestamp=%(timestamp)d func=%(func)s" %
           self.__dict__)
 
+#
+# Low-overhead statistics on the behavior of the loop.  We want
+# to know how much time we spend waiting for I/O, how much time
+# we spend running callbacks and tasks, and how late tasks run
+# with respect to their deadline, because a slow callback directly
+# distorts the measurements performed by the other streams.
+# Times are accumulated into power-of-two histograms of micro-
+# seconds, and callbacks are grouped by class and method.
+#
+
+def _bucket(value):
+    return min(int(value).bit_length(), BUCKETS - 1)
+
+def _histogram(vector):
+    return [[1 << index, count] for index, count in enumerate(vector)
+            if count]
+
+def _describe(key):
+    klass, name = key
+    if klass is None:
+        return name
+    return "%s.%s" % (klass.__name__, name)
+
+def _describe_func(func):
+    name = getattr(func, "__name__", str(func))
+    instance = getattr(func, "im_self", None)
+    if instance is None:
+        return None, name
+    return instance.__class__, name
+
+class LoopStats(object):
+
+    def __init__(self):
+        self.stall_threshold = STALL_THRESHOLD
+        self.iterations = 0
+        self.deferred = 0
+        self.stalls = 0
+        self.last_stall = None
+        self.wait = [0] * BUCKETS
+        self.busy = [0] * BUCKETS
+        self.lag = [0] * BUCKETS
+        self.ntasks = [0] * BUCKETS
+        self.callbacks = {}
+
+        self._begin = 0.0
+        self._waited = 0.0
+        self._tasks_run = 0
+        self._slowest = (0.0, None)
+
+    def begin_iteration(self):
+        self._begin = ticks()
+        self._waited = 0.0
+        self._tasks_run = 0
+        self._slowest = (0.0, None)
+
+    def waited(self, elapsed):
+        self._waited += elapsed
+        self.wait[_bucket(elapsed * 1000000)] += 1
+
+    def task(self, func, lag, elapsed):
+        self._tasks_run += 1
+        self.lag[_bucket(lag * 1000000)] += 1
+        self.callback(_describe_func(func), elapsed)
+
+    def callback(self, key, elapsed):
+        entry = self.callbacks.get(key)
+        if entry is None:
+            entry = self.callbacks[key] = [0, 0.0, 0.0]
+        entry[0] += 1
+        entry[1] += elapsed
+        if elapsed > entry[2]:
+            entry[2] = elapsed
+        if elapsed > self._slowest[0]:
+            self._slowest = (elapsed, key)
+
+    def end_iteration(self):
+        self.iterations += 1
+        self.ntasks[_bucket(self._tasks_run)] += 1
+        busy = ticks() - self._begin - self._waited
+        self.busy[_bucket(busy * 1000000)] += 1
+        if busy > self.stall_threshold:
+            self.stalls += 1
+            elapsed, key = self._slowest
+            culprit = "(none)"
+            if key:
+                culprit = _describe(key)
+            self.last_stall = {
+                "timestamp": timestamp(),
+                "busy": busy,
+                "callback": culprit,
+                "callback_time": elapsed,
+            }
+            logging.warning("poller: stall: iteration took %f s, slowest "
+              "callback %s took %f s", busy, culprit, elapsed)
+
+    def snap(self):
+        callbacks = {}
+        for key, entry in self.callbacks.items():
+            callbacks[_describe(key)] = {
+                "count": entry[0],
+                "total": entry[1],
+                "max": entry[2],
+            }
+        return {
+            "iterations": self.iterations,
+            "deferred": self.deferred,
+            "stalls": self.stalls,
+            "stall_threshold": self.stall_threshold,
+            "last_stall": self.last_stall,
+            "wait_usec": _histogram(self.wait),
+            "busy_usec": _histogram(self.busy),
+            "lag_usec": _histogram(self.lag),
+            "tasks_per_iteration": _histogram(self.ntasks),
+            "callbacks": callbacks,
+        }
+
+#
+# Return a pair of connected sockets.  Python 2 does not provide
+# socketpair() on Windows, so there we connect two TCP sockets
+# through a temporary listener bound to localhost.
+#
+def _socketpair():
+    if hasattr(socket, "socketpair"):
+        return socket.socketpair()
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        writer = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        writer.connect(listener.getsockname())
+        reader = listener.accept()[0]
+    finally:
+        listener.close()
+    return reader, writer
+
+#
+# The waker allows other threads to post functions that must
+# run in the context of the thread that runs the poller loop.
+# The posting thread appends the function to the queue and then
+# writes a byte to wake up the loop, which runs all the queued
+# functions when the reading end becomes readable.
+# If the socket buffer is full a wakeup is already pending, so
+# it is safe to ignore send() errors.
+#
+class Waker(Pollable):
+
+    def __init__(self, poller):
+        Pollable.__init__(self)
+        self.poller = poller
+        self.priority = PRIORITY_HIGH
+        self.watchdog = -1
+        self.lock = threading.Lock()
+        self.queue = collections.deque()
+        self.reader, self.writer = _socketpair()
+        self.reader.setblocking(False)
+        self.writer.setblocking(False)
+
+    def __repr__(self):
+        return "waker of %s" % str(self.poller)
+
+    def fileno(self):
+        return self.reader.fileno()
+
+    def post(self, func):
+        self.lock.acquire()
+        try:
+            self.queue.append(func)
+        finally:
+            self.lock.release()
+        try:
+            self.writer.send("\0")
+        except socket.error:
+            pass
+
+    def handle_read(self):
+        try:
+            self.reader.recv(4096)
+        except socket.error:
+            pass
+
+        self.lock.acquire()
+        try:
+            queue, self.queue = self.queue, collections.deque()
+        finally:
+            self.lock.release()
+
+        for func in queue:
+            try:
+                func()
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except:
+                logging.error(str(asyncore.compact_traceback()))
+
+    def handle_close(self):
+        self.reader.close()
+        self.writer.close()
+
+#
+# The backends below are the strategies that the poller uses
+# to wait for I/O readiness.  Each backend keeps the interest
+# of each file descriptor registered across loop iterations and
+# is informed by the poller when the interest changes via the
+# modify() method.  The wait() method returns the lists of the
+# readable and writable file descriptors, in the same way as
+# select() does, so that the poller dispatch code does not need
+# to know which backend is in use.
+# The select() backend is the most portable one but each call
+# costs O(n) in the number of file descriptors and it cannot
+# deal with file descriptors larger than FD_SETSIZE.  So we use
+# epoll() on Linux and poll() on other Unices, when available.
+#
+
+class SelectBackend(object):
+
+    name = "select"
+
+    def __init__(self, poller):
+        self.poller = poller
+
+    def modify(self, fileno, readable, writable):
+        pass
+
+    def close(self):
+        pass
+
+    def wait(self, timeout):
+        res = select.select(self.poller.readset.keys(),
+          self.poller.writeset.keys(), [], timeout)
+        return res[0], res[1]
+
+#
+# Win32 has no poll(), and its select module does not even
+# define the POLL* constants we use below.
+#
+if hasattr(select, "poll"):
+    class PollBackend(object):
+
+        name = "poll"
+
+        #
+        # Errors and hangups are reported to both readers and
+        # writers, like select() does, so that the stream tries
+        # to perform I/O, gets the error and is closed.
+        #
+        READ_EVENTS = select.POLLIN|select.POLLPRI|select.POLLERR| \
+                      select.POLLHUP|select.POLLNVAL
+        WRITE_EVENTS = select.POLLOUT|select.POLLERR|select.POLLHUP| \
+                       select.POLLNVAL
+
+        def __init__(self, poller):
+            self.poller = poller
+            self.pollobj = self._create()
+            self.masks = {}
+
+        def _create(self):
+            return select.poll()
+
+        def _mask(self, readable, writable):
+            mask = 0
+            if readable:
+                mask |= select.POLLIN
+            if writable:
+                mask |= select.POLLOUT
+            return mask
+
+        #
+        # We are tolerant with respect to errors here because the
+        # kernel might have already forgotten a file descriptor that
+        # was closed before we had the chance to unregister it, and
+        # because the same number might be reused by a new socket.
+        # A file descriptor that is not valid anymore is forgotten,
+        # and the I/O on the related stream will fail in any case.
+        #
+        def modify(self, fileno, readable, writable):
+            mask = self._mask(readable, writable)
+            if self.masks.get(fileno, 0) == mask:
+                return
+            if not mask:
+                del self.masks[fileno]
+                try:
+                    self.pollobj.unregister(fileno)
+                except (KeyError, IOError, OSError, ValueError):
+                    pass
+                return
+            try:
+                if fileno in self.masks:
+                    self.pollobj.modify(fileno, mask)
+                else:
+                    self.pollobj.register(fileno, mask)
+            except (IOError, OSError), exception:
+                if exception[0] == errno.ENOENT:
+                    self.pollobj.register(fileno, mask)
+                elif exception[0] == errno.EEXIST:
+                    self.pollobj.modify(fileno, mask)
+                elif exception[0] == errno.EBADF:
+                    self.masks.pop(fileno, None)
+                    return
+                else:
+                    raise
+            self.masks[fileno] = mask
+
+        def close(self):
+            self.masks.clear()
+
+        def _poll(self, timeout):
+            # poll() wants milliseconds
+            return self.pollobj.poll(int(timeout * 1000))
+
+        def wait(self, timeout):
+            readable, writable = [], []
+            for fileno, events in self._poll(timeout):
+                if events & self.READ_EVENTS:
+                    readable.append(fileno)
+                if events & self.WRITE_EVENTS:
+                    writable.append(fileno)
+            return readable, writable
+
+else:
+    PollBackend = None
+
+if hasattr(select, "epoll"):
+    class EpollBackend(PollBackend):
+
+        name = "epoll"
+
+        READ_EVENTS = select.EPOLLIN|select.EPOLLPRI|select.EPOLLERR| \
+                      select.EPOLLHUP
+        WRITE_EVENTS = select.EPOLLOUT|select.EPOLLERR|select.EPOLLHUP
+
+        def _create(self):
+            return select.epoll()
+
+        def _mask(self, readable, writable):
+            mask = 0
+            if readable:
+                mask |= select.EPOLLIN
+            if writable:
+                mask |= select.EPOLLOUT
+            return mask
+
+        def close(self):
+            PollBackend.close(self)
+            self.pollobj.close()
+
+        def _poll(self, timeout):
+            return self.pollobj.poll(timeout)
+
+else:
+    EpollBackend = None
+
+BACKENDS = {
+    "epoll": EpollBackend,
+    "poll": PollBackend,
+    "select": SelectBackend,
+}
+
+#
+# The poll() implementation of MacOSX is known to be broken
+# with certain kinds of file descriptors, so there we stick
+# with select().
+#
+def backend_class(name):
+    if name == "auto":
+        if BACKENDS["epoll"]:
+            return BACKENDS["epoll"]
+        if BACKENDS["poll"] and sys.platform != "darwin":
+            return BACKENDS["poll"]
+        return BACKENDS["select"]
+    if not BACKENDS.get(name):
+        raise ValueError("Poller backend not available: %s" % name)
+    return BACKENDS[name]
+
 class Poller(object):
 
-    def __init__(self, select_timeout):
+    def __init__(self, select_timeout, backend="auto"):
         self.select_timeout = select_timeout
         self.again = True
         self.readset = {}
         self.writeset = {}
-        self.pending = []
         self.tasks = []
+        self.deadlines = []
+        self.watched = {}
+        self.stale = 0
+        self.stats = LoopStats()
+        self.low_budget = LOW_BUDGET
+        self.deferred = set()
+        self.waker = None
+        self.outstanding = 0
+        self.backend = backend_class(backend)(self)
         self.sched(CHECK_TIMEOUT, self.check_timeout)
 
+    #
+    # Switch to another backend, migrating the file descriptors
+    # we are currently monitoring, if any.
+    #
+    def set_backend(self, name):
+        backend = backend_class(name)(self)
+        self.backend.close()
+        self.backend = backend
+        for fileno in set(self.readset) | set(self.writeset):
+            backend.modify(fileno, fileno in self.readset,
+                           fileno in self.writeset)
+
+    #
+    # The child of a fork() shares the kernel state of the backend
+    # and the waker with its parent, so it must create new ones
+    # before running the loop.
+    #
+    def after_fork(self):
+        self.set_backend(self.backend.name)
+        if self.waker:
+            waker = self.waker
+            self.unset_readable(waker)
+            waker.handle_close()
+            self.waker = None
+            self.enable_post()
+
     def sched(self, delta, func):
         task = Task(delta, func)
-        self.pending.append(task)
+        heapq.heappush(self.tasks, task)
         return task
 
     def set_readable(self, stream):
-        self.readset[stream.fileno()] = stream
+        fileno = stream.fileno()
+        self.readset[fileno] = stream
+        self.backend.modify(fileno, True, fileno in self.writeset)
+        if stream not in self.watched:
+            self._watch(stream)
 
     def set_writable(self, stream):
-        self.writeset[stream.fileno()] = stream
+        fileno = stream.fileno()
+        self.writeset[fileno] = stream
+        self.backend.modify(fileno, fileno in self.readset, True)
+        if stream not in self.watched:
+            self._watch(stream)
 
     def unset_readable(self, stream):
         fileno = stream.fileno()
         if self.readset.has_key(fileno):
             del self.readset[fileno]
+            self.backend.modify(fileno, False, fileno in self.writeset)
 
     def unset_writable(self, stream):
         fileno = stream.fileno()
         if self.writeset.has_key(fileno):
             del self.writeset[fileno]
+            self.backend.modify(fileno, fileno in self.readset, False)
+
+    #
+    # Streams are indexed by deadline using a binary heap, so that
+    # check_timeout() deals only with the streams that are due, rather
+    # than scanning all of them.  Each entry of the heap is a list like
+    # [deadline, seqno, stream, fileno].  When the deadline of a stream
+    # changes we push a new entry and we invalidate the old one, setting
+    # its stream to None, because removing it would cost O(n).
+    # We stop watching a stream when it is closed or when its deadline
+    # expires and it is not registered for I/O anymore.  We don't stop
+    # watching a stream as soon as it is not readable nor writable,
+    # because that happens after each recv() or send() and we don't
+    # want to pay O(log n) for each I/O operation.
+    #
+
+    def _watch(self, stream, timenow=None):
+        stream.observer = self
+        deadline = stream.deadline()
+        if deadline is None:
+            self.watched[stream] = None
+            return
+        if timenow is not None and deadline <= timenow:
+            deadline = timenow + CHECK_TIMEOUT
+        entry = [deadline, SEQNO.next(), stream, stream.fileno()]
+        heapq.heappush(self.deadlines, entry)
+        self.watched[stream] = entry
+
+    def _unwatch(self, stream):
+        entry = self.watched.pop(stream, None)
+        if entry:
+            entry[2] = None
+            self.stale += 1
+        stream.observer = None
+
+    def update_deadline(self, stream):
+        if stream not in self.watched:
+            return
+        self._unwatch(stream)
+        self._watch(stream)
+
+        # Get rid of invalid entries when they are the majority
+        if self.stale > 64 and self.stale > len(self.watched):
+            self.deadlines = [entry for entry in self.deadlines
+                              if entry[2] is not None]
+            heapq.heapify(self.deadlines)
+            self.stale = 0
 
     def close(self, stream):
+        self._unwatch(stream)
         self.unset_readable(stream)
         self.unset_writable(stream)
         try:
@@ -137,6 +722,8 @@ class Poller(object):
     def _call_handle_read(self, fileno):
         if self.readset.has_key(fileno):
             stream = self.readset[fileno]
+            begin = ticks()
+            stream.last_activity = begin
             try:
                 stream.handle_read()
             except (KeyboardInterrupt, SystemExit):
@@ -144,10 +731,14 @@ class Poller(object):
             except:
                 logging.error(str(asyncore.compact_traceback()))
                 self.close(stream)
+            self.stats.callback((stream.__class__, "handle_read"),
+                                ticks() - begin)
 
     def _call_handle_write(self, fileno):
         if self.writeset.has_key(fileno):
             stream = self.writeset[fileno]
+            begin = ticks()
+            stream.last_activity = begin
             try:
                 stream.handle_write()
             except (KeyboardInterrupt, SystemExit):
@@ -155,90 +746,165 @@ class Poller(object):
             except:
                 logging.error(str(asyncore.compact_traceback()))
                 self.close(stream)
+            self.stats.callback((stream.__class__, "handle_write"),
+                                ticks() - begin)
+
+    #
+    # The backends are level-triggered, so the events that we defer
+    # are reported again at the next iteration.  We service them
+    # before the other low-priority events, to avoid starvation.
+    #
+    def _dispatch(self, readable, writable):
+        events = ([], [], [])
+        for fileno in readable:
+            stream = self.readset.get(fileno)
+            if stream is not None:
+                events[stream.priority].append((self._call_handle_read,
+                                                fileno))
+        for fileno in writable:
+            stream = self.writeset.get(fileno)
+            if stream is not None:
+                events[stream.priority].append((self._call_handle_write,
+                                                fileno))
+
+        low = events[PRIORITY_LOW]
+        if len(low) > self.low_budget:
+            if self.deferred:
+                low.sort(key=lambda event: event[1] not in self.deferred)
+            self.deferred = set(event[1] for event in low[self.low_budget:])
+            self.stats.deferred += len(low) - self.low_budget
+            del low[self.low_budget:]
+        elif self.deferred:
+            self.deferred.clear()
+
+        for vector in events:
+            for func, fileno in vector:
+                func(fileno)
+
+    #
+    # Functions posted by other threads run in the context of the
+    # thread running the loop of this poller.  Posting must be enabled
+    # by the thread that owns the poller before the other threads
+    # start posting, because that registers the waker.
+    #
+
+    def enable_post(self):
+        if not self.waker:
+            self.waker = Waker(self)
+            self.set_readable(self.waker)
+
+    def post(self, func):
+        if not self.waker:
+            raise RuntimeError("Posting is not enabled")
+        self.waker.post(func)
 
     def break_loop(self):
         self.again = False
 
+    #
+    # The waker does not count as a stream when we decide whether
+    # there is still some I/O to wait for.  But we must keep running
+    # when we are waiting for some outstanding posts, e.g. the result
+    # of a DNS lookup.
+    #
+    def _has_streams(self):
+        if self.writeset or self.outstanding:
+            return True
+        count = len(self.readset)
+        if self.waker and self.waker.fileno() in self.readset:
+            count -= 1
+        return count > 0
+
     def loop(self):
-        while self.again and (self.readset or self.writeset):
-            self._loop_once()
+        previous = getattr(_CURRENT, "poller", None)
+        _CURRENT.poller = self
+        try:
+            while self.again and self._has_streams():
+                self._loop_once()
+        finally:
+            _CURRENT.poller = previous
+
+    def loop_forever(self):
+        previous = getattr(_CURRENT, "poller", None)
+        _CURRENT.poller = self
+        try:
+            while self.again:
+                self._loop_once()
+        finally:
+            _CURRENT.poller = previous
 
     #
-    # Tests shows that updating tasks would be slower if we kept tasks
-    # sorted in reverse order--yes, with this arrangement it would be
-    # faster to delete elements (because it would be just a matter of
-    # shrinking the list), but the sort would be slower, and our tests
-    # suggest that we loose more with the sort than we gain with the
-    # delete.
-    # Here it would be better to use the task scheduler that ships
-    # with Python standard library.  I have a patch for that and it
-    # may be able to go in before 0.5.0 release.
+    # We first pop all the expired tasks and then we run them,
+    # so that a task that schedules another task with zero delta
+    # cannot make this loop run forever.  The tasks scheduled in
+    # the meantime will run at the next iteration.  A task may
+    # cancel another task of the same batch, so we check again
+    # before running each of them.
     #
-    def _loop_once(self):
-
+    def _run_tasks(self):
         now = ticks()
+        expired = []
+        while self.tasks and self.tasks[0].time <= now:
+            task = heapq.heappop(self.tasks)
+            if not task.cancelled:
+                expired.append(task)
+
+        for task in expired:
+            if task.cancelled:
+                continue
+            func, begin = task.func, ticks()
+            try:
+                func()
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except:
+                logging.error(str(asyncore.compact_traceback()))
+            self.stats.task(func, begin - task.time, ticks() - begin)
 
-        # Add pending tasks
-        if self.pending:
-            for task in self.pending:
-                self.tasks.append(task)
-            self.pending = []
+    def _loop_once(self):
+        self.stats.begin_iteration()
 
         # Process expired tasks
         if self.tasks:
+            self._run_tasks()
 
-            self.tasks.sort(key=lambda task: task.time)
-
-            # Run expired tasks
-            index = 0
-            for task in self.tasks:
-                if task.time - now > 1:
-                    break
-                index = index + 1
-
-                try:
-                    task.func()
-                except (KeyboardInterrupt, SystemExit):
-                    raise
-                except:
-                    logging.error(str(asyncore.compact_traceback()))
-
-            # Get rid of expired tasks
-            del self.tasks[:index]
+        # Forget cancelled tasks at the head of the heap
+        while self.tasks and self.tasks[0].cancelled:
+            heapq.heappop(self.tasks)
 
         #
-        # Calculate select() timeout now that all
-        # the tasks are in a good state, i.e. no pending
-        # and no unscheduled tasks around.
+        # Calculate select() timeout from the exact deadline of
+        # the next task.  Note that some backends have a coarse
+        # granularity (milliseconds) and round it down, so we
+        # might wake up slightly before the deadline and spin for
+        # a little while, but we never fire a task too early.
         #
         if not self.tasks:
             timeout = self.select_timeout
         else:
-            timeout = self.tasks[0].time - now
-            if timeout < 0.1:
-                timeout = 0
+            timeout = max(0, self.tasks[0].time - ticks())
 
         # Monitor streams readability/writability
         if self.readset or self.writeset:
 
             # Get list of readable/writable streams
+            begin = ticks()
             try:
-                res = select.select(self.readset.keys(), self.writeset.keys(),
-                 [], timeout)
-            except select.error, (code, reason):
-                if code != errno.EINTR:
+                res = self.backend.wait(timeout)
+            except (select.error, IOError, OSError), exception:
+                if exception[0] != errno.EINTR:
                     logging.error(str(asyncore.compact_traceback()))
                     raise
 
                 else:
                     # Take care of EINTR
+                    self.stats.waited(ticks() - begin)
+                    self.stats.end_iteration()
                     return
+            self.stats.waited(ticks() - begin)
 
             # No error?  Fire readable and writable events
-            for fileno in res[0]:
-                self._call_handle_read(fileno)
-            for fileno in res[1]:
-                self._call_handle_write(fileno)
+            self._dispatch(res[0], res[1])
 
         #
         # No I/O pending?  So let's just wait for the
@@ -246,23 +912,90 @@ class Poller(object):
         #
         elif timeout > 0:
             time.sleep(timeout)
+            self.stats.waited(timeout)
+
+        self.stats.end_iteration()
 
+    #
+    # When a deadline expires we ask the stream to confirm, because
+    # handle_periodic() has the last word on whether the stream has
+    # timed out.  If not, e.g. because it has been refreshed in the
+    # meantime, we index it again.
+    #
     def check_timeout(self):
         self.sched(CHECK_TIMEOUT, self.check_timeout)
-        if self.readset or self.writeset:
-
-            streams = set()
-            streams.update(self.readset.values())
-            streams.update(self.writeset.values())
 
-            timenow = ticks()
-            for stream in streams:
-                if stream.handle_periodic(timenow):
-                    logging.warning('Watchdog timeout: %s', str(stream))
-                    self.close(stream)
+        timenow = ticks()
+        expired = []
+        while self.deadlines and self.deadlines[0][0] <= timenow:
+            deadline, seqno, stream, fileno = heapq.heappop(self.deadlines)
+            if stream is None:
+                self.stale -= 1
+                continue
+            del self.watched[stream]
+            stream.observer = None
+            if (self.readset.get(fileno) is stream or
+                self.writeset.get(fileno) is stream):
+                expired.append(stream)
+
+        for stream in expired:
+            if stream.handle_periodic(timenow):
+                logging.warning('Watchdog timeout: %s', str(stream))
+                self.close(stream)
+            elif stream not in self.watched:
+                self._watch(stream, timenow)
 
     def snap(self, d):
-        d['poller'] = {"pending": self.pending, "tasks": self.tasks,
-          "readset": self.readset, "writeset": self.writeset}
+        d['poller'] = {"tasks": sorted(self.tasks),
+          "readset": self.readset, "writeset": self.writeset,
+          "deadlines": len(self.deadlines), "backend": self.backend.name,
+          "stats": self.stats.snap()}
 
 POLLER = Poller(1)
+
+#
+# The poller that is running in the current thread, or the global
+# POLLER if the current thread is not running any poller.  Code that
+# is not given a poller explicitly should use this function rather
+# than hardwiring POLLER, so that it works in any thread.
+#
+_CURRENT = threading.local()
+
+def current_poller():
+    poller = getattr(_CURRENT, "poller", None)
+    if not poller:
+        poller = POLLER
+    return poller
+
+#
+# Run a poller loop in a separate thread, e.g. to keep measurement
+# streams isolated from the web user interface or to spread the load
+# of many connections over many cores.  The other threads interact
+# with this poller using post(), and stop() breaks the loop.
+# Note that singletons like LOG, NOTIFIER and the DATABASE are not
+# thread safe, so threads should post their results to the loop of
+# the main thread rather than touching them directly.
+#
+class PollerThread(threading.Thread):
+
+    def __init__(self, poller, name=None):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True
+        self.poller = poller
+        self.poller.enable_post()
+
+    def run(self):
+        self.poller.loop_forever()
+
+    def stop(self):
+        self.poller.post(self.poller.break_loop)
+
+def start_pollers(count, select_timeout=1):
+    POLLER.enable_post()
+    threads = []
+    for index in range(count):
+        poller = Poller(select_timeout, POLLER.backend.name)
+        thread = PollerThread(poller, "poller-%d" % index)
+        thread.start()
+        threads.append(thread)
+    return threads
@@ -31,7 +31,9 @@ import collections
 import errno
 import os
 import socket
+import stat
 import sys
+import tempfile
 import types
 
 try:
@@ -44,7 +46,11 @@ if __name__ == "__main__":
 
 from neubot.config import CONFIG
 from neubot.log import LOG
-from neubot.net.dns import getaddrinfo
+from neubot.net import benchmark
+from neubot.net import dns
+from neubot.net import tcpinfo
+from neubot.net import timestamping
+from neubot.net import tuning
 from neubot.net.poller import POLLER
 from neubot.net.poller import Pollable
 
@@ -58,12 +64,133 @@ STATES = [SUCCESS, ERROR, WANT_READ, WANT_WRITE] = range(4)
 # Maximum amount of bytes we read from a socket
 MAXBUF = 1 << 18
 
+# Maximum number of buffers we gather into a single send
+IOV_MAX = 1024
+
 # Soft errors on sockets, i.e. we can retry later
 SOFT_ERRORS = [ errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR ]
 
 # Winsock returns EWOULDBLOCK
 INPROGRESS = [ 0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN ]
 
+#
+# Streams that receive with recv_into() borrow a buffer from this
+# pool for the duration of each read, so that the buffers are shared
+# among all the streams and we don't allocate a new string for each
+# recv().  We keep at most POOL_SIZE idle buffers.
+#
+POOL_SIZE = 64
+
+class BufferPool(object):
+    def __init__(self, bufsize, poolsize=POOL_SIZE):
+        self.bufsize = bufsize
+        self.poolsize = poolsize
+        self.idle = []
+        self.allocated = 0
+
+    def get(self):
+        if self.idle:
+            return self.idle.pop()
+        self.allocated += 1
+        return bytearray(self.bufsize)
+
+    def put(self, buf):
+        if len(self.idle) < self.poolsize:
+            self.idle.append(buf)
+
+BUFFER_POOL = BufferPool(MAXBUF)
+
+#
+# Send queue watermarks for the protocols that want backpressure,
+# see send_queue_bytes() below.
+#
+HIGH_WATERMARK = 1 << 22
+LOW_WATERMARK = 1 << 20
+
+#
+# Python 2 does not provide os.sendfile(), so on Linux we invoke
+# sendfile(2) via ctypes.  Where sendfile is not available we read
+# the file and send it from user space, as usual.
+#
+def _find_sendfile():
+    if hasattr(os, "sendfile"):
+        return os.sendfile
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        func = libc.sendfile64
+    except (ImportError, OSError, AttributeError):
+        return None
+    func.argtypes = [ctypes.c_int, ctypes.c_int,
+                     ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t]
+    func.restype = ctypes.c_ssize_t
+
+    def sendfile(out_fd, in_fd, offset, count):
+        offset = ctypes.c_int64(offset)
+        result = func(out_fd, in_fd, ctypes.byref(offset), count)
+        if result < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        return result
+
+    return sendfile
+
+SENDFILE = _find_sendfile()
+
+#
+# The same for splice(2), which moves data between a socket and
+# a pipe without copying it into user space.
+#
+SPLICE_F_MOVE = 1
+SPLICE_F_NONBLOCK = 2
+
+# Default size of a pipe buffer on Linux
+PIPE_SIZE = 1 << 16
+
+def _find_splice():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        func = libc.splice
+    except (ImportError, OSError, AttributeError):
+        return None
+    func.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int,
+                     ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint]
+    func.restype = ctypes.c_ssize_t
+
+    def splice(fd_in, fd_out, count, flags):
+        result = func(fd_in, None, fd_out, None, count, flags)
+        if result < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        return result
+
+    return splice
+
+SPLICE = _find_splice()
+
+#
+# A region of a regular file that we send with sendfile(), without
+# copying it into user space.  It is queued in place of the file
+# object and its length is the number of bytes left to send.
+#
+class FileRegion(object):
+    def __init__(self, filep, offset, count):
+        self.filep = filep
+        self.offset = offset
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def advance(self, count):
+        self.offset += count
+        self.count -= count
+
 if ssl:
     class SSLWrapper(object):
         def __init__(self, sock):
@@ -87,6 +214,14 @@ if ssl:
                 else:
                     return ERROR, exception
 
+        # Python 2 can't read SSL records into a buffer, so we copy
+        def sorecv_into(self, buf, flags=0):
+            status, octets = self.sorecv(len(buf))
+            if status != SUCCESS:
+                return status, octets
+            buf[:len(octets)] = octets
+            return SUCCESS, len(octets)
+
         def sosend(self, octets):
             try:
                 count = self.sock.write(octets)
@@ -99,9 +234,36 @@ if ssl:
                 else:
                     return ERROR, exception
 
+    #
+    # Creating an SSL context means loading and parsing the
+    # certificate, so we create a context for each (certfile, side)
+    # and we reuse it for all the connections.  Since the session
+    # cache and the ticket keys belong to the context, reusing it
+    # also means that the server side can resume sessions.  Python 2
+    # has no API to save and reuse a client session (SSLSession is
+    # Python 3.6+), so the client side always performs a full
+    # handshake.  Old Pythons lack SSLContext: there we return None
+    # and the caller falls back to ssl.wrap_socket().
+    #
+    SSL_CONTEXTS = {}
+
+    def ssl_context(certfile, server_side):
+        if not hasattr(ssl, "SSLContext"):
+            return None
+        key = (certfile, server_side)
+        context = SSL_CONTEXTS.get(key)
+        if not context:
+            context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+            if certfile:
+                context.load_cert_chain(certfile)
+            SSL_CONTEXTS[key] = context
+        return context
+
 class SocketWrapper(object):
     def __init__(self, sock):
         self.sock = sock
+        self.stamped = False
+        self.stamp = None
 
     def soclose(self):
         try:
@@ -109,8 +271,26 @@ class SocketWrapper(object):
         except socket.error:
             LOG.exception()
 
+    #
+    # recvmsg() needs a writable buffer to read kernel timestamps,
+    # so we borrow one from BUFFER_POOL when maxlen matches the size
+    # of the pooled buffers (i.e. always, but for tests).
+    #
     def sorecv(self, maxlen):
         try:
+            if self.stamped:
+                pooled = maxlen == BUFFER_POOL.bufsize
+                if pooled:
+                    buf = BUFFER_POOL.get()
+                else:
+                    buf = bytearray(maxlen)
+                try:
+                    count, self.stamp = timestamping.recv_into(self.sock,
+                                                               buf)
+                    return SUCCESS, str(buffer(buf, 0, count))
+                finally:
+                    if pooled:
+                        BUFFER_POOL.put(buf)
             octets = self.sock.recv(maxlen)
             return SUCCESS, octets
         except socket.error, exception:
@@ -119,6 +299,20 @@ class SocketWrapper(object):
             else:
                 return ERROR, exception
 
+    def sorecv_into(self, buf, flags=0):
+        try:
+            if self.stamped:
+                count, self.stamp = timestamping.recv_into(self.sock, buf,
+                                                           flags)
+                return SUCCESS, count
+            count = self.sock.recv_into(buf, 0, flags)
+            return SUCCESS, count
+        except socket.error, exception:
+            if exception[0] in SOFT_ERRORS:
+                return WANT_READ, 0
+            else:
+                return ERROR, exception
+
     def sosend(self, octets):
         try:
             count = self.sock.send(octets)
@@ -129,6 +323,17 @@ class SocketWrapper(object):
             else:
                 return ERROR, exception
 
+    def sosendfile(self, region):
+        try:
+            count = SENDFILE(self.sock.fileno(), region.filep.fileno(),
+                             region.offset, region.count)
+            return SUCCESS, count
+        except (OSError, socket.error), exception:
+            if exception[0] in SOFT_ERRORS:
+                return WANT_WRITE, 0
+            else:
+                return ERROR, exception
+
 #
 # To implement the protocol syntax, subclass this class and
 # implement the finite state machine described in the file
@@ -152,16 +357,33 @@ class Stream(Pollable):
 
         self.close_complete = False
         self.close_pending = False
+        self.budget = 0
+        self.budget_iterations = 0
+        self.continuous = False
         self.recv_blocked = False
+        self.recv_flags = 0
+        self.recv_into = False
         self.recv_pending = False
         self.recv_ssl_needs_kickoff = False
         self.send_blocked = False
         self.send_octets = None
+        self.send_offset = 0
         self.send_queue = collections.deque()
+        self.send_queue_len = 0
         self.send_pending = False
+        self.send_retry = False
+        self.send_throttled = False
+        self.high_watermark = 0
+        self.low_watermark = 0
 
         self.bytes_recv_tot = 0
         self.bytes_sent_tot = 0
+        self.tcp_info = None
+        self.profile = None
+        self.tunings = {}
+        self.timestamps = False
+        self.tx_time = None
+        self.rx_time = None
 
         self.opaque = None
         self.atclosev = set()
@@ -177,12 +399,19 @@ class Stream(Pollable):
         self.parent = parent
         self.conf = conf
 
+        self.continuous = conf["net.stream.continuous"]
+        self.budget = conf["net.stream.budget"]
+        self.budget_iterations = conf["net.stream.budget_iterations"]
+        self.high_watermark = conf["net.stream.high_watermark"]
+        self.low_watermark = conf["net.stream.low_watermark"]
+
         self.filenum = sock.fileno()
         self.myname = sock.getsockname()
         self.peername = sock.getpeername()
         self.logname = str((self.myname, self.peername))
 
-        LOG.debug("* Connection made %s" % str(self.logname))
+        if LOG.is_debug():
+            LOG.debug("* Connection made %s" % str(self.logname))
 
         if conf["net.stream.secure"]:
             if not ssl:
@@ -195,8 +424,13 @@ class Stream(Pollable):
             if not certfile:
                 certfile = None
 
-            ssl_sock = ssl.wrap_socket(sock, do_handshake_on_connect=False,
-              certfile=certfile, server_side=server_side)
+            context = ssl_context(certfile, server_side)
+            if context:
+                ssl_sock = context.wrap_socket(sock, server_side=server_side,
+                  do_handshake_on_connect=False)
+            else:
+                ssl_sock = ssl.wrap_socket(sock, do_handshake_on_connect=False,
+                  certfile=certfile, server_side=server_side)
             self.sock = SSLWrapper(ssl_sock)
 
             self.recv_ssl_needs_kickoff = not server_side
@@ -235,6 +469,9 @@ class Stream(Pollable):
 
         self.close_complete = True
 
+        if self.tcp_info:
+            self.tcp_info.stop()
+
         self.connection_lost(None)
         self.parent.connection_lost(self)
 
@@ -248,6 +485,7 @@ class Stream(Pollable):
                 LOG.exception("Error in atclosev")
 
         self.send_octets = None
+        self.send_offset = 0
         self.sock.soclose()
 
     # Recv path
@@ -290,17 +528,83 @@ class Stream(Pollable):
             self.handle_write()
             return
 
+        if not self.continuous:
+            self._read_once()
+            return
+
+        budget = self.budget
+        for _ in xrange(self.budget_iterations):
+            count = self._read_once()
+            if not count or self.close_complete or not self.recv_pending:
+                break
+            budget -= count
+            if budget <= 0:
+                break
+
+        if not self.recv_pending and not self.close_complete:
+            self.poller.unset_readable(self)
+
+    #
+    # In continuous mode the stream stays readable (writable) while
+    # the protocol keeps asking for more, and handle_read (handle_write)
+    # loops until the socket would block or the per-wakeup budget of
+    # bytes and iterations is exhausted, so that a busy stream does
+    # not starve the others.  This saves a loop iteration and two
+    # changes of the interest set for each chunk.  The _once methods
+    # return the number of bytes transferred when it makes sense to
+    # try again, zero otherwise.
+    #
+    def _read_once(self):
+        if self.recv_into:
+            return self._read_into()
+
         status, octets = self.sock.sorecv(MAXBUF)
 
         if status == SUCCESS and octets:
 
             self.bytes_recv_tot += len(octets)
             self.recv_pending = False
-            self.poller.unset_readable(self)
+            if not self.continuous:
+                self.poller.unset_readable(self)
+            if self.timestamps and self.rx_time is None:
+                self._stamp_rx()
 
             self.recv_complete(octets)
-            return
+            return len(octets)
+
+        self._read_failed(status, octets)
+        return 0
+
+    #
+    # When recv_into is set, recv_complete() receives a memoryview
+    # of a buffer borrowed from BUFFER_POOL, which is valid only until
+    # recv_complete() returns.  So, recv_complete() must copy the bytes
+    # it wants to keep.
+    #
+    def _read_into(self):
+        buf = BUFFER_POOL.get()
+        try:
+            status, count = self.sock.sorecv_into(buf, self.recv_flags)
 
+            if status == SUCCESS and count:
+
+                self.bytes_recv_tot += count
+                self.recv_pending = False
+                if not self.continuous:
+                    self.poller.unset_readable(self)
+                if self.timestamps and self.rx_time is None:
+                    self._stamp_rx()
+
+                self.recv_complete(memoryview(buf)[:count])
+                return count
+
+        finally:
+            BUFFER_POOL.put(buf)
+
+        self._read_failed(status, count)
+        return 0
+
+    def _read_failed(self, status, octets):
         if status == WANT_READ:
             return
 
@@ -324,9 +628,92 @@ class Stream(Pollable):
     def recv_complete(self, octets):
         pass
 
+    #
+    # Measurement code invokes this function when a transfer
+    # starts, so that the time series of the kernel TCP state is
+    # available as self.tcp_info.series when the test is over.
+    #
+    def start_tcp_info(self):
+        interval = self.conf["net.stream.tcp_info_interval"]
+        if self.tcp_info or interval <= 0 or not tcpinfo.available():
+            return
+        self.tcp_info = tcpinfo.TCPInfoSampler(self.poller, self.sock.sock,
+                                               interval)
+        self.tcp_info.start()
+
+    #
+    # Tests select the tuning profile of each phase with this
+    # function, which changes the socket options only when the
+    # profile changes.  The description of each profile applied
+    # is kept in self.tunings, so that tests can save it along
+    # with the results.
+    #
+    def set_profile(self, name):
+        if name == self.profile or self.close_complete:
+            return
+        self.profile = name
+        self.tunings[name] = tuning.apply(self.sock.sock, name,
+                                          tuning.settings(self.conf, name))
+
+    #
+    # Latency measurements invoke start_timestamps() before they
+    # send a request, and then read tx_time, the time just before
+    # the first send(), and rx_time, the time at which the first
+    # byte of the response arrived.  With net.stream.rx_timestamps
+    # and on Linux, rx_time is the kernel timestamp of the packet,
+    # so that it does not include the time the response waited for
+    # the poller to dispatch it.  Both use the clock of ticks().
+    #
+    def start_timestamps(self):
+        self.timestamps = True
+        self.tx_time = None
+        self.rx_time = None
+        if (self.conf["net.stream.rx_timestamps"] and
+            timestamping.available() and
+            isinstance(self.sock, SocketWrapper) and
+            not self.sock.stamped):
+            try:
+                timestamping.enable(self.sock.sock)
+            except socket.error:
+                LOG.warning("stream: cannot enable kernel timestamps")
+                return
+            self.sock.stamped = True
+
+    def stop_timestamps(self):
+        self.timestamps = False
+        if isinstance(self.sock, SocketWrapper) and self.sock.stamped:
+            self.sock.stamped = False
+            self.sock.stamp = None
+
+    def _stamp_rx(self):
+        stamp = None
+        if isinstance(self.sock, SocketWrapper):
+            stamp = self.sock.stamp
+        if stamp is None:
+            stamp = utils.ticks()
+        self.rx_time = stamp
+
     # Send path
 
-    def read_send_queue(self):
+    #
+    # Regular files are sent with sendfile() when the socket
+    # supports it, i.e. it is not SSL.  Other file-likes, such as
+    # StringIOs and pipes, are read and sent from user space.
+    #
+    def _file_region(self, filep):
+        if (not SENDFILE or not isinstance(filep, file) or
+            not hasattr(self.sock, "sosendfile")):
+            return None
+        try:
+            if not stat.S_ISREG(os.fstat(filep.fileno()).st_mode):
+                return None
+            offset = filep.tell()
+            return FileRegion(filep, offset,
+                              os.fstat(filep.fileno()).st_size - offset)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def read_send_queue(self, maxlen=MAXBUF):
         octets = ""
 
         while self.send_queue:
@@ -334,27 +721,77 @@ class Stream(Pollable):
             if isinstance(octets, basestring):
                 # remove the piece in any case
                 self.send_queue.popleft()
+                self.send_queue_len -= len(octets)
                 if octets:
                     break
             else:
-                octets = octets.read(MAXBUF)
+                region = self._file_region(octets)
+                if region is not None:
+                    self.send_queue.popleft()
+                    octets = region
+                    if octets:
+                        break
+                    continue
+                octets = octets.read(maxlen)
                 if octets:
                     break
                 # remove the file-like when it is empty
                 self.send_queue.popleft()
 
-        if octets:
+        if octets and not isinstance(octets, FileRegion):
             if type(octets) == types.UnicodeType:
                 LOG.oops("Received unicode input")
                 octets = octets.encode("utf-8")
 
         return octets
 
+    #
+    # The send queue is unbounded, so producers must not queue
+    # faster than the peer reads.  When the bytes in memory waiting
+    # to be sent reach the high watermark we invoke send_paused(),
+    # and when they fall below the low watermark we invoke
+    # send_resumed().  Request/response protocols should stop reading
+    # while paused, so that TCP pushes back on the peer, and producers
+    # of non-essential data (e.g. LOG streaming) should check the
+    # send_throttled flag and drop or coalesce it.  File-likes are
+    # not counted, because they are not in memory.
+    # Backpressure is off by default, i.e. net.stream.high_watermark
+    # is zero, and the protocols that need it enable it explicitly.
+    #
+    def enable_backpressure(self):
+        self.high_watermark = HIGH_WATERMARK
+        self.low_watermark = LOW_WATERMARK
+
+    def send_queue_bytes(self):
+        count = self.send_queue_len
+        if isinstance(self.send_octets, basestring):
+            count += len(self.send_octets) - self.send_offset
+        return count
+
+    def send_paused(self):
+        pass
+
+    def send_resumed(self):
+        pass
+
+    def _maybe_resume(self):
+        if (self.send_throttled and
+            self.send_queue_bytes() <= self.low_watermark):
+            self.send_throttled = False
+            self.send_resumed()
+
     def start_send(self, octets):
         if self.close_complete or self.close_pending:
             return
 
         self.send_queue.append(octets)
+        if isinstance(octets, basestring):
+            self.send_queue_len += len(octets)
+            if (not self.send_throttled and self.high_watermark > 0 and
+                self.send_queue_bytes() >= self.high_watermark):
+                self.send_throttled = True
+                self.send_paused()
+
         if self.send_pending:
             return
 
@@ -369,6 +806,34 @@ class Stream(Pollable):
 
         self.poller.set_writable(self)
 
+    #
+    # Python 2 does not provide sendmsg(), so we emulate scatter-
+    # gather I/O joining the small buffers queued after the current
+    # one, e.g. headers and body of an HTTP message, or a burst of
+    # BitTorrent messages, so that they go out with a single send().
+    # We don't gather when we must retry the send of the current
+    # buffer, because SSL wants us to retry with the same buffer.
+    # We gather strings only and we stop at the first file-like,
+    # which may be a regular file that we send with sendfile().
+    #
+    def _gather(self):
+        vector = [self.send_octets]
+        total = len(self.send_octets)
+        while self.send_queue and len(vector) < IOV_MAX and total < MAXBUF:
+            octets = self.send_queue[0]
+            if not isinstance(octets, basestring):
+                break
+            if not octets:
+                self.send_queue.popleft()
+                continue
+            if total + len(octets) > MAXBUF:
+                break
+            octets = self.read_send_queue()
+            vector.append(octets)
+            total += len(octets)
+        if len(vector) > 1:
+            self.send_octets = "".join(vector)
+
     def handle_write(self):
         if self.send_blocked:
             self.poller.set_readable(self)
@@ -378,36 +843,91 @@ class Stream(Pollable):
             self.handle_read()
             return
 
-        status, count = self.sock.sosend(self.send_octets)
+        if not self.continuous:
+            self._write_once()
+            return
+
+        budget = self.budget
+        for _ in xrange(self.budget_iterations):
+            count = self._write_once()
+            if not count or self.close_complete or not self.send_pending:
+                break
+            budget -= count
+            if budget <= 0:
+                break
+
+        if not self.send_pending and not self.close_complete:
+            self.poller.unset_writable(self)
+
+    def _write_once(self):
+        octets = self.send_octets
+        if isinstance(octets, FileRegion):
+            status, count = self.sock.sosendfile(octets)
+
+            #
+            # Empty regions are never queued, so here zero does not
+            # mean EOF of the socket: it means that the file became
+            # shorter after we queued it, e.g. it was truncated, and
+            # the peer would silently receive a short body.
+            #
+            if status == SUCCESS and count == 0:
+                raise RuntimeError("File shrunk while sending it: %d "
+                                   "bytes missing" % octets.count)
+
+        else:
+            if (self.send_queue and not self.send_offset and
+                not self.send_retry and len(octets) < MAXBUF):
+                self._gather()
+                octets = self.send_octets
+
+            # Keep track of partial sends with an offset, not copying
+            if self.send_offset:
+                octets = memoryview(octets)[self.send_offset:]
+
+            if self.timestamps and self.tx_time is None:
+                self.tx_time = utils.ticks()
+
+            status, count = self.sock.sosend(octets)
 
         if status == SUCCESS and count > 0:
             self.bytes_sent_tot += count
+            self.send_retry = False
 
-            if count == len(self.send_octets):
+            if count == len(octets):
 
+                self.send_offset = 0
                 self.send_octets = self.read_send_queue()
+                self._maybe_resume()
                 if self.send_octets:
-                    return
+                    return count
 
                 self.send_pending = False
-                self.poller.unset_writable(self)
+                if not self.continuous:
+                    self.poller.unset_writable(self)
 
                 self.send_complete()
                 if self.close_pending:
                     self.poller.close(self)
-                return
+                return count
 
-            if count < len(self.send_octets):
-                self.send_octets = buffer(self.send_octets, count)
+            # A partial send means that the socket buffer is full
+            if count < len(octets):
+                if isinstance(octets, FileRegion):
+                    octets.advance(count)
+                else:
+                    self.send_offset += count
+                self._maybe_resume()
                 self.poller.set_writable(self)
-                return
+                return 0
 
             raise RuntimeError("Sent more than expected")
 
         if status == WANT_WRITE:
+            self.send_retry = True
             return
 
         if status == WANT_READ:
+            self.send_retry = True
             self.poller.unset_writable(self)
             self.poller.set_readable(self)
             self.recv_blocked = True
@@ -430,40 +950,123 @@ class Stream(Pollable):
     def send_complete(self):
         pass
 
-class Connector(Pollable):
-    def __init__(self, poller, parent):
+#
+# Happy Eyeballs (RFC 8305): we try the addresses in turn, starting
+# a new attempt when the previous one has not completed after a short
+# delay, or as soon as it fails, and we keep the first connection that
+# succeeds.  When both families are allowed, addresses are interleaved
+# starting with IPv6, so that a broken IPv6 path costs at most one
+# delay.
+#
+def _interleave(addrinfo):
+    inet6 = [ainfo for ainfo in addrinfo if ainfo[0] == socket.AF_INET6]
+    other = [ainfo for ainfo in addrinfo if ainfo[0] != socket.AF_INET6]
+    result = []
+    while inet6 or other:
+        if inet6:
+            result.append(inet6.pop(0))
+        if other:
+            result.append(other.pop(0))
+    return result
+
+class ConnectAttempt(Pollable):
+    def __init__(self, connector, sock, address):
         Pollable.__init__(self)
+        self.connector = connector
+        self.sock = sock
+        self.address = address
+        self.timestamp = utils.ticks()
+
+    def __repr__(self):
+        return "connect attempt to %s" % str(self.address)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def handle_write(self):
+        self.connector.poller.unset_writable(self)
+
+        # See http://cr.yp.to/docs/connect.html
+        try:
+            self.sock.getpeername()
+        except socket.error, exception:
+            # MacOSX getpeername() fails with EINVAL
+            if exception[0] in (errno.ENOTCONN, errno.EINVAL):
+                try:
+                    self.sock.recv(MAXBUF)
+                except socket.error, exception2:
+                    exception = exception2
+            LOG.debug("* Connection to %s failed: %s" % (str(self.address),
+              exception))
+            connector, self.connector = self.connector, None
+            connector.poller.close(self)
+            connector._attempt_failed(self, exception)
+            return
+
+        rtt = utils.ticks() - self.timestamp
+        self.connector._attempt_made(self, rtt)
+
+    #
+    # The connector clears our reference to it before closing the
+    # attempts that lost the race, so that they don't report back.
+    #
+    def handle_close(self):
+        connector, self.connector = self.connector, None
+        self.sock.close()
+        if connector:
+            connector._attempt_failed(self, None)
+
+class Connector(object):
+    def __init__(self, poller, parent):
         self.poller = poller
         self.parent = parent
         self.sock = None
         self.timestamp = 0
         self.endpoint = None
         self.family = 0
+        self.conf = None
+        self.addrinfo = collections.deque()
+        self.attempts = []
+        self.last_exception = None
+        self.started = False
+        self.task = None
 
     def __repr__(self):
         return "connector to %s" % str(self.endpoint)
 
+    #
+    # Name resolution does not block the poller: we continue
+    # in _resolved() once the resolver has the address.
+    #
     def connect(self, endpoint, conf):
         self.endpoint = endpoint
-        self.family = socket.AF_INET
-        if conf["net.stream.ipv6"]:
-            self.family = socket.AF_INET6
-        rcvbuf = conf["net.stream.rcvbuf"]
-        sndbuf = conf["net.stream.sndbuf"]
+        self.conf = conf
+        self.timestamp = utils.ticks()
+        self.family = dns.connect_family(conf)
+        dns.resolve(self.poller, self._resolved, endpoint[0], endpoint[1],
+                    self.family, socket.SOCK_STREAM)
 
-        try:
-            addrinfo = getaddrinfo(endpoint[0], endpoint[1], self.family,
-                                   socket.SOCK_STREAM)
-        except socket.error, exception:
-            LOG.error("* Connection to %s failed: %s" % (endpoint, exception))
+    def _resolved(self, exception, addrinfo):
+        if exception:
+            LOG.error("* Connection to %s failed: %s" % (self.endpoint,
+              exception))
             self.parent._connection_failed(self, exception)
             return
 
-        last_exception = None
-        for ainfo in addrinfo:
+        self.addrinfo.extend(_interleave(addrinfo))
+        self._next_attempt()
+
+    def _next_attempt(self, *args, **kwargs):
+        self.task = None
+
+        rcvbuf = self.conf["net.stream.rcvbuf"]
+        sndbuf = self.conf["net.stream.sndbuf"]
+
+        while self.addrinfo:
+            ainfo = self.addrinfo.popleft()
             try:
 
-                sock = socket.socket(self.family, socket.SOCK_STREAM)
+                sock = socket.socket(ainfo[0], socket.SOCK_STREAM)
                 if rcvbuf:
                     sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
                 if sndbuf:
@@ -471,48 +1074,99 @@ class Connector(Pollable):
                 sock.setblocking(False)
                 result = sock.connect_ex(ainfo[4])
                 if result not in INPROGRESS:
+                    sock.close()
                     raise socket.error(result, os.strerror(result))
 
-                self.sock = sock
-                self.timestamp = utils.ticks()
-                self.poller.set_writable(self)
-                if result != 0:
-                    LOG.debug("* Connecting to %s ..." % str(endpoint))
-                    self.parent.started_connecting(self)
-                return
-
             except socket.error, exception:
-                last_exception = exception
-
-        LOG.error("* Connection to %s failed: %s" % (endpoint, last_exception))
-        self.parent._connection_failed(self, last_exception)
-
-    def fileno(self):
-        return self.sock.fileno()
-
-    def handle_write(self):
-        self.poller.unset_writable(self)
+                self.last_exception = exception
+                continue
+
+            attempt = ConnectAttempt(self, sock, ainfo[4])
+            self.attempts.append(attempt)
+            self.poller.set_writable(attempt)
+            if result != 0 and not self.started:
+                self.started = True
+                LOG.debug("* Connecting to %s ..." % str(self.endpoint))
+                self.parent.started_connecting(self)
+            if self.addrinfo:
+                self.task = self.poller.sched(
+                  self.conf["net.stream.happy_eyeballs_delay"],
+                  self._next_attempt)
+            return
 
-        # See http://cr.yp.to/docs/connect.html
-        try:
-            self.sock.getpeername()
-        except socket.error, exception:
-            # MacOSX getpeername() fails with EINVAL
-            if exception[0] in (errno.ENOTCONN, errno.EINVAL):
-                try:
-                    self.sock.recv(MAXBUF)
-                except socket.error, exception2:
-                    exception = exception2
+        if not self.attempts:
             LOG.error("* Connection to %s failed: %s" % (self.endpoint,
-              exception))
-            self.parent._connection_failed(self, exception)
-            return
+              self.last_exception))
+            self.parent._connection_failed(self, self.last_exception)
 
-        rtt = utils.ticks() - self.timestamp
-        self.parent._connection_made(self.sock, rtt)
+    def _attempt_failed(self, attempt, exception):
+        if attempt not in self.attempts:
+            return
+        self.attempts.remove(attempt)
+        if exception:
+            self.last_exception = exception
+        # Don't wait for the delay to try the next address
+        if self.task:
+            self.task.cancel()
+        self._next_attempt()
+
+    def _attempt_made(self, attempt, rtt):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        self.addrinfo.clear()
+        self.attempts.remove(attempt)
+        losers, self.attempts = self.attempts, []
+        for loser in losers:
+            loser.connector = None
+            self.poller.close(loser)
+        self.sock = attempt.sock
+        self.parent._connection_made(attempt.sock, rtt)
 
-    def handle_close(self):
-        self.parent._connection_failed(self, None)
+#
+# Counters of the listeners, exported by the debug API together
+# with the listen queue overflows counted by the kernel, i.e. the
+# connections that were dropped because the backlog was full.
+#
+ACCEPT_STATS = {
+    "accepted": 0,
+    "accept_errors": 0,
+    "accept_wakeups": 0,
+    "accept_max_batch": 0,
+}
+
+_ACCEPT_LAST = [utils.ticks(), 0]
+
+def _read_netstat(path="/proc/net/netstat"):
+    result = {}
+    try:
+        filep = open(path, "rb")
+        lines = filep.readlines()
+        filep.close()
+    except (IOError, OSError):
+        return result
+    # Each protocol has a line of names followed by a line of values
+    for names, values in zip(lines[0::2], lines[1::2]):
+        names, values = names.split(), values.split()
+        if names[0] != "TcpExt:" or values[0] != "TcpExt:":
+            continue
+        for name, value in zip(names[1:], values[1:]):
+            result[name] = int(value)
+    return result
+
+def accept_stats():
+    stats = ACCEPT_STATS.copy()
+    now = utils.ticks()
+    elapsed = now - _ACCEPT_LAST[0]
+    if elapsed > 0:
+        stats["accept_rate"] = (stats["accepted"] - _ACCEPT_LAST[1]) / elapsed
+    else:
+        stats["accept_rate"] = 0.0
+    _ACCEPT_LAST[:] = [now, stats["accepted"]]
+    netstat = _read_netstat()
+    stats["listen_overflows"] = netstat.get("ListenOverflows", -1)
+    stats["listen_drops"] = netstat.get("ListenDrops", -1)
+    return stats
 
 class Listener(Pollable):
     def __init__(self, poller, parent):
@@ -522,6 +1176,7 @@ class Listener(Pollable):
         self.lsock = None
         self.endpoint = None
         self.family = 0
+        self.conf = None
 
         # Want to listen "forever"
         self.watchdog = -1
@@ -529,22 +1184,36 @@ class Listener(Pollable):
     def __repr__(self):
         return "listener at %s" % str(self.endpoint)
 
+    #
+    # We resolve the address to bind synchronously, so that we
+    # are listening when listen() returns, i.e. before the server
+    # drops privileges and before the pre-fork server forks its
+    # workers, which would forget a pending lookup.
+    #
     def listen(self, endpoint, conf):
         self.endpoint = endpoint
+        self.conf = conf
         self.family = socket.AF_INET
         if conf["net.stream.ipv6"]:
             self.family = socket.AF_INET6
-        rcvbuf = conf["net.stream.rcvbuf"]
-        sndbuf = conf["net.stream.sndbuf"]
-
         try:
-            addrinfo = getaddrinfo(endpoint[0], endpoint[1], self.family,
-                                   socket.SOCK_STREAM, 0, socket.AI_PASSIVE)
+            addrinfo = dns.getaddrinfo(endpoint[0], endpoint[1], self.family,
+                                       socket.SOCK_STREAM, 0,
+                                       socket.AI_PASSIVE)
         except socket.error, exception:
+            self._resolved(exception, None)
+        else:
+            self._resolved(None, addrinfo)
+
+    def _resolved(self, exception, addrinfo):
+        if exception:
             LOG.error("* Bind %s failed: %s" % (self.endpoint, exception))
             self.parent.bind_failed(self, exception)
             return
 
+        rcvbuf = self.conf["net.stream.rcvbuf"]
+        sndbuf = self.conf["net.stream.sndbuf"]
+
         last_exception = None
         for ainfo in addrinfo:
             try:
@@ -557,8 +1226,20 @@ class Listener(Pollable):
                     lsock.setsockopt(socket.SOL_SOCKET,socket.SO_SNDBUF,sndbuf)
                 lsock.setblocking(False)
                 lsock.bind(ainfo[4])
-                # Probably the backlog here is too big
-                lsock.listen(128)
+                lsock.listen(self.conf["net.stream.backlog"])
+
+                #
+                # Create the SSL context now, before the pre-fork
+                # server forks its workers, so that all the workers
+                # share the same ticket keys.
+                #
+                if self.conf["net.stream.secure"] and ssl:
+                    try:
+                        ssl_context(self.conf["net.stream.certfile"] or None,
+                                    True)
+                    except (IOError, ssl.SSLError), exception:
+                        LOG.warning("* Cannot load certificate: %s" %
+                                    str(exception))
 
                 LOG.debug("* Listening at %s" % str(self.endpoint))
 
@@ -577,20 +1258,42 @@ class Listener(Pollable):
         return self.lsock.fileno()
 
     #
+    # We accept up to net.stream.accept_batch connections for each
+    # wakeup, so that a burst of clients (e.g. the ones synchronized
+    # by the rendezvous interval) does not overflow the backlog.
+    # Python 2 has no accept4(), and emulating it with ctypes would
+    # cost a dup() to wrap the file descriptor into a socket object,
+    # so we stick with accept() plus setblocking().
     # Catch all types of exception because an error in
     # connection_made() MUST NOT cause the server to stop
     # listening for new connections.
     #
     def handle_read(self):
-        try:
-            sock, sockaddr = self.lsock.accept()
-            sock.setblocking(False)
-            self.parent.connection_made(sock)
-        except (KeyboardInterrupt, SystemExit):
-            raise
-        except Exception, exception:
-            self.parent.accept_failed(self, exception)
-            return
+        ACCEPT_STATS["accept_wakeups"] += 1
+        count = 0
+        while count < self.conf["net.stream.accept_batch"]:
+            try:
+                sock, sockaddr = self.lsock.accept()
+            except socket.error, exception:
+                # Other workers might have accepted it
+                if exception[0] in SOFT_ERRORS:
+                    break
+                ACCEPT_STATS["accept_errors"] += 1
+                self.parent.accept_failed(self, exception)
+                break
+            count += 1
+            try:
+                sock.setblocking(False)
+                self.parent.connection_made(sock)
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except Exception, exception:
+                ACCEPT_STATS["accept_errors"] += 1
+                self.parent.accept_failed(self, exception)
+
+        ACCEPT_STATS["accepted"] += count
+        if count > ACCEPT_STATS["accept_max_batch"]:
+            ACCEPT_STATS["accept_max_batch"] = count
 
     def handle_close(self):
         self.parent.bind_failed(self, None)     # XXX
@@ -603,6 +1306,7 @@ class StreamHandler(object):
         self.bad = collections.deque()
         self.good = collections.deque()
         self.rtts = []
+        self.connecting = 0
 
     def configure(self, conf):
         self.conf = conf
@@ -626,24 +1330,37 @@ class StreamHandler(object):
             count = count - 1
         self._next_connect()
 
+    #
+    # Up to net.stream.max_connects connections are established
+    # in parallel, so that the setup of N connections costs about
+    # one RTT rather than N.  As before, we report the outcome when
+    # all the connections are complete, and we close all of them if
+    # any of them failed.
+    #
     def _next_connect(self):
-        if self.epnts:
+        while (self.epnts and
+               self.connecting < self.conf["net.stream.max_connects"]):
+            self.connecting += 1
             connector = Connector(self.poller, self)
             connector.connect(self.epnts.popleft(), self.conf)
+
+        if self.epnts or self.connecting:
+            return
+
+        if self.bad:
+            while self.bad:
+                connector, exception = self.bad.popleft()
+                self.connection_failed(connector, exception)
+            while self.good:
+                sock, rtt = self.good.popleft()
+                sock.close()
         else:
-            if self.bad:
-                while self.bad:
-                    connector, exception = self.bad.popleft()
-                    self.connection_failed(connector, exception)
-                while self.good:
-                    sock = self.good.popleft()
-                    sock.close()
-            else:
-                while self.good:
-                    sock, rtt = self.good.popleft()
-                    self.connection_made(sock, rtt)
+            while self.good:
+                sock, rtt = self.good.popleft()
+                self.connection_made(sock, rtt)
 
     def _connection_failed(self, connector, exception):
+        self.connecting -= 1
         self.bad.append((connector, exception))
         self._next_connect()
 
@@ -654,6 +1371,7 @@ class StreamHandler(object):
         pass
 
     def _connection_made(self, sock, rtt):
+        self.connecting -= 1
         self.rtts.append(rtt)
         self.good.append((sock, rtt))
         self._next_connect()
@@ -665,11 +1383,21 @@ class StreamHandler(object):
         pass
 
 class GenericHandler(StreamHandler):
+    def __init__(self, poller):
+        StreamHandler.__init__(self, poller)
+        self.benchmark = None
+
     def connection_made(self, sock, rtt=0):
         stream = GenericProtocolStream(self.poller)
         stream.kind = self.conf["net.stream.proto"]
+        if self.benchmark:
+            self.benchmark.add(stream)
         stream.attach(self, sock, self.conf)
 
+    def connection_lost(self, stream):
+        if self.benchmark:
+            self.benchmark.remove(stream)
+
 #
 # Specializes stream in order to handle some byte-oriented
 # protocols like discard, chargen, and echo.
@@ -679,12 +1407,42 @@ class GenericProtocolStream(Stream):
         Stream.__init__(self, poller)
         self.buffer = None
         self.kind = ""
+        self.task = None
+        self.pipe = None
+        self.pipe_bytes = 0
+        self.times = None
+        self.io_calls = 0
 
+    #
+    # In zero-copy mode, which is available for plain TCP on Linux,
+    # chargen sends a file with sendfile(), echo moves data from the
+    # socket to a pipe and back with splice(), and discard receives
+    # with MSG_TRUNC, so that the kernel drops the data without
+    # copying it.  Python 2 has no sendmsg(), so we can't use
+    # MSG_ZEROCOPY and we send a file filled with "A" instead.
+    #
     def connection_made(self):
-        self.buffer = "A" * self.conf["net.stream.chunk"]
+        self.times = os.times()
+        chunk = self.conf["net.stream.chunk"]
+        self.buffer = "A" * chunk
+        self.recv_into = self.conf["net.stream.recv_into"]
+
+        if (self.conf["net.stream.zerocopy"] and
+            not self.conf["net.stream.secure"]):
+            if self.kind == "chargen" and SENDFILE:
+                self.buffer = tempfile.TemporaryFile()
+                self.buffer.write("A" * chunk)
+                self.buffer.flush()
+                self.buffer.seek(0)
+            elif self.kind == "echo" and SPLICE:
+                self.pipe = os.pipe()
+            elif self.kind == "discard" and sys.platform.startswith("linux"):
+                self.recv_into = True
+                self.recv_flags = socket.MSG_TRUNC
+
         duration = self.conf["net.stream.duration"]
         if duration >= 0:
-            POLLER.sched(duration, self._do_close)
+            self.task = self.poller.sched(duration, self._do_close)
         if self.kind == "discard":
             self.start_recv()
         elif self.kind == "chargen":
@@ -697,15 +1455,96 @@ class GenericProtocolStream(Stream):
     def _do_close(self, *args, **kwargs):
         self.close()
 
+    def connection_lost(self, exception):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        if self.pipe:
+            os.close(self.pipe[0])
+            os.close(self.pipe[1])
+            self.pipe = None
+        if not isinstance(self.buffer, basestring):
+            self.buffer.close()
+
+        if not self.times:
+            return
+
+        # Note that CPU times are for the whole process
+        times = os.times()
+        user, system = times[0] - self.times[0], times[1] - self.times[1]
+        elapsed = times[4] - self.times[4]
+        LOG.info("* %s: sent %d bytes, received %d bytes, CPU user %.2f s"
+          " system %.2f s (%.1f%% of %.2f s)" % (self.logname,
+          self.bytes_sent_tot, self.bytes_recv_tot, user, system,
+          100 * (user + system) / max(elapsed, 0.01), elapsed))
+
+    # Count the I/O calls, for the benchmark
+    def _read_once(self):
+        self.io_calls += 1
+        return Stream._read_once(self)
+
+    def _write_once(self):
+        self.io_calls += 1
+        return Stream._write_once(self)
+
+    def handle_read(self):
+        if not self.pipe:
+            Stream.handle_read(self)
+            return
+        self.io_calls += 1
+        try:
+            count = SPLICE(self.filenum, self.pipe[1], PIPE_SIZE,
+                           SPLICE_F_MOVE|SPLICE_F_NONBLOCK)
+        except OSError, exception:
+            if exception[0] in SOFT_ERRORS:
+                return
+            raise
+        if count == 0:
+            self.eof = True
+            self.poller.close(self)
+            return
+        self.bytes_recv_tot += count
+        self.pipe_bytes += count
+        self.poller.unset_readable(self)
+        self.poller.set_writable(self)
+
+    def handle_write(self):
+        if not self.pipe:
+            Stream.handle_write(self)
+            return
+        self.io_calls += 1
+        try:
+            count = SPLICE(self.pipe[0], self.filenum, self.pipe_bytes,
+                           SPLICE_F_MOVE|SPLICE_F_NONBLOCK)
+        except OSError, exception:
+            if exception[0] in SOFT_ERRORS:
+                return
+            raise
+        self.bytes_sent_tot += count
+        self.pipe_bytes -= count
+        if not self.pipe_bytes:
+            self.poller.unset_writable(self)
+            self.poller.set_readable(self)
+
     def recv_complete(self, octets):
-        self.start_recv()
         if self.kind == "echo":
+            if isinstance(octets, memoryview):
+                octets = octets.tobytes()
             self.start_send(octets)
+        # Echo stops reading when the peer does not read
+        if not self.send_throttled:
+            self.start_recv()
+
+    def send_resumed(self):
+        if self.kind == "echo":
+            self.start_recv()
 
     def send_complete(self):
         if self.kind == "echo":
             self.start_recv()
             return
+        if not isinstance(self.buffer, basestring):
+            self.buffer.seek(0)
         self.start_send(self.buffer)
 
 CONFIG.register_defaults({
@@ -726,6 +1565,22 @@ CONFIG.register_defaults({
     "net.stream.listen": False,
     "net.stream.port": 12345,
     "net.stream.proto": "",
+    "net.stream.json": "",
+    "net.stream.report_interval": 1.0,
+    "net.stream.recv_into": False,
+    "net.stream.continuous": False,
+    "net.stream.budget": 1 << 20,
+    "net.stream.budget_iterations": 32,
+    "net.stream.happy_eyeballs": False,
+    "net.stream.happy_eyeballs_delay": 0.25,
+    "net.stream.max_connects": 8,
+    "net.stream.backlog": 1024,
+    "net.stream.accept_batch": 64,
+    "net.stream.high_watermark": 0,
+    "net.stream.low_watermark": 0,
+    "net.stream.rx_timestamps": False,
+    "net.stream.tcp_info_interval": 0.5,
+    "net.stream.zerocopy": False,
 })
 
 def main(args):
@@ -748,6 +1603,22 @@ def main(args):
         "net.stream.listen": "Enable server mode",
         "net.stream.port": "Set client or server port",
         "net.stream.proto": "Set proto (chargen, discard, or echo)",
+        "net.stream.json": "Save the summary of each run as JSON (- = stdout)",
+        "net.stream.report_interval": "Interval between throughput reports (0 = off)",
+        "net.stream.recv_into": "Receive into pooled buffers",
+        "net.stream.continuous": "Read/write until EAGAIN at each wakeup",
+        "net.stream.budget": "Max bytes per wakeup in continuous mode",
+        "net.stream.budget_iterations": "Max I/O ops per wakeup in continuous mode",
+        "net.stream.happy_eyeballs": "Race IPv6 and IPv4 when connecting",
+        "net.stream.happy_eyeballs_delay": "Delay between connect attempts",
+        "net.stream.max_connects": "Max number of parallel connects",
+        "net.stream.backlog": "Length of the listen queue",
+        "net.stream.accept_batch": "Max accepts per wakeup",
+        "net.stream.high_watermark": "Pause producers above this many queued bytes (0 = off)",
+        "net.stream.low_watermark": "Resume producers below this many queued bytes",
+        "net.stream.rx_timestamps": "Time latency probes with kernel timestamps",
+        "net.stream.tcp_info_interval": "Interval between TCP_INFO samples (0 = off)",
+        "net.stream.zerocopy": "Avoid copies with sendfile, splice, MSG_TRUNC",
     })
 
     common.main("net.stream", "TCP bulk transfer test", args)
@@ -767,6 +1638,8 @@ def main(args):
 
     handler = GenericHandler(POLLER)
     handler.configure(conf)
+    handler.benchmark = benchmark.Benchmark(POLLER,
+      conf["net.stream.report_interval"], conf["net.stream.json"])
 
     if conf["net.stream.listen"]:
         if conf["net.stream.daemonize"]:
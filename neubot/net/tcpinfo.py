@@ -0,0 +1,160 @@
+# neubot/net/tcpinfo.py
+
+#
+# Copyright (c) 2012 Simone Basso <bassosimone@gmail.com>,
+#  NEXA Center for Internet & Society at Politecnico di Torino
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+''' Sample the kernel TCP state of a socket '''
+
+#
+# Throughput alone does not tell whether a transfer was limited
+# by the receiver window, by the congestion window or by losses,
+# so on Linux we periodically read struct tcp_info and we keep a
+# compact time series for each stream.  The sender-side fields
+# (cwnd, delivery and pacing rate) are meaningful only for the
+# direction in which we send.
+#
+
+import socket
+import struct
+import sys
+
+from neubot.utils import ticks
+
+# Value of TCP_INFO in <netinet/tcp.h>
+TCP_INFO = getattr(socket, "TCP_INFO", 11)
+
+#
+# The beginning of struct tcp_info, up to tcpi_delivery_rate,
+# which is available since Linux 4.9.  Older kernels return a
+# shorter structure and we zero-fill the missing fields.
+#
+FORMAT = "=8B24I4Q6IQ"
+SIZE = struct.calcsize(FORMAT)
+
+# Indexes of the fields we care about in the unpacked tuple
+RTT = 23
+RTTVAR = 24
+SND_CWND = 26
+TOTAL_RETRANS = 31
+PACING_RATE = 32
+DELIVERY_RATE = 42
+
+# The fields of each sample in the time series
+FIELDS = ("time", "rtt", "rttvar", "snd_cwnd", "retransmits",
+          "delivery_rate", "pacing_rate")
+
+def available():
+    ''' Returns True if we can sample TCP_INFO '''
+    return sys.platform.startswith("linux")
+
+def sample(sock):
+    ''' Read TCP_INFO and return the fields we care about '''
+    data = sock.getsockopt(socket.IPPROTO_TCP, TCP_INFO, SIZE)
+    if len(data) < SIZE:
+        data += "\0" * (SIZE - len(data))
+    info = struct.unpack(FORMAT, data)
+    return (info[RTT] / 1000000.0, info[RTTVAR] / 1000000.0,
+            info[SND_CWND], info[TOTAL_RETRANS], info[DELIVERY_RATE],
+            info[PACING_RATE])
+
+class TCPInfoSampler(object):
+
+    ''' Samples TCP_INFO at regular intervals '''
+
+    def __init__(self, poller, sock, interval):
+        ''' Initialize the sampler '''
+        self.poller = poller
+        self.sock = sock
+        self.interval = interval
+        self.series = []
+        self.task = None
+        self.begin = 0
+        self.retransmits_base = 0
+
+    def start(self):
+        ''' Start sampling '''
+        self.begin = ticks()
+        self._sample()
+
+    def _sample(self, *args, **kwargs):
+        ''' Take a sample and schedule the next one '''
+        self.task = self.poller.sched(self.interval, self._sample)
+        self.take()
+
+    def take(self):
+        ''' Append a sample to the time series '''
+        try:
+            values = sample(self.sock)
+        except (socket.error, struct.error):
+            return
+        self.series.append((round(ticks() - self.begin, 3),) + values)
+
+    #
+    # The retransmits counter is cumulative, so we remember its
+    # value at the time of the reset, and the summary counts only
+    # the retransmits that occurred after it.
+    #
+    def reset(self):
+        ''' Forget the samples taken so far '''
+        self.take()
+        if self.series:
+            self.retransmits_base = self.series[-1][4]
+        self.series = []
+
+    def stop(self):
+        ''' Take a last sample and stop sampling '''
+        if self.task:
+            self.task.cancel()
+            self.task = None
+            self.take()
+
+#
+# Tests that measure more than one direction with the same
+# streams, e.g. speedtest, summarize and reset the samplers at
+# the end of each phase, and use a different prefix for the
+# keys of each phase.
+#
+def summarize(samplers, prefix):
+    ''' Summarize the time series of one or more streams '''
+    summary = {
+        "rtt": 0.0,
+        "rttvar": 0.0,
+        "snd_cwnd": 0,
+        "retransmits": 0,
+        "delivery_rate": 0.0,
+        "pacing_rate": 0.0,
+    }
+    samples = [entry for sampler in samplers for entry in sampler.series]
+    if samples:
+        count = float(len(samples))
+        summary["rtt"] = sum(entry[1] for entry in samples) / count
+        summary["rttvar"] = sum(entry[2] for entry in samples) / count
+        summary["snd_cwnd"] = max(entry[3] for entry in samples)
+    for sampler in samplers:
+        if not sampler.series:
+            continue
+        # Retransmits are cumulative, rates are per stream
+        series = sampler.series
+        summary["retransmits"] += series[-1][4] - sampler.retransmits_base
+        summary["delivery_rate"] += (sum(entry[5] for entry in series)
+                                     / float(len(series)))
+        summary["pacing_rate"] += (sum(entry[6] for entry in series)
+                                   / float(len(series)))
+    return dict((prefix + key, value) for key, value in summary.items())
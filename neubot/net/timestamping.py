@@ -0,0 +1,121 @@
+# neubot/net/timestamping.py
+
+#
+# Copyright (c) 2012 Simone Basso <bassosimone@gmail.com>,
+#  NEXA Center for Internet & Society at Politecnico di Torino
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+''' Kernel receive timestamps '''
+
+#
+# When we measure latency with ticks() around a request, the time
+# the response waits in the socket buffer before the poller gets
+# around to dispatch it is counted as network delay.  On Linux we
+# can ask the kernel to timestamp each incoming packet with the
+# SO_TIMESTAMPNS option, and read the timestamp, which is in the
+# same clock of time.time(), with recvmsg().  Python 2 does not
+# provide recvmsg(), so we invoke it via ctypes.
+#
+
+import os
+import socket
+import struct
+import sys
+
+# Values in <asm-generic/socket.h>
+SO_TIMESTAMPNS = 35
+SCM_TIMESTAMPNS = SO_TIMESTAMPNS
+
+# Room for a cmsghdr carrying a struct timespec
+CONTROL_SIZE = 64
+
+def _find_recvmsg():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        func = libc.recvmsg
+    except (ImportError, OSError, AttributeError):
+        return None
+
+    class IOVec(ctypes.Structure):
+        _fields_ = [("iov_base", ctypes.c_void_p),
+                    ("iov_len", ctypes.c_size_t)]
+
+    class MsgHdr(ctypes.Structure):
+        _fields_ = [("msg_name", ctypes.c_void_p),
+                    ("msg_namelen", ctypes.c_uint32),
+                    ("msg_iov", ctypes.POINTER(IOVec)),
+                    ("msg_iovlen", ctypes.c_size_t),
+                    ("msg_control", ctypes.c_void_p),
+                    ("msg_controllen", ctypes.c_size_t),
+                    ("msg_flags", ctypes.c_int)]
+
+    func.argtypes = [ctypes.c_int, ctypes.POINTER(MsgHdr), ctypes.c_int]
+    func.restype = ctypes.c_ssize_t
+
+    # struct cmsghdr is aligned like a size_t
+    align = ctypes.sizeof(ctypes.c_size_t)
+    header = "@" + {4: "I", 8: "Q"}[align] + "ii"
+    header_size = (struct.calcsize(header) + align - 1) & ~(align - 1)
+    timespec = "@ll"
+
+    def recvmsg_into(fileno, buf, flags):
+        data = (ctypes.c_char * len(buf)).from_buffer(buf)
+        control = ctypes.create_string_buffer(CONTROL_SIZE)
+        iov = IOVec(ctypes.cast(data, ctypes.c_void_p), len(buf))
+        msg = MsgHdr(None, 0, ctypes.pointer(iov), 1,
+                     ctypes.cast(control, ctypes.c_void_p), CONTROL_SIZE, 0)
+        result = func(fileno, ctypes.byref(msg), flags)
+        if result < 0:
+            error = ctypes.get_errno()
+            raise socket.error(error, os.strerror(error))
+        return result, _parse_control(control.raw[:msg.msg_controllen])
+
+    def _parse_control(control):
+        offset = 0
+        while offset + header_size <= len(control):
+            length, level, kind = struct.unpack_from(header, control, offset)
+            if length < header_size:
+                break
+            if level == socket.SOL_SOCKET and kind == SCM_TIMESTAMPNS:
+                sec, nsec = struct.unpack_from(timespec, control,
+                                               offset + header_size)
+                return sec + nsec / 1000000000.0
+            offset += (length + align - 1) & ~(align - 1)
+        return None
+
+    return recvmsg_into
+
+RECVMSG_INTO = _find_recvmsg()
+
+def available():
+    ''' Returns True if we can read kernel timestamps '''
+    return RECVMSG_INTO is not None
+
+def enable(sock):
+    ''' Ask the kernel to timestamp the packets of @sock '''
+    sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+
+def recv_into(sock, buf, flags=0):
+    '''
+     Like sock.recv_into(buf, 0, flags), but returns a tuple that
+     also contains the kernel timestamp of the data, or None.
+    '''
+    return RECVMSG_INTO(sock.fileno(), buf, flags)
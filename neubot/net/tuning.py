@@ -0,0 +1,137 @@
+# neubot/net/tuning.py
+
+#
+# Copyright (c) 2012 Simone Basso <bassosimone@gmail.com>,
+#  NEXA Center for Internet & Society at Politecnico di Torino
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+''' Per-test TCP tuning profiles '''
+
+#
+# Latency probes want TCP_NODELAY, bulk transfers may want a
+# specific congestion control algorithm or larger buffers, and
+# BitTorrent sends many small REQUESTs interleaved with PIECEs.
+# So each test selects a named profile for each phase, and the
+# settings of each profile can be changed via the configuration
+# variables net.tuning.<profile>.<setting>.  Since the settings
+# affect the results, each result records the profiles in use.
+#
+
+import socket
+import sys
+
+from neubot.config import CONFIG
+from neubot.log import LOG
+
+# Values in <netinet/tcp.h> on Linux
+TCP_CONGESTION = getattr(socket, "TCP_CONGESTION", 13)
+TCP_NOTSENT_LOWAT = getattr(socket, "TCP_NOTSENT_LOWAT", 25)
+
+# Maximum length of the name of a congestion control algorithm
+TCP_CA_NAME_MAX = 16
+
+#
+# Zero (or empty) buffers and congestion control mean that we
+# don't touch the system default.  Zero notsent_lowat restores
+# the system default, so that a socket that switches from the
+# latency to the bulk profile is not left with a small value.
+#
+PROFILES = {
+    "latency": {
+        "nodelay": True,
+        "congestion": "",
+        "rcvbuf": 0,
+        "sndbuf": 0,
+        "notsent_lowat": 16384,
+    },
+    "bulk": {
+        "nodelay": False,
+        "congestion": "",
+        "rcvbuf": 0,
+        "sndbuf": 0,
+        "notsent_lowat": 0,
+    },
+    "bittorrent": {
+        "nodelay": True,
+        "congestion": "",
+        "rcvbuf": 0,
+        "sndbuf": 0,
+        "notsent_lowat": 0,
+    },
+}
+
+SETTINGS = ("nodelay", "congestion", "rcvbuf", "sndbuf", "notsent_lowat")
+
+def settings(conf, name):
+    ''' Return the settings of the profile @name '''
+    result = {}
+    for setting in SETTINGS:
+        result[setting] = conf.get("net.tuning.%s.%s" % (name, setting),
+                                   PROFILES[name][setting])
+    return result
+
+def apply(sock, name, values):
+    '''
+     Apply @values to @sock and return a string that describes
+     the profile @name, including the congestion control in use.
+    '''
+    linux = sys.platform.startswith("linux")
+    options = [(socket.IPPROTO_TCP, socket.TCP_NODELAY,
+                int(values["nodelay"]))]
+    if values["rcvbuf"]:
+        options.append((socket.SOL_SOCKET, socket.SO_RCVBUF,
+                        values["rcvbuf"]))
+    if values["sndbuf"]:
+        options.append((socket.SOL_SOCKET, socket.SO_SNDBUF,
+                        values["sndbuf"]))
+    if linux:
+        options.append((socket.IPPROTO_TCP, TCP_NOTSENT_LOWAT,
+                        values["notsent_lowat"]))
+        if values["congestion"]:
+            options.append((socket.IPPROTO_TCP, TCP_CONGESTION,
+                            str(values["congestion"])))
+
+    for level, option, value in options:
+        try:
+            sock.setsockopt(level, option, value)
+        except socket.error, exception:
+            LOG.warning("tuning: %s: cannot set option %d to %s: %s" % (
+                        name, option, value, exception))
+
+    congestion = values["congestion"]
+    if linux:
+        try:
+            congestion = sock.getsockopt(socket.IPPROTO_TCP, TCP_CONGESTION,
+                                         TCP_CA_NAME_MAX).split("\0", 1)[0]
+        except socket.error:
+            pass
+
+    return "%s(congestion=%s,nodelay=%d,notsent_lowat=%d,rcvbuf=%d,"\
+           "sndbuf=%d)" % (name, congestion, values["nodelay"],
+           values["notsent_lowat"], values["rcvbuf"], values["sndbuf"])
+
+def summarize(streams):
+    ''' Describe all the profiles used by @streams '''
+    descriptions = set()
+    for stream in streams:
+        descriptions.update(stream.tunings.values())
+    return "; ".join(sorted(descriptions))
+
+CONFIG.register_defaults(dict(("net.tuning.%s.%s" % (name, setting),
+                               PROFILES[name][setting])
+                              for name in PROFILES for setting in SETTINGS))
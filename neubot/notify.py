@@ -31,18 +31,21 @@ import asyncore
 import collections
 import logging
 
-from neubot.net.poller import POLLER
+from neubot.net.poller import current_poller
 from neubot.utils import T
 
 INTERVAL = 10
 
 class Notifier(object):
-    def __init__(self):
+    def __init__(self, poller=None):
+        if not poller:
+            poller = current_poller()
+        self.poller = poller
         self._timestamps = collections.defaultdict(int)
         self._subscribers = collections.defaultdict(list)
         self._tofire = []
 
-        POLLER.sched(INTERVAL, self._periodic)
+        self.poller.sched(INTERVAL, self._periodic)
 
     def subscribe(self, event, func, context=None, periodic=False):
         queue = self._subscribers[event]
@@ -69,7 +72,7 @@ class Notifier(object):
         self._fireq(event, queue)
 
     def _periodic(self, *args, **kwargs):
-        POLLER.sched(INTERVAL, self._periodic)
+        self.poller.sched(INTERVAL, self._periodic)
         self._tofire, q = [], self._tofire
         for event in q:
 
@@ -0,0 +1,260 @@
+# neubot/prefork.py
+
+#
+# Copyright (c) 2012 Simone Basso <bassosimone@gmail.com>,
+#  NEXA Center for Internet & Society at Politecnico di Torino
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+''' Pre-fork multi-process server '''
+
+#
+# The server binds all its listening sockets and then forks
+# a number of workers that inherit them, so that the kernel
+# spreads the incoming connections among the workers and the
+# load among many cores.  The parent process becomes a supervisor
+# that restarts the workers that crash and aggregates the stats
+# that each worker periodically writes on a pipe.
+#
+
+import errno
+import fcntl
+import os
+import signal
+
+from neubot.compat import json
+from neubot.log import LOG
+from neubot.net import dns
+from neubot.net.poller import Pollable
+from neubot.net.poller import Poller
+from neubot.net.stream import ACCEPT_STATS
+
+# Interval between the stats reports of each worker
+STATS_INTERVAL = 10
+
+# Interval between checks for dead workers
+REAP_INTERVAL = 1
+
+# The stats that we sum when aggregating workers stats
+SUMMED = ("iterations", "deferred", "stalls", "readable", "writable",
+          "accepted", "accept_errors", "accept_wakeups")
+
+# The histograms that we merge when aggregating workers stats
+MERGED = ("wait_usec", "busy_usec", "lag_usec")
+
+class WorkerPipe(Pollable):
+
+    ''' Reads the stats reports of a worker '''
+
+    def __init__(self, supervisor, pid, fileno):
+        ''' Initialize the pipe '''
+        Pollable.__init__(self)
+        self.supervisor = supervisor
+        self.pid = pid
+        self.filenum = fileno
+        self.buffer = ""
+
+        # Wait "forever"
+        self.watchdog = -1
+
+    def __repr__(self):
+        return "stats pipe of worker %d" % self.pid
+
+    def fileno(self):
+        ''' Return file number '''
+        return self.filenum
+
+    def handle_read(self):
+        ''' Read stats reports, one per line '''
+        try:
+            data = os.read(self.filenum, 65536)
+        except OSError, exception:
+            if exception[0] == errno.EAGAIN:
+                return
+            data = ""
+        if not data:
+            self.supervisor.poller.close(self)
+            return
+        self.buffer += data
+        while "\n" in self.buffer:
+            line, self.buffer = self.buffer.split("\n", 1)
+            try:
+                self.supervisor.stats[self.pid] = json.loads(line)
+            except ValueError:
+                LOG.warning("prefork: invalid stats from %d" % self.pid)
+
+    def handle_close(self):
+        ''' Close the pipe '''
+        if self.filenum >= 0:
+            os.close(self.filenum)
+            self.filenum = -1
+
+class Supervisor(object):
+
+    ''' Forks the workers and keeps them running '''
+
+    def __init__(self, worker_poller, count):
+        ''' Initialize the supervisor '''
+        self.worker_poller = worker_poller
+        self.count = count
+        self.poller = Poller(1, worker_poller.backend.name)
+        self.interval = STATS_INTERVAL
+        self.workers = {}
+        self.stats = {}
+        self.restarts = 0
+        self.stopping = False
+
+    def start(self):
+        ''' Fork all the workers '''
+        LOG.info("prefork: starting %d workers" % self.count)
+        for _ in range(self.count):
+            self._spawn()
+        self.poller.sched(REAP_INTERVAL, self._reap)
+
+    def run(self):
+        ''' Fork all the workers and supervise them '''
+        signal.signal(signal.SIGTERM, self._signal)
+        signal.signal(signal.SIGINT, self._signal)
+        self.start()
+        self.poller.loop_forever()
+        self.stop()
+
+    def _signal(self, signum, frame):
+        ''' Invoked when we are asked to terminate '''
+        self.poller.break_loop()
+
+    def stop(self):
+        ''' Terminate all the workers '''
+        self.stopping = True
+        for pid in self.workers.keys():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        for pid, pipe in self.workers.items():
+            while True:
+                try:
+                    os.waitpid(pid, 0)
+                except OSError, exception:
+                    if exception[0] == errno.EINTR:
+                        continue
+                break
+            self.poller.close(pipe)
+        self.workers.clear()
+        self.stats.clear()
+
+    def _spawn(self):
+        ''' Fork a new worker '''
+        rfd, wfd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(rfd)
+            status = 1
+            try:
+                self._worker(wfd)
+                status = 0
+            except (KeyboardInterrupt, SystemExit):
+                pass
+            except:
+                LOG.exception()
+            os._exit(status)
+
+        os.close(wfd)
+        fcntl.fcntl(rfd, fcntl.F_SETFL, os.O_NONBLOCK)
+        pipe = WorkerPipe(self, pid, rfd)
+        self.workers[pid] = pipe
+        self.poller.set_readable(pipe)
+        LOG.debug("prefork: started worker %d" % pid)
+
+    def _worker(self, wfd):
+        ''' The main loop of a worker '''
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+        # We don't need the pipes of the other workers
+        for pipe in self.workers.values():
+            pipe.handle_close()
+        self.workers.clear()
+
+        fcntl.fcntl(wfd, fcntl.F_SETFL, os.O_NONBLOCK)
+        poller = self.worker_poller
+        poller.after_fork()
+        dns.RESOLVER.after_fork()
+
+        def report():
+            ''' Write our stats on the pipe '''
+            poller.sched(self.interval, report)
+            stats = poller.stats.snap()
+            stats["readable"] = len(poller.readset)
+            stats["writable"] = len(poller.writeset)
+            stats.update(ACCEPT_STATS)
+            try:
+                os.write(wfd, json.dumps(stats) + "\n")
+            except OSError:
+                pass
+
+        poller.sched(0, report)
+        poller.loop()
+
+    #
+    # A worker that exits with success has nothing left to do,
+    # so we restart only the workers that crash or that are killed
+    # by a signal.  We restart them at most once per REAP_INTERVAL,
+    # so that a worker that crashes at startup does not make us
+    # fork like crazy.
+    #
+    def _reap(self):
+        ''' Restart the workers that died '''
+        self.poller.sched(REAP_INTERVAL, self._reap)
+        for pid in self.workers.keys():
+            try:
+                child, status = os.waitpid(pid, os.WNOHANG)
+            except OSError:
+                continue
+            if child == 0:
+                continue
+            self.poller.close(self.workers.pop(pid))
+            self.stats.pop(pid, None)
+            if self.stopping:
+                continue
+            if os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0:
+                LOG.info("prefork: worker %d exited" % pid)
+                continue
+            LOG.warning("prefork: worker %d died (status %d): restarting"
+                        % (pid, status))
+            self.restarts += 1
+            self._spawn()
+
+    def snap(self):
+        ''' Aggregate the stats of all the workers '''
+        total = dict((key, 0) for key in SUMMED)
+        histograms = dict((key, {}) for key in MERGED)
+        for stats in self.stats.values():
+            for key in SUMMED:
+                total[key] += stats.get(key, 0)
+            for key in MERGED:
+                for bucket, count in stats.get(key, []):
+                    histograms[key][bucket] = (histograms[key].get(bucket, 0)
+                                               + count)
+        for key in MERGED:
+            total[key] = sorted(map(list, histograms[key].items()))
+        return {
+                "workers": len(self.workers),
+                "restarts": self.restarts,
+                "total": total,
+                "per_worker": self.stats,
+               }
@@ -36,6 +36,8 @@ if __name__ == "__main__":
 
 from neubot.http.client import ClientHTTP
 from neubot.http.message import Message
+from neubot.http.message import urlsplit
+from neubot.net import dns
 from neubot.net.poller import POLLER
 
 from neubot.config import CONFIG
@@ -49,6 +51,9 @@ from neubot import privacy
 from neubot import runner_core
 from neubot import runner_lst
 
+# Resolve the names we need this many seconds before the rendezvous
+PREFETCH = 30
+
 def _open_browser_on_windows(page):
 
     ''' Open a browser in the user session to notify something '''
@@ -76,9 +81,15 @@ class ClientRendezvous(ClientHTTP):
         ClientHTTP.__init__(self, poller)
         self._interval = 0
         self._task = None
+        self._prefetch_task = None
 
     def connect_uri(self, uri=None, count=None):
-        self._task = None
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._prefetch_task:
+            self._prefetch_task.cancel()
+            self._prefetch_task = None
 
         if not privacy.allowed_to_run():
             _open_browser_on_windows('privacy.html')
@@ -197,12 +208,43 @@ class ClientRendezvous(ClientHTTP):
 
         LOG.info("* Next rendezvous in %d seconds" % interval)
 
+        # Make sure there is just one pending rendezvous
+        if self._task:
+            self._task.cancel()
+
         fn = lambda *args, **kwargs: self.connect_uri()
-        self._task = POLLER.sched(interval, fn)
+        self._task = self.poller.sched(interval, fn)
+
+        if self._prefetch_task:
+            self._prefetch_task.cancel()
+        self._prefetch_task = self.poller.sched(max(0, interval - PREFETCH),
+                                                self._prefetch)
 
         STATE.update("idle", publish=False)
         STATE.update("next_rendezvous", self._task.timestamp)
 
+    #
+    # Warm up the DNS cache with the names of the master server
+    # and of the test servers, so that the rendezvous and the test
+    # don't wait for the resolver.
+    #
+    def _prefetch(self):
+        self._prefetch_task = None
+
+        family = dns.connect_family(self.conf)
+
+        endpoints = set([(CONFIG["agent.master"], 9773, family)])
+        for uris in runner_lst.RUNNER_LST.avail.values():
+            for uri in uris:
+                try:
+                    scheme, address, port, pathquery = urlsplit(uri)
+                    endpoints.add((address, int(port), family))
+                except ValueError:
+                    pass
+
+        LOG.debug("* Prefetching: %s" % sorted(endpoints))
+        dns.prefetch(self.poller, endpoints)
+
 CONFIG.register_defaults({
     "rendezvous.client.debug": False,
     "rendezvous.client.version": common.VERSION,
@@ -27,6 +27,7 @@ the negotiate server and the test server.
 """
 
 import gc
+import os
 import sys
 
 if __name__ == "__main__":
@@ -41,7 +42,9 @@ from neubot.negotiate.server import NEGOTIATE_SERVER
 from neubot.negotiate.server_speedtest import NEGOTIATE_SERVER_SPEEDTEST
 from neubot.negotiate.server_bittorrent import NEGOTIATE_SERVER_BITTORRENT
 from neubot.net.dns import DNS_CACHE
+from neubot.net.stream import accept_stats
 from neubot.notify import NOTIFIER
+from neubot.prefork import Supervisor
 from neubot.state import STATE
 
 from neubot.compat import json
@@ -63,6 +66,11 @@ import neubot.speedtest.wrapper
 class DebugAPI(ServerHTTP):
     ''' Implements the debugging API '''
 
+    def __init__(self, poller, supervisor=None):
+        ''' Initialize the debugging API '''
+        ServerHTTP.__init__(self, poller)
+        self.supervisor = supervisor
+
     def process_request(self, stream, request):
         ''' Process HTTP request and return response '''
 
@@ -88,10 +96,11 @@ class DebugAPI(ServerHTTP):
                     'NEGOTIATE_SERVER_SPEEDTEST.clients': \
                         len(NEGOTIATE_SERVER_SPEEDTEST.clients),
                     'DNS_CACHE': len(DNS_CACHE),
-                    'POLLER.tasks': len(POLLER.tasks),
-                    'POLLER.pending': len(POLLER.pending),
-                    'POLLER.readset': len(POLLER.readset),
-                    'POLLER.writeset': len(POLLER.writeset),
+                    'POLLER.tasks': len(self.poller.tasks),
+                    'POLLER.readset': len(self.poller.readset),
+                    'POLLER.writeset': len(self.poller.writeset),
+                    'POLLER.deadlines': len(self.poller.deadlines),
+                    'POLLER.watched': len(self.poller.watched),
                     'LOG._queue': len(LOG._queue),
                     'CONFIG.conf': len(CONFIG.conf),
                     'NOTIFIER._timestamps': len(NOTIFIER._timestamps),
@@ -100,6 +109,18 @@ class DebugAPI(ServerHTTP):
                     'STATE._events': len(STATE._events),
                    }
 
+        elif request.uri == '/debugmem/poller':
+            body = self.poller.stats.snap()
+
+        elif request.uri == '/debugmem/accept':
+            body = accept_stats()
+
+        elif request.uri == '/debugmem/workers':
+            if self.supervisor:
+                body = self.supervisor.snap()
+            else:
+                body = {}
+
         elif request.uri == '/debugmem/garbage':
             body = [str(obj) for obj in gc.garbage]
 
@@ -170,6 +191,7 @@ CONFIG.register_defaults({
     "server.rendezvous": False,         # Not needed on the random server
     "server.sapi": True,
     "server.speedtest": True,
+    "server.workers": 0,
 })
 
 def main(args):
@@ -188,11 +210,17 @@ def main(args):
         "server.rendezvous": "Start up rendezvous server",
         "server.sapi": "Turn on Server-side API",
         "server.speedtest": "Start up Speedtest test and negotiate server",
+        "server.workers": "Number of worker processes (0 means no fork)",
     })
 
     common.main("server", "Neubot server-side component", args)
     conf = CONFIG.copy()
 
+    if conf["server.workers"] < 0 or (conf["server.workers"] > 0 and
+                                      not hasattr(os, "fork")):
+        sys.stderr.write("server: invalid number of workers\n")
+        sys.exit(1)
+
     #
     # Configure our global HTTP server and make
     # sure that we don't provide filesystem access
@@ -249,11 +277,25 @@ def main(args):
         HTTP_SERVER.register_child(server, "/sapi")
 
     #
-    # Create localhost-only debug server
+    # In pre-fork mode the workers inherit the listening
+    # sockets and run the poller loop, while this process
+    # supervises them.
+    #
+    supervisor = None
+    if conf["server.workers"] > 0:
+        supervisor = Supervisor(POLLER, conf["server.workers"])
+
+    #
+    # Create localhost-only debug server.  In pre-fork
+    # mode it runs in the supervisor, so that it can report
+    # the aggregate stats of the workers.
     #
     if CONFIG['server.debug']:
         LOG.info('server: Starting debug server at 127.0.0.1:9774')
-        server = DebugAPI(POLLER)
+        if supervisor:
+            server = DebugAPI(supervisor.poller, supervisor)
+        else:
+            server = DebugAPI(POLLER)
         server.configure(conf)
         server.listen(('127.0.0.1', 9774))
 
@@ -268,7 +310,10 @@ def main(args):
         LOG.redirect()
 
     system.drop_privileges(LOG.error)
-    POLLER.loop()
+    if supervisor:
+        supervisor.run()
+    else:
+        POLLER.loop()
 
 if __name__ == "__main__":
     main(sys.argv)
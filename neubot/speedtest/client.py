@@ -31,7 +31,10 @@ from neubot.database import table_speedtest
 from neubot.http.client import ClientHTTP
 from neubot.http.message import Message
 from neubot.log import LOG
+from neubot.net import tcpinfo
+from neubot.net import tuning
 from neubot.net.poller import POLLER
+from neubot.net.poller import PRIORITY_HIGH
 from neubot.notify import NOTIFIER
 from neubot.state import STATE
 from neubot.speedtest.wrapper import SpeedtestCollect
@@ -60,16 +63,23 @@ class ClientLatency(ClientHTTP):
         self.ticks = {}
 
     def connection_ready(self, stream):
+        stream.priority = PRIORITY_HIGH
+        stream.set_profile("latency")
         request = Message()
         request.compose(method="HEAD", pathquery="/speedtest/latency",
           host=self.host_header)
         request["authorization"] = self.conf.get(
           "speedtest.client.authorization", "")
         self.ticks[stream] = utils.ticks()
+        stream.start_timestamps()
         stream.send_request(request)
 
     def got_response(self, stream, request, response):
-        ticks = utils.ticks() - self.ticks[stream]
+        if stream.tx_time is not None and stream.rx_time is not None:
+            ticks = stream.rx_time - stream.tx_time
+        else:
+            ticks = utils.ticks() - self.ticks[stream]
+        stream.stop_timestamps()
         self.conf.setdefault("speedtest.client.latency",
           []).append(ticks)
 
@@ -80,6 +90,8 @@ class ClientDownload(ClientHTTP):
         self.bytes = {}
 
     def connection_ready(self, stream):
+        stream.priority = PRIORITY_HIGH
+        stream.set_profile("bulk")
         request = Message()
         request.compose(method="GET", pathquery="/speedtest/download",
           host=self.host_header)
@@ -88,6 +100,7 @@ class ClientDownload(ClientHTTP):
           "speedtest.client.authorization", "")
         self.ticks[stream] = utils.ticks()
         self.bytes[stream] = stream.bytes_recv_tot
+        stream.start_tcp_info()
         response = Message()
         response.body.write = lambda piece: None
         stream.send_request(request, response)
@@ -104,6 +117,8 @@ class ClientUpload(ClientHTTP):
         self.bytes = {}
 
     def connection_ready(self, stream):
+        stream.priority = PRIORITY_HIGH
+        stream.set_profile("bulk")
         request = Message()
         request.compose(method="POST", body=RandomBody(ESTIMATE["upload"]),
           pathquery="/speedtest/upload", host=self.host_header)
@@ -111,6 +126,7 @@ class ClientUpload(ClientHTTP):
           "speedtest.client.authorization", "")
         self.ticks[stream] = utils.ticks()
         self.bytes[stream] = stream.bytes_sent_tot
+        stream.start_tcp_info()
         stream.send_request(request)
 
     def got_response(self, stream, request, response):
@@ -164,6 +180,19 @@ def obj_to_dict(obj):
         "privacy_can_publish": obj.privacy_can_share,   #XXX
         "platform": obj.platform,
         "neubot_version": obj.neubot_version,
+        "tcp_download_rtt": obj.tcp_download_rtt,
+        "tcp_download_rttvar": obj.tcp_download_rttvar,
+        "tcp_download_snd_cwnd": obj.tcp_download_snd_cwnd,
+        "tcp_download_retransmits": obj.tcp_download_retransmits,
+        "tcp_download_delivery_rate": obj.tcp_download_delivery_rate,
+        "tcp_download_pacing_rate": obj.tcp_download_pacing_rate,
+        "tcp_upload_rtt": obj.tcp_upload_rtt,
+        "tcp_upload_rttvar": obj.tcp_upload_rttvar,
+        "tcp_upload_snd_cwnd": obj.tcp_upload_snd_cwnd,
+        "tcp_upload_retransmits": obj.tcp_upload_retransmits,
+        "tcp_upload_delivery_rate": obj.tcp_upload_delivery_rate,
+        "tcp_upload_pacing_rate": obj.tcp_upload_pacing_rate,
+        "tuning": obj.tuning,
     }
     return dictionary
 
@@ -197,6 +226,13 @@ class ClientCollect(ClientHTTP):
 
         m1.connectTime = sum(self.rtts) / len(self.rtts)
 
+        for phase in ("download", "upload"):
+            summary = self.conf.get("speedtest.client.tcp_info_%s" % phase,
+                                    {})
+            for key, value in summary.items():
+                setattr(m1, key, value)
+        m1.tuning = self.conf.get("speedtest.client.tuning", "")
+
         s = marshal.marshal_object(m1, "text/xml")
         stringio = StringIO.StringIO(s)
 
@@ -365,10 +401,25 @@ class ClientSpeedtest(ClientHTTP):
                     STATE.update("test_%s" % self.state,
                       utils.speed_formatter(speed))
                     LOG.complete("done, %s\n" % utils.speed_formatter(speed))
+
+                    #
+                    # The same streams are used for both directions,
+                    # so we summarize TCP_INFO at the end of each phase
+                    # and we start again from scratch.
+                    #
+                    samplers = [stream.tcp_info for stream in self.streams
+                                if stream.tcp_info]
+                    self.conf["speedtest.client.tcp_info_%s" % self.state] = \
+                      tcpinfo.summarize(samplers, "tcp_%s_" % self.state)
+                    for sampler in samplers:
+                        sampler.reset()
+
                     if self.state == "download":
                         self.state = "upload"
                     else:
                         self.state = "collect"
+                        self.conf["speedtest.client.tuning"] = \
+                          tuning.summarize(self.streams)
                 elif elapsed > LO_THRESH/3:
                     del self.conf["speedtest.client.%s" % self.state]
                     ESTIMATE[self.state] *= TARGET/elapsed
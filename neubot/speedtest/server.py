@@ -25,6 +25,7 @@
 from neubot.utils.blocks import RandomBody
 from neubot.http.message import Message
 from neubot.http.server import ServerHTTP
+from neubot.net.poller import PRIORITY_HIGH
 
 class SpeedtestServer(ServerHTTP):
 
@@ -46,6 +47,12 @@ class SpeedtestServer(ServerHTTP):
         # memory consumed by the server under control again.
         #
         request.body.write = lambda data: None
+        if isgood:
+            stream.priority = PRIORITY_HIGH
+            if request.uri == '/speedtest/latency':
+                stream.set_profile('latency')
+            else:
+                stream.set_profile('bulk')
         return isgood
 
     @staticmethod
@@ -64,6 +64,19 @@ class SpeedtestCollect(object):
         self.privacy_can_share = 0
         self.platform = ''
         self.neubot_version = ''
+        self.tcp_download_rtt = 0.0
+        self.tcp_download_rttvar = 0.0
+        self.tcp_download_snd_cwnd = 0
+        self.tcp_download_retransmits = 0
+        self.tcp_download_delivery_rate = 0.0
+        self.tcp_download_pacing_rate = 0.0
+        self.tcp_upload_rtt = 0.0
+        self.tcp_upload_rttvar = 0.0
+        self.tcp_upload_snd_cwnd = 0
+        self.tcp_upload_retransmits = 0
+        self.tcp_upload_delivery_rate = 0.0
+        self.tcp_upload_pacing_rate = 0.0
+        self.tuning = ''
 
 class SpeedtestNegotiate_Response(object):
 
@@ -195,6 +208,19 @@ class SpeedtestWrapper(ServerHTTP):
             'privacy_can_share': xmlreq.privacy_can_share,
             'platform': xmlreq.platform,
             'neubot_version': xmlreq.neubot_version,
+            'tcp_download_rtt': xmlreq.tcp_download_rtt,
+            'tcp_download_rttvar': xmlreq.tcp_download_rttvar,
+            'tcp_download_snd_cwnd': xmlreq.tcp_download_snd_cwnd,
+            'tcp_download_retransmits': xmlreq.tcp_download_retransmits,
+            'tcp_download_delivery_rate': xmlreq.tcp_download_delivery_rate,
+            'tcp_download_pacing_rate': xmlreq.tcp_download_pacing_rate,
+            'tcp_upload_rtt': xmlreq.tcp_upload_rtt,
+            'tcp_upload_rttvar': xmlreq.tcp_upload_rttvar,
+            'tcp_upload_snd_cwnd': xmlreq.tcp_upload_snd_cwnd,
+            'tcp_upload_retransmits': xmlreq.tcp_upload_retransmits,
+            'tcp_upload_delivery_rate': xmlreq.tcp_upload_delivery_rate,
+            'tcp_upload_pacing_rate': xmlreq.tcp_upload_pacing_rate,
+            'tuning': xmlreq.tuning,
         }
         # XXX Here we don't rewrite content-length which becomes bogus
         request['content-type'] = 'application/json'
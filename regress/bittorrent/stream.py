@@ -179,6 +179,21 @@ class TestReassembler_SingleChar(TestReassembler_Base):
             m = buffer(m, amt)
         self.check_results()
 
+# Receive the messages into a reused buffer, like Stream._read_into()
+class TestReassembler_Pooled(TestReassembler_Base):
+    def runTest(self):
+        """Make sure the reader copies what it keeps from the buffer"""
+        amt = 1000
+        buf = bytearray(amt)
+        m = "".join(self.messages)
+        while m:
+            count = min(amt, len(m))
+            buf[:count] = m[:count]
+            self.stream.recv_complete(memoryview(buf)[:count])
+            buf[:] = "X" * amt
+            m = buffer(m, count)
+        self.check_results()
+
 #
 #  ____
 # |  _ \   __ _  _ __  ___   ___  _ __
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2012 Simone Basso <bassosimone@gmail.com>,
+#  NEXA Center for Internet & Society at Politecnico di Torino
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+''' Benchmark the per-message cost of the BitTorrent stream '''
+
+import logging
+import struct
+import sys
+
+sys.path.insert(0, '.')
+
+from neubot.bittorrent.stream import StreamBitTorrent
+from neubot.bittorrent.stream import PIECE
+from neubot.bittorrent.stream import REQUEST
+from neubot.log import LOG
+from neubot import utils
+
+# Number of messages for each run
+MESSAGES = 50000
+
+# We report the best of REPEAT runs
+REPEAT = 3
+
+# Size of the block of each PIECE
+BLOCK = "A" * 16384
+
+class NullParent(object):
+    ''' Parent that ignores the messages '''
+
+    numpieces = 1 << 20
+
+    def got_request(self, stream, index, begin, length):
+        ''' Got a REQUEST '''
+
+    def got_piece(self, stream, index, begin, block):
+        ''' Got a PIECE '''
+
+class NullStream(StreamBitTorrent):
+    ''' A stream that does not send anything '''
+
+    def __init__(self):
+        ''' Initialize the stream '''
+        StreamBitTorrent.__init__(self, None)
+        self.parent = NullParent()
+        self.complete = True
+        self.got_anything = True
+
+    def start_send(self, octets):
+        ''' Drop the message '''
+
+def run(name, func):
+    ''' Run @func MESSAGES times '''
+    elapsed = float('inf')
+    for _ in range(REPEAT):
+        begin = utils.ticks()
+        for index in xrange(MESSAGES):
+            func(index)
+        elapsed = min(elapsed, utils.ticks() - begin)
+    print('%-14s noisy=%-5s %s per message' % (name, LOG.noisy,
+          utils.time_formatter(elapsed / MESSAGES)))
+
+def main():
+    ''' Benchmark REQUEST and PIECE in both directions '''
+    logging.getLogger().setLevel(logging.ERROR)
+    stream = NullStream()
+    request = struct.pack("!cIII", REQUEST, 7, 16384, 16384)
+    piece = struct.pack("!cII", PIECE, 7, 16384) + BLOCK
+    run('send REQUEST', lambda index: stream.send_request(index, 0, 16384))
+    run('send PIECE', lambda index: stream.send_piece(index, 0, BLOCK))
+    run('got REQUEST', lambda index: stream._got_message(request))
+    run('got PIECE', lambda index: stream._got_message(piece))
+
+if __name__ == '__main__':
+    main()
@@ -59,5 +59,21 @@ class TestRenameColumn(unittest.TestCase):
         self.assertEqual(query, 'CREATE TABLE Person (id INTEGER PRIMARY '
                                 'KEY, age INTEGER, surname TEXT, name TEXT)')
 
+    def test_data(self):
+        ''' Make sure that data ends up in the right columns '''
+        template = dict(('column%d' % index, index) for index in range(32))
+        mapping = dict(('column%d' % index, 'renamed%d' % index)
+                       for index in range(0, 32, 3))
+        connection = sqlite3.connect(':memory:')
+        connection.row_factory = sqlite3.Row
+        connection.execute(_table_utils.make_create_table('Numbers',
+                                                          template))
+        connection.execute(_table_utils.make_insert_into('Numbers',
+                                                         template), template)
+        _table_utils.rename_column(connection, 'Numbers', template, mapping)
+        row = connection.execute('SELECT * FROM Numbers;').fetchone()
+        for name, value in template.items():
+            self.assertEqual(row[mapping.get(name, name)], value)
+
 if __name__ == '__main__':
     unittest.main()
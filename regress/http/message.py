@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2012 Simone Basso <bassosimone@gmail.com>,
+#  NEXA Center for Internet & Society at Politecnico di Torino
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import sys
+import unittest
+
+if __name__ == "__main__":
+    sys.path.insert(0, ".")
+
+from neubot.http import message
+from neubot.log import LOG
+
+class TestCanonical(unittest.TestCase):
+    def runTest(self):
+        """Make sure we capitalize and cache header names"""
+        self.assertEqual(message.canonical("content-length"),
+                         "Content-Length")
+        self.assertEqual(message.canonical("x-neubot-test"), "X-Neubot-Test")
+        self.assertTrue(message.canonical("content-length") is
+                        message.CANONICAL["content-length"])
+
+class TestFormatdate(unittest.TestCase):
+    def runTest(self):
+        """Make sure we cache the Date header for one second"""
+        date = message.formatdate()
+        self.assertTrue(date.endswith(" GMT"))
+        self.assertTrue(message.formatdate() is message._DATE[1])
+
+class TestSerializeHeaders(unittest.TestCase):
+    def test_response(self):
+        """Make sure we serialize a response into a string"""
+        msg = message.Message()
+        msg.compose(code="200", reason="Ok", body="{}",
+                    mimetype="application/json", date=False,
+                    nocache=False)
+        self.assertEqual(sorted(msg.serialize_headers().split("\r\n")), [
+                         "", "", "Content-Length: 2",
+                         "Content-Type: application/json",
+                         "HTTP/1.1 200 Ok"])
+
+    def test_request(self):
+        """Make sure we serialize a request and end headers"""
+        msg = message.Message()
+        msg.compose(method="GET", pathquery="/speedtest/latency",
+                    host="127.0.0.1:8080")
+        string = msg.serialize_headers()
+        self.assertTrue(isinstance(string, str))
+        self.assertTrue(string.startswith("GET /speedtest/latency "
+                                          "HTTP/1.1\r\n"))
+        self.assertTrue(string.endswith("\r\n\r\n"))
+        self.assertTrue("\r\nHost: 127.0.0.1:8080\r\n" in string)
+        self.assertTrue("\r\nDate: %s\r\n" % message.formatdate() in string)
+
+    def test_debug(self):
+        """Make sure we log the headers only when debugging"""
+        lines = []
+        saved = LOG.logger
+        LOG.logger = lambda severity, line: lines.append(line)
+        try:
+            msg = message.Message()
+            msg.compose(code="204", reason="No Content", date=False,
+                        nocache=False)
+            msg.serialize_headers()
+            self.assertEqual(lines, [])
+            LOG.verbose()
+            msg.serialize_headers()
+        finally:
+            LOG.quiet()
+            LOG.logger = saved
+        self.assertEqual(lines, ["> HTTP/1.1 204 No Content",
+                                 "> Content-Length: 0", ">"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2012 Simone Basso <bassosimone@gmail.com>,
+#  NEXA Center for Internet & Society at Politecnico di Torino
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+''' Benchmark the composition and serialization of small messages '''
+
+import logging
+import sys
+
+sys.path.insert(0, '.')
+
+from neubot.http.message import Message
+from neubot.log import LOG
+from neubot import utils
+
+# Number of messages for each run
+MESSAGES = 20000
+
+def response():
+    ''' Compose and serialize a small API response '''
+    message = Message()
+    message.compose(code="200", reason="Ok", body='{"queue_len": 0}',
+                    mimetype="application/json")
+    return message.serialize_headers()
+
+def request():
+    ''' Compose and serialize a speedtest request '''
+    message = Message()
+    message.compose(method="GET", pathquery="/speedtest/download",
+                    host="master.neubot.org:8080")
+    message["range"] = "bytes=0-1048575"
+    message["authorization"] = "8c1d9b0b-1cc2-4cd8-9e7b-71b2f2f4a9e5"
+    return message.serialize_headers()
+
+def run(name, func):
+    ''' Run @func MESSAGES times '''
+    begin = utils.ticks()
+    for _ in range(MESSAGES):
+        func()
+    elapsed = utils.ticks() - begin
+    print('%-10s noisy=%-5s %s per message' % (name, LOG.noisy,
+          utils.time_formatter(elapsed / MESSAGES)))
+
+def main():
+    ''' Benchmark message serialization '''
+    logging.getLogger().setLevel(logging.ERROR)
+    run('response', response)
+    run('request', request)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2012 Simone Basso <bassosimone@gmail.com>,
+#  NEXA Center for Internet & Society at Politecnico di Torino
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import random
+import sys
+import unittest
+
+if __name__ == "__main__":
+    sys.path.insert(0, ".")
+
+from neubot.http import stream
+
+REQUEST = ("POST /speedtest/collect HTTP/1.1\r\n"
+           "Host: 127.0.0.1:8080\r\n"
+           "Content-Type: text/plain\r\n"
+           "Content-Length: 11\r\n"
+           "\r\n"
+           "hello world")
+
+RESPONSE = ("HTTP/1.1 200 Ok\r\n"
+            "Transfer-Encoding: chunked\r\n"
+            "\r\n"
+            "5\r\nhello\r\n"
+            "6\r\n world\r\n"
+            "0\r\n"
+            "X-Trailer: ignored\r\n"
+            "\r\n")
+
+class RecordingStream(stream.StreamHTTP):
+    def __init__(self):
+        stream.StreamHTTP.__init__(self, None)
+        self.events = []
+        self.body = []
+
+    def start_recv(self):
+        pass
+
+    def close(self):
+        self.close_pending = True
+
+    def got_request_line(self, method, uri, protocol):
+        self.events.append(("request", method, uri, protocol))
+
+    def got_response_line(self, protocol, code, reason):
+        self.events.append(("response", protocol, code, reason))
+
+    def got_header(self, key, value):
+        self.events.append(("header", key, value))
+
+    def got_end_of_headers(self):
+        self.events.append(("end_of_headers",))
+        for event in self.events:
+            if event[0] == "header" and event[1] == "Content-Length":
+                return stream.BOUNDED, int(event[2])
+            if event[0] == "header" and event[1] == "Transfer-Encoding":
+                return stream.CHUNK_LENGTH, 0
+            if event[0] == "header" and event[1] == "X-Reject":
+                return stream.ERROR, 0
+        return stream.FIRSTLINE, 0
+
+    def got_piece(self, piece):
+        self.body.append(str(piece))
+
+    def got_end_of_body(self):
+        self.events.append(("end_of_body", "".join(self.body)))
+        self.body = []
+
+def feed(data, sizes):
+    receiver = RecordingStream()
+    offset = 0
+    for size in sizes:
+        receiver.recv_complete(data[offset:offset + size])
+        offset += size
+    receiver.recv_complete(data[offset:])
+    return receiver
+
+#
+# Like feed() but receive into a reused buffer, like Stream._read_into()
+# does, and scribble on it after each read, so that we notice if the
+# parser keeps a reference to the buffer rather than a copy.
+#
+def feed_pooled(data, sizes):
+    receiver = RecordingStream()
+    buf = bytearray(len(data) + 1)
+    offset = 0
+    for size in sizes + [len(data)]:
+        count = len(data[offset:offset + size])
+        buf[:count] = data[offset:offset + count]
+        receiver.recv_complete(memoryview(buf)[:count])
+        buf[:] = "X" * len(buf)
+        offset += count
+    return receiver
+
+def random_sizes(data, seed):
+    prng = random.Random(seed)
+    sizes, total = [], 0
+    while total < len(data):
+        size = prng.randint(1, 24)
+        sizes.append(size)
+        total += size
+    return sizes
+
+class TestRequest(unittest.TestCase):
+    def runTest(self):
+        """Make sure we parse a request with a bounded body"""
+        receiver = feed(REQUEST + REQUEST, [])
+        self.assertEqual(receiver.events[:6], [
+          ("request", "POST", "/speedtest/collect", "HTTP/1.1"),
+          ("header", "Host", "127.0.0.1:8080"),
+          ("header", "Content-Type", "text/plain"),
+          ("header", "Content-Length", "11"),
+          ("end_of_headers",),
+          ("end_of_body", "hello world"),
+        ])
+        self.assertEqual(receiver.events[6:12], receiver.events[:6])
+        self.assertFalse(receiver.incoming)
+
+class TestChunked(unittest.TestCase):
+    def runTest(self):
+        """Make sure we decode chunked bodies and skip trailers"""
+        receiver = feed(RESPONSE, [])
+        self.assertEqual(receiver.events, [
+          ("response", "HTTP/1.1", "200", "Ok"),
+          ("header", "Transfer-Encoding", "chunked"),
+          ("end_of_headers",),
+          ("end_of_body", "hello world"),
+        ])
+        self.assertEqual(receiver.state, stream.FIRSTLINE)
+
+class TestSegmented(unittest.TestCase):
+    def runTest(self):
+        """Make sure the result does not depend on segmentation"""
+        for data in (REQUEST * 3, RESPONSE * 3):
+            expected = feed(data, []).events
+            self.assertEqual(feed(data, [1] * len(data)).events, expected)
+            for seed in range(32):
+                self.assertEqual(feed(data, random_sizes(data, seed)).events,
+                                 expected)
+
+class TestPooled(unittest.TestCase):
+    def runTest(self):
+        """Make sure we copy what we keep out of pooled buffers"""
+        for data in (REQUEST * 3, RESPONSE * 3):
+            expected = feed(data, []).events
+            self.assertEqual(feed_pooled(data, []).events, expected)
+            for seed in range(32):
+                self.assertEqual(feed_pooled(data, random_sizes(data,
+                                 seed)).events, expected)
+
+class TestLineEndings(unittest.TestCase):
+    def runTest(self):
+        """Make sure we accept LF and mixed line endings"""
+        data = "GET / HTTP/1.0\nHost: a\r\nAccept: */*\n\n"
+        receiver = feed(data, [17])
+        self.assertEqual(receiver.events, [
+          ("request", "GET", "/", "HTTP/1.0"),
+          ("header", "Host", "a"),
+          ("header", "Accept", "*/*"),
+          ("end_of_headers",),
+          ("end_of_body", ""),
+        ])
+
+class TestErrors(unittest.TestCase):
+    def test_invalid_header(self):
+        """Make sure we reject a header without colon"""
+        self.assertRaises(RuntimeError, feed,
+                          "GET / HTTP/1.1\r\nInvalid\r\n\r\n", [])
+
+    def test_invalid_protocol(self):
+        """Make sure we reject an unknown protocol"""
+        self.assertRaises(RuntimeError, feed,
+                          "GET / HTTP/2.0\r\n\r\n", [])
+
+    def test_headers_too_long(self):
+        """Make sure we don't buffer unlimited headers"""
+        receiver = RecordingStream()
+        receiver.recv_complete("GET / HTTP/1.1\r\n")
+        self.assertRaises(RuntimeError, receiver.recv_complete,
+                          "X-Foo: bar\r\n" * (stream.MAXHEADERS / 12 + 1))
+
+    def test_line_too_long(self):
+        """Make sure we don't buffer unlimited chunk-length lines"""
+        receiver = feed(RESPONSE[:RESPONSE.index("5\r\n")], [])
+        self.assertRaises(RuntimeError, receiver.recv_complete,
+                          "5" * (stream.MAXLINE + 1))
+
+    def test_rejected(self):
+        """Make sure we stop parsing when upstream closes"""
+        receiver = feed("GET / HTTP/1.1\r\nX-Reject: 1\r\n\r\n"
+                        "GET / HTTP/1.1\r\n\r\n", [])
+        self.assertTrue(receiver.close_pending)
+        self.assertEqual(len([event for event in receiver.events
+                              if event[0] == "request"]), 1)
+
+if __name__ == "__main__":
+    unittest.main()
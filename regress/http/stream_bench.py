@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2012 Simone Basso <bassosimone@gmail.com>,
+#  NEXA Center for Internet & Society at Politecnico di Torino
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+''' Benchmark the HTTP receiver with requests and chunked bodies '''
+
+import logging
+import sys
+
+sys.path.insert(0, '.')
+
+from neubot.http.stream import CHUNK_LENGTH
+from neubot.http.stream import FIRSTLINE
+from neubot.http.stream import StreamHTTP
+from neubot import utils
+
+# Number of messages parsed by each run
+MESSAGES = 2000
+
+REQUEST = ("GET /speedtest/download HTTP/1.1\r\n"
+           "Host: master.neubot.org:8080\r\n"
+           "User-Agent: Neubot/0.4.6\r\n"
+           "Range: bytes=0-1048575\r\n"
+           "Authorization: 8c1d9b0b-1cc2-4cd8-9e7b-71b2f2f4a9e5\r\n"
+           "Cache-Control: no-cache\r\n"
+           "Pragma: no-cache\r\n"
+           "Connection: keep-alive\r\n"
+           "\r\n")
+
+# A request with many headers, e.g. cookies
+BIG_REQUEST = (REQUEST[:-2] + "".join("X-Header-%d: %s\r\n" % (index,
+               "v" * 40) for index in range(100)) + "\r\n")
+
+RESPONSE = ("HTTP/1.1 200 Ok\r\n"
+            "Content-Type: application/octet-stream\r\n"
+            "Transfer-Encoding: chunked\r\n"
+            "\r\n" + "".join("%x\r\n%s\r\n" % (size, "A" * size)
+            for size in (16, 512, 4096, 65536) * 4) + "0\r\n\r\n")
+
+class NullStream(StreamHTTP):
+    ''' A receiver that discards what it parses '''
+
+    def __init__(self, chunked):
+        ''' Initialize the stream '''
+        StreamHTTP.__init__(self, None)
+        self.chunked = chunked
+        self.messages = 0
+        self.body = 0
+
+    def start_recv(self):
+        ''' No poller here '''
+
+    def got_request_line(self, method, uri, protocol):
+        ''' Got the request line '''
+
+    def got_response_line(self, protocol, code, reason):
+        ''' Got the response line '''
+
+    def got_end_of_headers(self):
+        ''' Got the end of headers '''
+        if self.chunked:
+            return CHUNK_LENGTH, 0
+        return FIRSTLINE, 0
+
+    def got_piece(self, piece):
+        ''' Got a piece of the body '''
+        self.body += len(piece)
+
+    def got_end_of_body(self):
+        ''' Got the end of the body '''
+        self.messages += 1
+
+def run(name, message, segment, chunked=False):
+    ''' Parse MESSAGES messages received in segments of @segment bytes '''
+    stream = NullStream(chunked)
+    segments = [message[index:index + segment]
+                for index in range(0, len(message), segment)]
+    begin = utils.ticks()
+    for _ in range(MESSAGES):
+        for data in segments:
+            stream.recv_complete(data)
+    elapsed = utils.ticks() - begin
+    assert stream.messages == MESSAGES
+    print('%-24s %6d byte segments: %s per message' % (name, segment,
+          utils.time_formatter(elapsed / MESSAGES)))
+
+def main():
+    ''' Benchmark the HTTP receiver '''
+    logging.getLogger().setLevel(logging.ERROR)
+    run('request', REQUEST, len(REQUEST))
+    run('request', REQUEST, 16)
+    run('request (100 headers)', BIG_REQUEST, len(BIG_REQUEST))
+    run('request (100 headers)', BIG_REQUEST, 64)
+    run('request (100 headers)', BIG_REQUEST, 8)
+    run('chunked response', RESPONSE, 65536, True)
+    run('chunked response', RESPONSE, 1460, True)
+
+if __name__ == '__main__':
+    main()
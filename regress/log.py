@@ -53,7 +53,10 @@ if __name__ == "__main__":
     logging.warning("WARNING w/ logging.warning")
     logging.error("ERROR w/ logging.error")
 
+    # DEBUG messages are discarded unless we are verbose
+    assert(not LOG.is_debug())
     LOG.verbose()
+    assert(LOG.is_debug())
 
     logging.info("INFO w/ logging.info")
     logging.debug("DEBUG w/ logging.debug")
@@ -85,6 +88,23 @@ if __name__ == "__main__":
     logging.warning("WARNING %s", "variadic warning")
     LOG.warning("WARNING %s", "variadic warning")
 
+    # Closed streams are forgotten along with their dropped lines
+    class FakeStream(object):
+        close_complete = False
+        close_pending = False
+        send_throttled = True
+        def enable_backpressure(self):
+            pass
+        def start_send(self, octets):
+            raise RuntimeError("Should not send anything")
+    stream = FakeStream()
+    LOG.start_streaming(stream)
+    LOG.info("Dropped because the stream is throttled")
+    assert(LOG.dropped[stream] == 1)
+    stream.close_complete = True
+    LOG.info("Not sent because the stream is closed")
+    assert(not LOG.streams and not LOG.dropped)
+
     LOG.redirect()
 
     LOG.error("testing neubot logger -- This is an error message")
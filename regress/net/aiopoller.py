@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2012 Simone Basso <bassosimone@gmail.com>,
+#  NEXA Center for Internet & Society at Politecnico di Torino
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+''' Regression test for neubot/net/aiopoller.py '''
+
+import logging
+import socket
+import sys
+import time
+import unittest
+
+if __name__ == '__main__':
+    sys.path.insert(0, '.')
+
+from neubot.net.aiopoller import AsyncioBackend
+from neubot.net.aiopoller import AsyncioPoller
+from neubot.net.aiopoller import asyncio
+from neubot.net.poller import Pollable
+
+class TestStream(Pollable):
+    ''' Fake stream that reads and writes once '''
+
+    def __init__(self, poller, sock):
+        ''' Initialize fake stream '''
+        Pollable.__init__(self)
+        self.poller = poller
+        self.sock = sock
+        self.data = ""
+
+    def fileno(self):
+        ''' Return file number '''
+        return self.sock.fileno()
+
+    def handle_read(self):
+        ''' Invoked when the socket is readable '''
+        self.data += self.sock.recv(1024)
+        self.poller.unset_readable(self)
+
+    def handle_write(self):
+        ''' Invoked when the socket is writable '''
+        self.sock.send("neubot")
+        self.poller.unset_writable(self)
+
+class FakeLoop(object):
+    ''' Fake asyncio loop that records the registered callbacks '''
+
+    def __init__(self):
+        ''' Initialize fake loop '''
+        self.readers = {}
+        self.writers = {}
+        self.fail = set()
+
+    def add_reader(self, fileno, callback, *args):
+        ''' Register reader '''
+        if "add_reader" in self.fail:
+            raise OSError("add_reader failed")
+        self.readers[fileno] = callback
+
+    def add_writer(self, fileno, callback, *args):
+        ''' Register writer '''
+        if "add_writer" in self.fail:
+            raise OSError("add_writer failed")
+        self.writers[fileno] = callback
+
+    def remove_reader(self, fileno):
+        ''' Unregister reader '''
+        return self.readers.pop(fileno, None) is not None
+
+    def remove_writer(self, fileno):
+        ''' Unregister writer '''
+        return self.writers.pop(fileno, None) is not None
+
+class FakePoller(object):
+    ''' Fake poller that owns a fake loop '''
+
+    def __init__(self):
+        ''' Initialize fake poller '''
+        self.aioloop = FakeLoop()
+
+    def _call_handle_read(self, fileno):
+        ''' Dispatch readable event '''
+
+    def _call_handle_write(self, fileno):
+        ''' Dispatch writable event '''
+
+class TestAsyncioBackend(unittest.TestCase):
+    ''' Make sure the backend state matches the loop state '''
+
+    def setUp(self):
+        ''' Create a backend on top of a fake loop '''
+        self.poller = FakePoller()
+        self.aioloop = self.poller.aioloop
+        self.backend = AsyncioBackend(self.poller)
+
+    def test_modify(self):
+        ''' Make sure that modify() registers and unregisters '''
+        self.backend.modify(3, True, False)
+        self.assertEqual(self.backend.masks, {3: (True, False)})
+        self.assertEqual(list(self.aioloop.readers), [3])
+        self.backend.modify(3, True, True)
+        self.assertEqual(self.backend.masks, {3: (True, True)})
+        self.assertEqual(list(self.aioloop.writers), [3])
+        self.backend.modify(3, False, True)
+        self.assertEqual(self.aioloop.readers, {})
+        self.backend.close()
+        self.assertEqual(self.backend.masks, {})
+        self.assertEqual(self.aioloop.writers, {})
+
+    def test_partial_failure(self):
+        ''' Make sure a failure halfway leaves nothing registered '''
+        self.aioloop.fail.add("add_writer")
+        self.backend.modify(3, True, True)
+        self.assertEqual(self.backend.masks, {})
+        self.assertEqual(self.aioloop.readers, {})
+        self.assertEqual(self.aioloop.writers, {})
+
+    def test_failure_forgets_old_state(self):
+        ''' Make sure a failure also drops older registrations '''
+        self.backend.modify(3, True, False)
+        self.aioloop.fail.add("add_writer")
+        self.backend.modify(3, True, True)
+        self.assertEqual(self.backend.masks, {})
+        self.assertEqual(self.aioloop.readers, {})
+
+    def test_wait(self):
+        ''' Make sure that wait() is never used '''
+        self.assertRaises(RuntimeError, self.backend.wait, 1)
+
+class TestAsyncioPoller(unittest.TestCase):
+    ''' Make sure that the asyncio poller behaves like the poller '''
+
+    def setUp(self):
+        ''' Create a poller with a fresh asyncio loop '''
+        self.aioloop = asyncio.new_event_loop()
+        self.poller = AsyncioPoller(1, self.aioloop)
+        # Don't wait for the pending check_timeout()
+        for task in self.poller.tasks:
+            task.cancel()
+
+    def tearDown(self):
+        ''' Close the asyncio loop '''
+        self.poller.backend.close()
+        self.aioloop.close()
+
+    def test_io(self):
+        ''' Make sure that loop() runs until there is I/O to do '''
+        left, right = socket.socketpair()
+        reader = TestStream(self.poller, left)
+        writer = TestStream(self.poller, right)
+        self.poller.set_readable(reader)
+        self.poller.set_writable(writer)
+        self.poller.loop()
+        self.assertEqual(reader.data, "neubot")
+        self.assertEqual(self.poller.backend.masks, {})
+        left.close()
+        right.close()
+
+    def test_sched(self):
+        ''' Make sure that tasks run in order and can be cancelled '''
+        result = []
+        self.poller.sched(0.2, lambda: result.append(2))
+        self.poller.sched(0.1, lambda: result.append(1))
+        self.poller.sched(0.15, lambda: result.append(3)).cancel()
+        self.poller.sched(0.3, self.poller.break_loop)
+        self.poller.loop_forever()
+        self.assertEqual(result, [1, 2])
+
+    def test_stats(self):
+        ''' Make sure that asyncio callbacks are accounted '''
+        self.poller.stats.stall_threshold = 0.05
+        left, right = socket.socketpair()
+        writer = TestStream(self.poller, right)
+        handle_write = writer.handle_write
+        writer.handle_write = lambda: (time.sleep(0.1), handle_write())
+        reader = TestStream(self.poller, left)
+        self.poller.set_writable(writer)
+        self.poller.set_readable(reader)
+        self.poller.sched(0, lambda: None)
+        self.poller.loop()
+
+        snap = self.poller.stats.snap()
+        self.assertEqual(snap["iterations"], 3)
+        self.assertEqual(snap["stalls"], 1)
+        self.assertEqual(snap["last_stall"]["callback"],
+                         "TestStream.handle_write")
+        self.assertEqual(snap["callbacks"]["<lambda>"]["count"], 1)
+        self.assertEqual(snap["callbacks"]["TestStream.handle_read"]
+                         ["count"], 1)
+        left.close()
+        right.close()
+
+    def test_set_backend(self):
+        ''' Make sure that the backend cannot be changed '''
+        self.assertRaises(ValueError, self.poller.set_backend, "select")
+
+if __name__ == '__main__':
+    # Suppress annoying warnings
+    logging.getLogger().setLevel(logging.ERROR)
+
+    if not asyncio:
+        sys.stderr.write("asyncio not available: skipping TestAsyncioPoller\n")
+        del TestAsyncioPoller
+
+    # Run tests
+    unittest.main()
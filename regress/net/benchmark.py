@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2012 Simone Basso <bassosimone@gmail.com>,
+#  NEXA Center for Internet & Society at Politecnico di Torino
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sys
+import tempfile
+import unittest
+
+if __name__ == "__main__":
+    sys.path.insert(0, ".")
+
+from neubot.compat import json
+from neubot.net import benchmark
+from neubot.net.poller import Poller
+
+class FakeStream(object):
+    def __init__(self):
+        self.bytes_sent_tot = 0
+        self.bytes_recv_tot = 0
+        self.io_calls = 0
+
+class TestPercentile(unittest.TestCase):
+    def runTest(self):
+        """Make sure we compute nearest-rank percentiles"""
+        vector = range(101)
+        self.assertEqual(benchmark.percentile(vector, 0), 0)
+        self.assertEqual(benchmark.percentile(vector, 50), 50)
+        self.assertEqual(benchmark.percentile(vector, 99), 99)
+        self.assertEqual(benchmark.percentile(vector, 100), 100)
+        self.assertEqual(benchmark.percentile([7], 90), 7)
+        self.assertEqual(benchmark.percentile([], 90), 0.0)
+
+class TestBenchmark(unittest.TestCase):
+    def setUp(self):
+        self.poller = Poller(1)
+        fdesc, self.path = tempfile.mkstemp()
+        os.close(fdesc)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_run(self):
+        """Make sure a run ends when the last stream is closed"""
+        bench = benchmark.Benchmark(self.poller, 1.0, self.path)
+        first, second = FakeStream(), FakeStream()
+        bench.add(first)
+        bench.add(second)
+        self.assertTrue(bench.task)
+
+        first.bytes_recv_tot = 1000000
+        first.io_calls = 10
+        second.bytes_sent_tot = 3000000
+        second.io_calls = 30
+        bench._report()
+
+        bench.remove(first)
+        self.assertFalse(bench.summaries)
+        bench.remove(second)
+        self.assertEqual(bench.task, None)
+        self.assertEqual(len(bench.summaries), 1)
+
+        summary = json.load(open(self.path))
+        self.assertEqual(summary["connections"], 2)
+        self.assertEqual(summary["bytes"], 4000000)
+        self.assertEqual(summary["io_calls"], 40)
+        self.assertTrue(summary["syscalls_per_mb"] >= 10)
+        self.assertEqual([entry["connection"] for entry in
+                          summary["per_connection"]], [0, 1])
+        percentiles = summary["throughput_percentiles"]
+        self.assertTrue(percentiles["p0"] <= percentiles["p50"]
+                        <= percentiles["p100"])
+
+    def test_unknown(self):
+        """Make sure we ignore streams we don't know"""
+        bench = benchmark.Benchmark(self.poller, 0)
+        bench.remove(FakeStream())
+        self.assertFalse(bench.summaries)
+
+    def test_new_run(self):
+        """Make sure a new run starts after the previous one"""
+        bench = benchmark.Benchmark(self.poller, 0)
+        for _ in range(2):
+            stream = FakeStream()
+            bench.add(stream)
+            stream.bytes_recv_tot = 1000
+            bench.remove(stream)
+        self.assertEqual(len(bench.summaries), 2)
+        self.assertEqual(bench.summaries[1]["connections"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
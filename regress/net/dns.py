@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2012 Simone Basso <bassosimone@gmail.com>,
+#  NEXA Center for Internet & Society at Politecnico di Torino
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+''' Regression test for neubot/net/dns.py '''
+
+import logging
+import socket
+import sys
+import threading
+import unittest
+
+if __name__ == '__main__':
+    sys.path.insert(0, '.')
+
+from neubot.net import dns
+from neubot.net.poller import Poller
+
+class FakeGetaddrinfo(object):
+    ''' Replaces socket.getaddrinfo() and counts queries '''
+
+    def __init__(self, fail=False):
+        ''' Initialize and install fake getaddrinfo '''
+        self.fail = fail
+        self.error = None
+        self.count = 0
+        self.gate = threading.Event()
+        self.gate.set()
+        self.saved = socket.getaddrinfo
+        socket.getaddrinfo = self
+
+    def __call__(self, address, port, family=0, socktype=0, proto=0,
+                 flags=0):
+        ''' Fake getaddrinfo() '''
+        if flags & socket.AI_NUMERICHOST or not address:
+            return self.saved(address, port, family, socktype, proto, flags)
+        self.gate.wait()
+        self.count += 1
+        if self.error:
+            raise self.error
+        if self.fail:
+            raise socket.gaierror(socket.EAI_NONAME, "Name not known")
+        return [(family, socktype, proto, "", ("127.0.0.1", port))]
+
+    def restore(self):
+        ''' Restore the original getaddrinfo() '''
+        socket.getaddrinfo = self.saved
+
+class TestCache(unittest.TestCase):
+    ''' Make sure that the cache works '''
+
+    def setUp(self):
+        ''' Start with an empty cache '''
+        dns.DNS_CACHE.clear()
+        self.fake = FakeGetaddrinfo()
+
+    def tearDown(self):
+        ''' Restore getaddrinfo() '''
+        self.fake.restore()
+        dns.DNS_CACHE.clear()
+
+    def test_hit(self):
+        ''' Make sure that a second lookup hits the cache '''
+        first = dns.getaddrinfo("www.example.com", 80)
+        second = dns.getaddrinfo("www.example.com", 80)
+        self.assertEqual(first, second)
+        self.assertEqual(self.fake.count, 1)
+
+        # Different arguments, different entry
+        dns.getaddrinfo("www.example.com", 8080)
+        self.assertEqual(self.fake.count, 2)
+
+    def test_expire(self):
+        ''' Make sure that entries expire '''
+        dns.getaddrinfo("www.example.com", 80)
+        for key, entry in dns.DNS_CACHE.items():
+            dns.DNS_CACHE[key] = (entry[0], entry[1], 0)
+        dns.getaddrinfo("www.example.com", 80)
+        self.assertEqual(self.fake.count, 2)
+
+    def test_negative(self):
+        ''' Make sure that failures are cached '''
+        self.fake.fail = True
+        self.assertRaises(socket.error, dns.getaddrinfo,
+                          "nonexistent.example.com", 80)
+        self.assertRaises(socket.error, dns.getaddrinfo,
+                          "nonexistent.example.com", 80)
+        self.assertEqual(self.fake.count, 1)
+
+    def test_lru(self):
+        ''' Make sure that we evict the least recently used entry '''
+        for port in range(dns.DNS_CACHE_SIZE):
+            dns.getaddrinfo("www.example.com", port)
+        dns.getaddrinfo("www.example.com", 0)
+        dns.getaddrinfo("www.example.com", dns.DNS_CACHE_SIZE)
+        self.assertEqual(len(dns.DNS_CACHE), dns.DNS_CACHE_SIZE)
+        ports = [key[1] for key in dns.DNS_CACHE]
+        self.assertTrue(0 in ports)
+        self.assertFalse(1 in ports)
+
+    def test_numeric(self):
+        ''' Make sure that numeric addresses don't query the DNS '''
+        dns.getaddrinfo("127.0.0.1", 80)
+        dns.getaddrinfo("0.0.0.0", 80, socket.AF_INET, socket.SOCK_STREAM, 0,
+                        socket.AI_PASSIVE)
+        self.assertEqual(self.fake.count, 0)
+
+class TestResolver(unittest.TestCase):
+    ''' Make sure that the resolver does not block the poller '''
+
+    def setUp(self):
+        ''' Start with an empty cache '''
+        dns.DNS_CACHE.clear()
+        self.fake = FakeGetaddrinfo()
+        self.poller = Poller(1)
+        # Don't wait for the pending check_timeout()
+        for task in self.poller.tasks:
+            task.cancel()
+
+    def tearDown(self):
+        ''' Restore getaddrinfo() '''
+        self.fake.restore()
+        dns.DNS_CACHE.clear()
+
+    def test_resolve(self):
+        ''' Make sure that the result is delivered by the poller '''
+        result = []
+        self.fake.gate.clear()
+        for _ in range(3):
+            dns.resolve(self.poller, lambda exception, addrinfo:
+              result.append((threading.currentThread(), exception,
+                             addrinfo)), "www.example.com", 80)
+        self.assertEqual(result, [])
+        self.assertEqual(self.poller.outstanding, 3)
+
+        self.fake.gate.set()
+        self.poller.loop()
+
+        self.assertEqual(len(result), 3)
+        for thread, exception, addrinfo in result:
+            self.assertTrue(thread is threading.currentThread())
+            self.assertEqual(exception, None)
+            self.assertEqual(addrinfo[0][4], ("127.0.0.1", 80))
+        self.assertEqual(self.poller.outstanding, 0)
+        self.assertEqual(self.fake.count, 1)
+
+        # Now it's cached, so it's delivered immediately
+        dns.resolve(self.poller, lambda exception, addrinfo:
+          result.append(addrinfo), "www.example.com", 80)
+        self.assertEqual(len(result), 4)
+
+    def test_failure(self):
+        ''' Make sure that the failure is delivered '''
+        result = []
+        self.fake.fail = True
+        dns.resolve(self.poller, lambda exception, addrinfo:
+          result.append((exception, addrinfo)), "nonexistent.example.com", 80)
+        self.poller.loop()
+        self.assertEqual(len(result), 1)
+        self.assertTrue(isinstance(result[0][0], socket.error))
+        self.assertEqual(result[0][1], None)
+
+    def test_unexpected_error(self):
+        ''' Make sure that non-socket errors are delivered too '''
+        result = []
+        self.fake.error = UnicodeError("label too long")
+        for _ in range(2):
+            dns.resolve(self.poller, lambda exception, addrinfo:
+              result.append((exception, addrinfo)), "bad.example.com", 80)
+        self.poller.loop()
+        self.assertEqual(len(result), 2)
+        for exception, addrinfo in result:
+            self.assertTrue(isinstance(exception, UnicodeError))
+            self.assertEqual(addrinfo, None)
+        self.assertEqual(self.poller.outstanding, 0)
+        self.assertEqual(dns.RESOLVER.pending, {})
+
+        # The workers must have survived
+        self.fake.error = None
+        dns.resolve(self.poller, lambda exception, addrinfo:
+          result.append((exception, addrinfo)), "www.example.com", 80)
+        self.poller.loop()
+        self.assertEqual(result[-1][0], None)
+
+    def test_connect_family(self):
+        ''' Make sure prefetch and connect agree on the family '''
+        self.assertEqual(dns.connect_family({}), socket.AF_INET)
+        self.assertEqual(dns.connect_family({"net.stream.ipv6": True}),
+                         socket.AF_INET6)
+        self.assertEqual(dns.connect_family({
+          "net.stream.happy_eyeballs": True}), socket.AF_UNSPEC)
+
+    def test_prefetch(self):
+        ''' Make sure that prefetch warms up the cache '''
+        dns.prefetch(self.poller, [("www.example.com", 80, socket.AF_INET)])
+        self.poller.loop()
+        dns.getaddrinfo("www.example.com", 80, socket.AF_INET,
+                        socket.SOCK_STREAM)
+        self.assertEqual(self.fake.count, 1)
+
+if __name__ == '__main__':
+    # Suppress annoying warnings
+    logging.getLogger().setLevel(logging.ERROR)
+
+    # Run tests
+    unittest.main()
@@ -22,22 +22,40 @@
 
 ''' Regression test for neubot/net/poller.py '''
 
+import imp
 import logging
+import select
+import socket
 import sys
+import threading
+import time
 import unittest
 
 if __name__ == '__main__':
     sys.path.insert(0, '.')
 
+from neubot.net.poller import BACKENDS
+from neubot.net.poller import Pollable
 from neubot.net.poller import Poller
+from neubot.net.poller import PRIORITY_HIGH
+from neubot.net.poller import PRIORITY_LOW
+from neubot.net.poller import PRIORITY_NORMAL
+from neubot.net.poller import PollerThread
+from neubot.net.poller import current_poller
+from neubot.utils import ticks
 
-class TestCheckTimeoutStream(object):
+class TestCheckTimeoutStream(Pollable):
     ''' Fake stream for TestCheckTimeout '''
 
     def __init__(self, result, fileno):
         '''Initialize fake stream '''
+        Pollable.__init__(self)
         self._result = result
         self._fileno = fileno
+        self.checked = 0
+
+        # Make sure the deadline is already expired
+        self.created = ticks() - self.watchdog - 1
 
     def fileno(self):
         ''' Return file number '''
@@ -50,6 +68,7 @@ class TestCheckTimeoutStream(object):
         # We want to prune all odd streams and make sure that
         # even ones are still tracked by the poller.
         #
+        self.checked += 1
         return self._fileno % 2
 
     def handle_close(self):
@@ -74,33 +93,33 @@ class TestCheckTimeout(unittest.TestCase):
         # one because we've just created the poller and the other
         # because we've just invoked check_timeout().
         #
-        self.assertEqual(len(poller.pending), 2)
-        self.assertEqual(poller.pending[0].func,
+        self.assertEqual(len(poller.tasks), 2)
+        self.assertEqual(poller.tasks[0].func,
           poller.check_timeout)
-        self.assertEqual(poller.pending[1].func,
+        self.assertEqual(poller.tasks[1].func,
           poller.check_timeout)
 
     def test_readable(self):
         ''' Make sure it runs when there's only readable stuff '''
-        poller = Poller(1)
+        poller = Poller(1, "select")
         result = []
         stream = TestCheckTimeoutStream(result, 1)
-        poller.readset[1] = stream
+        poller.set_readable(stream)
         poller.check_timeout()
         self.assertEqual(result, [1])
 
     def test_writable(self):
         ''' Make sure it runs when there's only writable stuff '''
-        poller = Poller(1)
+        poller = Poller(1, "select")
         result = []
         stream = TestCheckTimeoutStream(result, 1)
-        poller.writeset[1] = stream
+        poller.set_writable(stream)
         poller.check_timeout()
         self.assertEqual(result, [1])
 
     def test_complete(self):
         ''' Make sure it works with both readable and writable streams '''
-        poller = Poller(1)
+        poller = Poller(1, "select")
         result = []
 
         #
@@ -111,9 +130,9 @@ class TestCheckTimeout(unittest.TestCase):
         #
         for i in range(256):
             stream = TestCheckTimeoutStream(result, i)
-            poller.readset[i] = stream
+            poller.set_readable(stream)
             if i > 14 and i < 128:
-                poller.writeset[i] = stream
+                poller.set_writable(stream)
 
         # This should close odd streams only
         poller.check_timeout()
@@ -127,6 +146,376 @@ class TestCheckTimeout(unittest.TestCase):
         # Make sure the writable set is consistent
         self.assertEqual(sorted(poller.writeset), range(16, 128, 2))
 
+        # Make sure even streams are still watched
+        self.assertEqual(sorted(stream.fileno() for stream in
+                                poller.watched), range(0, 256, 2))
+
+    def test_not_due(self):
+        ''' Make sure we don't touch streams that are not due '''
+        poller = Poller(1, "select")
+        result = []
+        stream = TestCheckTimeoutStream(result, 1)
+        stream.created = ticks()
+        poller.set_readable(stream)
+        poller.check_timeout()
+        self.assertEqual(stream.checked, 0)
+        self.assertEqual(result, [])
+
+    def test_refresh(self):
+        ''' Make sure that refreshing created updates the deadline '''
+        poller = Poller(1, "select")
+        result = []
+        stream = TestCheckTimeoutStream(result, 1)
+        poller.set_readable(stream)
+        stream.created = ticks()
+        poller.check_timeout()
+        self.assertEqual(stream.checked, 0)
+        self.assertEqual(result, [])
+
+        # The old entry must have been invalidated
+        self.assertEqual(len(poller.deadlines), 1)
+        self.assertEqual(poller.stale, 0)
+
+    def test_watchdog(self):
+        ''' Make sure that changing watchdog updates the deadline '''
+        poller = Poller(1, "select")
+        result = []
+        stream = TestCheckTimeoutStream(result, 1)
+        stream.created = ticks()
+        poller.set_readable(stream)
+        stream.watchdog = -1
+        self.assertEqual(poller.deadlines[0][2], None)
+        stream.watchdog = 0
+        poller.check_timeout()
+        self.assertEqual(result, [1])
+
+    def test_idle(self):
+        ''' Make sure that idle streams are reclaimed '''
+        poller = Poller(1, "select")
+        stream = Pollable()
+        stream.fileno = lambda: 1
+        stream.watchdog = 3600
+        stream.idle = 1
+        poller.set_readable(stream)
+        self.assertEqual(poller.deadlines[0][0], stream.last_activity + 1)
+
+        # Activity does not touch the index, it is checked when due
+        stream.last_activity = ticks()
+        poller.deadlines[0][0] = 0
+        poller.check_timeout()
+        self.assertTrue(stream in poller.watched)
+        self.assertEqual(poller.watched[stream][0], stream.last_activity + 1)
+
+        # No activity in the meantime: timed out
+        stream.last_activity = ticks() - 2
+        poller.deadlines[0][0] = 0
+        poller.check_timeout()
+        self.assertFalse(stream in poller.watched)
+        self.assertEqual(poller.readset, {})
+
+    def test_idle_dispatch(self):
+        ''' Make sure that I/O events count as activity '''
+        poller = Poller(1, "select")
+        stream = Pollable()
+        stream.fileno = lambda: 1
+        stream.last_activity = 0
+        poller.set_readable(stream)
+        poller._call_handle_read(1)
+        self.assertTrue(stream.last_activity > 0)
+
+    def test_unregistered(self):
+        ''' Make sure we forget streams not registered for I/O '''
+        poller = Poller(1, "select")
+        result = []
+        stream = TestCheckTimeoutStream(result, 1)
+        poller.set_readable(stream)
+        poller.unset_readable(stream)
+        poller.check_timeout()
+        self.assertEqual(stream.checked, 0)
+        self.assertEqual(poller.watched, {})
+
+class TestSched(unittest.TestCase):
+    ''' Regression test for poller.sched() '''
+
+    def setUp(self):
+        ''' Create a poller without pending tasks '''
+        self.poller = Poller(0)
+        for task in self.poller.tasks:
+            task.cancel()
+        self.result = []
+
+    def test_order(self):
+        ''' Make sure that tasks run in deadline order '''
+        for delta in (0.03, 0.01, 0.02, 0.01):
+            self.poller.sched(delta, lambda delta=delta:
+                              self.result.append(delta))
+        time.sleep(0.04)
+        self.poller._loop_once()
+        self.assertEqual(self.result, [0.01, 0.01, 0.02, 0.03])
+
+    def test_not_early(self):
+        ''' Make sure that tasks do not run before their deadline '''
+        self.poller.sched(0.5, lambda: self.result.append(1))
+        self.poller.select_timeout = 0
+        time.sleep(0.01)
+        self.poller._run_tasks()
+        self.assertEqual(self.result, [])
+
+    def test_cancel(self):
+        ''' Make sure that cancelled tasks do not run '''
+        task = self.poller.sched(0, lambda: self.result.append(1))
+        self.poller.sched(0, lambda: self.result.append(2))
+        task.cancel()
+        self.poller._loop_once()
+        self.assertEqual(self.result, [2])
+        self.assertEqual(self.poller.tasks, [])
+
+    def test_cancel_same_batch(self):
+        ''' Make sure a task can cancel another one due at the same time '''
+        tasks = []
+        def first():
+            ''' Cancel the second task '''
+            self.result.append(1)
+            tasks[1].cancel()
+        tasks.append(self.poller.sched(0, first))
+        tasks.append(self.poller.sched(0, lambda: self.result.append(2)))
+        self.poller.stats.task = lambda func, lag, cost: \
+          self.assertTrue(func is not None)
+        self.poller._run_tasks()
+        self.assertEqual(self.result, [1])
+
+    def test_resched(self):
+        ''' Make sure a task rescheduling itself does not loop forever '''
+        def func():
+            ''' Reschedule itself '''
+            self.result.append(1)
+            self.poller.sched(0, func)
+        self.poller.sched(0, func)
+        self.poller._loop_once()
+        self.assertEqual(self.result, [1])
+        self.assertEqual(len([task for task in self.poller.tasks
+                              if not task.cancelled]), 1)
+
+class TestBackendStream(Pollable):
+    ''' Fake stream for TestBackends '''
+
+    def __init__(self, sock):
+        ''' Initialize fake stream '''
+        Pollable.__init__(self)
+        self.sock = sock
+        self.nread = 0
+        self.nwrite = 0
+
+    def fileno(self):
+        ''' Return file number '''
+        return self.sock.fileno()
+
+    def handle_read(self):
+        ''' Invoked when the socket is readable '''
+        self.nread += 1
+
+    def handle_write(self):
+        ''' Invoked when the socket is writable '''
+        self.nwrite += 1
+
+    def handle_close(self):
+        ''' Invoked when this stream is closed '''
+
+class TestBackends(unittest.TestCase):
+    ''' Make sure that all the available backends behave the same '''
+
+    def _run_backend(self, name):
+        ''' Run the test with the given backend '''
+        poller = Poller(0, name)
+        # Don't wait for the pending check_timeout()
+        for task in poller.tasks:
+            task.cancel()
+        left, right = socket.socketpair()
+        stream = TestBackendStream(left)
+
+        # A fresh socket is writable but not readable
+        poller.set_readable(stream)
+        poller.set_writable(stream)
+        poller._loop_once()
+        self.assertEqual((stream.nread, stream.nwrite), (0, 1))
+
+        # Once not writable anymore, it must not be reported
+        poller.unset_writable(stream)
+        poller._loop_once()
+        self.assertEqual((stream.nread, stream.nwrite), (0, 1))
+
+        # But it must be reported as soon as there is data
+        right.send("A")
+        poller._loop_once()
+        self.assertEqual((stream.nread, stream.nwrite), (1, 1))
+
+        # Migrating to another backend must keep interests
+        poller.set_backend("select")
+        poller._loop_once()
+        self.assertEqual((stream.nread, stream.nwrite), (2, 1))
+
+        poller.close(stream)
+        self.assertEqual(poller.readset, {})
+        self.assertEqual(poller.writeset, {})
+        left.close()
+        right.close()
+
+    def test_backends(self):
+        ''' Test all the backends available on this platform '''
+        for name in sorted(BACKENDS):
+            if BACKENDS[name]:
+                self._run_backend(name)
+        self._run_backend("auto")
+
+    def test_no_poll(self):
+        ''' Make sure the module loads where select has no poll() '''
+        fake = imp.new_module("select")
+        fake.select = select.select
+        fake.error = select.error
+        sys.modules["select"] = fake
+        try:
+            module = imp.load_source("_poller_no_poll",
+              sys.modules[Poller.__module__].__file__.replace(".pyc", ".py"))
+        finally:
+            sys.modules["select"] = select
+            sys.modules.pop("_poller_no_poll", None)
+        self.assertEqual(module.BACKENDS["poll"], None)
+        self.assertEqual(module.BACKENDS["epoll"], None)
+        self.assertEqual(module.backend_class("auto").name, "select")
+
+    def test_unknown_backend(self):
+        ''' Make sure we complain for unknown backends '''
+        self.assertRaises(ValueError, Poller, 1, "kqueue")
+
+class TestPriorities(unittest.TestCase):
+    ''' Make sure that the poller honours priorities '''
+
+    def test_priorities(self):
+        ''' High priority first and low priority within budget '''
+        poller = Poller(0, "select")
+        for task in poller.tasks:
+            task.cancel()
+        poller.low_budget = 1
+
+        result, sockets = [], []
+        for priority in (PRIORITY_LOW, PRIORITY_LOW, PRIORITY_NORMAL,
+                         PRIORITY_LOW, PRIORITY_HIGH):
+            left, right = socket.socketpair()
+            sockets.extend((left, right))
+            right.send("A")
+            stream = TestBackendStream(left)
+            stream.priority = priority
+            stream.handle_read = (lambda stream=stream:
+                                  result.append(stream))
+            poller.set_readable(stream)
+
+        poller._loop_once()
+        self.assertEqual([stream.priority for stream in result],
+                         [PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW])
+        self.assertEqual(poller.stats.deferred, 2)
+
+        # Deferred events are serviced first at the next iteration
+        deferred = set(poller.deferred)
+        del result[:]
+        poller._loop_once()
+        self.assertEqual(len(result), 3)
+        self.assertTrue(result[2].fileno() in deferred)
+        self.assertEqual(poller.stats.deferred, 4)
+
+        for sock in sockets:
+            sock.close()
+
+class TestLoopStats(unittest.TestCase):
+    ''' Regression test for the poller statistics '''
+
+    def test_stats(self):
+        ''' Make sure callbacks, tasks and stalls are accounted '''
+        poller = Poller(0, "select")
+        for task in poller.tasks:
+            task.cancel()
+        poller.stats.stall_threshold = 0.05
+
+        left, right = socket.socketpair()
+        stream = TestBackendStream(left)
+        stream.handle_write = lambda: time.sleep(0.1)
+        poller.set_writable(stream)
+        poller.sched(0, lambda: None)
+        poller._loop_once()
+
+        snap = poller.stats.snap()
+        self.assertEqual(snap["iterations"], 1)
+        self.assertEqual(snap["stalls"], 1)
+        self.assertEqual(snap["last_stall"]["callback"],
+                         "TestBackendStream.handle_write")
+        self.assertEqual(snap["callbacks"]["<lambda>"]["count"], 1)
+        self.assertEqual(snap["callbacks"]["TestBackendStream.handle_write"]
+                         ["count"], 1)
+        self.assertEqual(snap["tasks_per_iteration"], [[2, 1]])
+
+        # A fast iteration is not a stall
+        poller.unset_writable(stream)
+        poller.set_readable(stream)
+        poller._loop_once()
+        snap = poller.stats.snap()
+        self.assertEqual(snap["iterations"], 2)
+        self.assertEqual(snap["stalls"], 1)
+
+        left.close()
+        right.close()
+
+class TestThreads(unittest.TestCase):
+    ''' Make sure that pollers work in separate threads '''
+
+    def test_post(self):
+        ''' Make sure that post() runs funcs in the poller thread '''
+
+        threads = [PollerThread(Poller(1), "poller-%d" % index)
+                   for index in range(2)]
+        for thread in threads:
+            for task in thread.poller.tasks:
+                task.cancel()
+            thread.start()
+
+        result = []
+        done = threading.Event()
+
+        def got_poller(thread):
+            ''' Invoked in the context of @thread '''
+            result.append((thread, threading.currentThread(),
+                           current_poller()))
+            if len(result) == len(threads):
+                done.set()
+
+        for thread in threads:
+            thread.poller.post(lambda thread=thread: got_poller(thread))
+        done.wait(5)
+
+        self.assertEqual(len(result), len(threads))
+        for thread, running, poller in result:
+            self.assertTrue(thread is running)
+            self.assertTrue(poller is thread.poller)
+
+        for thread in threads:
+            thread.stop()
+            thread.join(5)
+            self.assertFalse(thread.isAlive())
+
+        # Outside of any loop we get the global poller
+        self.assertFalse(current_poller() in [thread.poller
+                                              for thread in threads])
+
+    def test_post_not_enabled(self):
+        ''' Make sure that post() fails when not enabled '''
+        self.assertRaises(RuntimeError, Poller(1).post, lambda: None)
+
+    def test_loop_ignores_waker(self):
+        ''' Make sure that loop() returns when only the waker is left '''
+        poller = Poller(1)
+        for task in poller.tasks:
+            task.cancel()
+        poller.enable_post()
+        poller.loop()
+
 if __name__ == '__main__':
     # Suppress annoying warnings
     logging.getLogger().setLevel(logging.ERROR)
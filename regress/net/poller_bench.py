@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2012 Simone Basso <bassosimone@gmail.com>,
+#  NEXA Center for Internet & Society at Politecnico di Torino
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+''' Benchmark the cost of a poller loop with idle sockets '''
+
+import socket
+import sys
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+sys.path.insert(0, '.')
+
+from neubot.net.poller import BACKENDS
+from neubot.net.poller import Pollable
+from neubot.net.poller import Poller
+from neubot import utils
+
+# Number of idle sockets for each run
+SIZES = (10, 1000, 10000)
+
+# Number of loop iterations for each run
+ITERATIONS = 200
+
+# select() cannot deal with file descriptors above this one
+FD_SETSIZE = 1024
+
+class IdleStream(Pollable):
+    ''' A stream that is never readable '''
+
+    def __init__(self):
+        ''' Initialize the stream '''
+        Pollable.__init__(self)
+        # Unbound UDP sockets never become readable
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def fileno(self):
+        ''' Return file number '''
+        return self.sock.fileno()
+
+def max_sockets():
+    ''' Return the maximum number of sockets we can open '''
+    if not resource:
+        return FD_SETSIZE
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard or hard == resource.RLIM_INFINITY:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            soft = hard
+        except (ValueError, resource.error):
+            pass
+    return soft - 64
+
+def run(name, size):
+    ''' Measure the cost of an iteration with @size idle sockets '''
+    poller = Poller(0, name)
+    # Don't wait for the pending check_timeout()
+    for task in poller.tasks:
+        task.cancel()
+    streams = [IdleStream() for _ in range(size)]
+    for stream in streams:
+        poller.set_readable(stream)
+
+    begin = utils.ticks()
+    for _ in range(ITERATIONS):
+        poller._loop_once()
+    elapsed = utils.ticks() - begin
+
+    for stream in streams:
+        poller.unset_readable(stream)
+        stream.sock.close()
+    poller.backend.close()
+
+    return elapsed / ITERATIONS
+
+def main():
+    ''' Benchmark the poller backends '''
+    limit = max_sockets()
+    for name in sorted(BACKENDS):
+        if not BACKENDS[name]:
+            print('%-6s: not available' % name)
+            continue
+        for size in SIZES:
+            if size > limit or (name == 'select' and size > FD_SETSIZE - 64):
+                print('%-6s: %5d sockets: skipped' % (name, size))
+                continue
+            print('%-6s: %5d sockets: %s per iteration' % (name, size,
+                  utils.time_formatter(run(name, size))))
+
+if __name__ == '__main__':
+    main()
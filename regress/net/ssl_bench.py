@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2012 Simone Basso <bassosimone@gmail.com>,
+#  NEXA Center for Internet & Society at Politecnico di Torino
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+''' Benchmark SSL handshakes over loopback '''
+
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+
+sys.path.insert(0, '.')
+
+from neubot.net import stream
+from neubot import utils
+
+# Number of handshakes for each run
+HANDSHAKES = 200
+
+def make_certfile(basedir):
+    ''' Generate a self-signed certificate like net.CA does '''
+    certfile = os.sep.join([basedir, "cert.pem"])
+    devnull = open(os.devnull, "w")
+    result = subprocess.call(["openssl", "req", "-new", "-x509", "-nodes",
+      "-newkey", "rsa:2048", "-keyout", certfile, "-out", certfile,
+      "-days", "1", "-subj", "/CN=localhost"], stdout=devnull,
+      stderr=devnull)
+    devnull.close()
+    if result != 0:
+        return None
+    return certfile
+
+def wrap(sock, certfile, server_side, cached):
+    ''' Wrap a socket the old way or with a cached context '''
+    if not cached:
+        return stream.ssl.wrap_socket(sock, certfile=certfile,
+          server_side=server_side)
+    context = stream.ssl_context(certfile, server_side)
+    return context.wrap_socket(sock, server_side=server_side)
+
+def serve(lsock, certfile, cached):
+    ''' Accept connections and perform the server-side handshake '''
+    for _ in range(HANDSHAKES):
+        sock = lsock.accept()[0]
+        ssl_sock = wrap(sock, certfile, True, cached)
+        ssl_sock.read(1)
+        ssl_sock.close()
+
+def run(certfile, cached):
+    ''' Measure HANDSHAKES handshakes '''
+    stream.SSL_CONTEXTS.clear()
+    lsock = socket.socket()
+    lsock.bind(("127.0.0.1", 0))
+    lsock.listen(128)
+    thread = threading.Thread(target=serve, args=(lsock, certfile, cached))
+    thread.start()
+
+    begin = utils.ticks()
+    for _ in range(HANDSHAKES):
+        sock = socket.create_connection(lsock.getsockname())
+        ssl_sock = wrap(sock, None, False, cached)
+        ssl_sock.write("A")
+        ssl_sock.close()
+    thread.join()
+    elapsed = utils.ticks() - begin
+    lsock.close()
+
+    print('cached=%-5s %.1f handshakes/s' % (cached, HANDSHAKES / elapsed))
+
+def main():
+    ''' Benchmark SSL handshakes '''
+    if not stream.ssl or not hasattr(stream.ssl, "SSLContext"):
+        print('SSL contexts not available')
+        return
+    basedir = tempfile.mkdtemp()
+    try:
+        certfile = make_certfile(basedir)
+        if not certfile:
+            print('cannot generate certificate')
+            return
+        run(certfile, False)
+        run(certfile, True)
+    finally:
+        shutil.rmtree(basedir)
+
+if __name__ == '__main__':
+    main()
@@ -21,9 +21,13 @@
 #
 
 import StringIO
+import os
 import random
+import socket
 import struct
 import sys
+import tempfile
+import time
 import unittest
 
 if __name__ == "__main__":
@@ -31,6 +35,9 @@ if __name__ == "__main__":
 
 from neubot.config import CONFIG
 from neubot.net import stream
+from neubot.net import timestamping
+from neubot.net.poller import Poller
+from neubot import utils
 
 #
 # Provide the bare minimum needed to look
@@ -386,6 +393,136 @@ class TestStreamReadable_UnknownStatus(TestStream_Base):
         self.stream.handle_write = lambda: 1/0
         self.assertRaises(RuntimeError, self.stream.handle_read)
 
+#
+# With recv_into we read into a pooled buffer and pass
+# recv_complete() a view of the bytes we have read, then
+# we give the buffer back to the pool.
+#
+class TestStreamReadable_RecvInto(TestStream_Base):
+    def runTest(self):
+        self.count = 0
+        self.stream.recv_into = True
+        self.stream.sock.sorecv = lambda k: 1/0
+        self.stream.sock.sorecv_into = self.sorecv_into
+        self.stream.handle_write = lambda: 1/0
+        self.stream.recv_complete = self.recv_complete
+        self.stream.handle_read()
+        self.assertEqual(self.count, 2)
+        self.assertFalse(self.stream.recv_pending)
+        self.assertTrue(stream.BUFFER_POOL.idle[-1] is self.buf)
+
+    def sorecv_into(self, buf, flags):
+        self.buf = buf
+        buf[:3] = "abc"
+        return stream.SUCCESS, 3
+
+    def unset_readable(self, stream):
+        self.count += 1
+
+    def recv_complete(self, octets):
+        self.assertTrue(isinstance(octets, memoryview))
+        self.assertEqual(octets.tobytes(), "abc")
+        self.count += 1
+
+class TestStreamReadable_RecvIntoEOF(TestStream_Base):
+    def runTest(self):
+        self.stream.recv_into = True
+        self.stream.sock.sorecv_into = lambda buf, flags: (stream.SUCCESS, 0)
+        self.stream.handle_write = lambda: 1/0
+        self.stream.handle_read()
+        self.assertTrue(self.stream.eof)
+
+    def close(self, stream):
+        pass
+
+class TestStreamReadable_Continuous(TestStream_Base):
+    def setUp(self):
+        TestStream_Base.setUp(self)
+        self.chunks = ["abc", "def", "ghi"]
+        self.received = []
+        self.stream.continuous = True
+        self.stream.recv_pending = True
+        self.stream.sock.sorecv = self.sorecv
+        self.stream.recv_complete = self.recv_complete
+
+    def test_until_eagain(self):
+        """Make sure we read until EAGAIN, keeping the stream readable"""
+        self.stream.handle_read()
+        self.assertEqual(self.received, ["abc", "def", "ghi"])
+        self.assertTrue(self.stream.recv_pending)
+
+    def test_budget(self):
+        """Make sure we stop when the budget is exhausted"""
+        self.stream.budget_iterations = 2
+        self.stream.handle_read()
+        self.assertEqual(self.received, ["abc", "def"])
+
+    def sorecv(self, maxlen):
+        if not self.chunks:
+            return stream.WANT_READ, ""
+        return stream.SUCCESS, self.chunks.pop(0)
+
+    def recv_complete(self, octets):
+        self.received.append(octets)
+        self.stream.start_recv()
+
+    def set_readable(self, stream):
+        pass
+
+class TestStreamWritable_Continuous(TestStream_Base):
+    def setUp(self):
+        TestStream_Base.setUp(self)
+        self.sent = []
+        self.stream.continuous = True
+        self.stream.sock.sosend = self.sosend
+        self.stream.send_complete = self.send_complete
+        self.unset = 0
+
+    def test_until_full(self):
+        """Make sure we write until the socket buffer is full"""
+        self.stream.start_send("A" * 10)
+        self.stream.handle_write()
+        self.assertEqual(len(self.sent), 4)
+        self.assertTrue(self.stream.send_pending)
+        self.assertEqual(self.unset, 0)
+
+    def test_complete(self):
+        """Make sure we unset writable when there's nothing to send"""
+        self.stream.send_complete = lambda: None
+        self.stream.start_send("A" * 10)
+        self.stream.handle_write()
+        self.assertFalse(self.stream.send_pending)
+        self.assertEqual(self.unset, 1)
+
+    def sosend(self, octets):
+        if len(self.sent) == 3:
+            self.sent.append(octets[:5])
+            return stream.SUCCESS, 5
+        self.sent.append(octets)
+        return stream.SUCCESS, len(octets)
+
+    def send_complete(self):
+        self.stream.start_send("A" * 10)
+
+    def set_writable(self, stream):
+        pass
+
+    def unset_writable(self, stream):
+        self.unset += 1
+
+class TestBufferPool(unittest.TestCase):
+    def runTest(self):
+        """Make sure the buffer pool recycles buffers"""
+        pool = stream.BufferPool(16, 1)
+        first, second = pool.get(), pool.get()
+        self.assertEqual(pool.allocated, 2)
+        self.assertEqual(len(first), 16)
+        pool.put(first)
+        pool.put(second)
+        self.assertEqual(pool.idle, [first])
+        self.assertTrue(pool.get() is first)
+        self.assertEqual(pool.allocated, 2)
+
 #
 #  ____                    _
 # / ___|   ___  _ __    __| |
@@ -469,5 +606,579 @@ class TestStreamSend_ReandSendQueue_NotEmpty(unittest.TestCase):
     def set_writable(self, stream):
         pass
 
+#
+# Make sure that small queued buffers are gathered into a single
+# send, that partial sends are tracked with an offset, and that we
+# don't gather when we must retry the send of the same buffer.
+#
+class TestStreamSend_Gather(unittest.TestCase):
+    def runTest(self):
+        """Make sure we gather small buffers into a single send"""
+        s = stream.Stream(self)
+        s.sock = self
+        self.sent = []
+        self.results = [(stream.WANT_WRITE, 0), (stream.SUCCESS, 3),
+                        (stream.SUCCESS, 3)]
+
+        s.start_send("abc")
+        s.handle_write()
+        self.assertTrue(s.send_retry)
+
+        # Not gathered because we must retry
+        s.start_send("def")
+        s.start_send(StringIO.StringIO("ghi"))
+        s.handle_write()
+        self.assertEqual(self.sent[-1], "abc")
+
+        # Not gathered because a file-like follows
+        s.start_send("jkl")
+        s.handle_write()
+        self.assertEqual(self.sent[-1], "def")
+
+        # Not gathered because the file-like is not at EOF yet
+        s.start_send("")
+        s.start_send("mno")
+        self.results = [(stream.SUCCESS, 3)]
+        s.handle_write()
+        self.assertEqual(self.sent[-1], "ghi")
+
+        # Gathered skipping the empty string, then partially sent
+        self.results = [(stream.SUCCESS, 3)]
+        s.handle_write()
+        self.assertEqual(self.sent[-1], "jklmno")
+        self.assertEqual(s.send_offset, 3)
+
+        self.results = [(stream.SUCCESS, 3)]
+        s.handle_write()
+        self.assertEqual(self.sent[-1], "mno")
+        self.assertFalse(s.send_pending)
+        self.assertEqual(s.send_offset, 0)
+        self.assertEqual(s.bytes_sent_tot, 15)
+
+    def sosend(self, octets):
+        if isinstance(octets, memoryview):
+            octets = octets.tobytes()
+        self.sent.append(octets)
+        return self.results.pop(0)
+
+    def set_writable(self, stream):
+        pass
+
+    def unset_writable(self, stream):
+        pass
+
+#
+# Make sure that regular files are sent with sendfile() when
+# the socket supports it, and read and sent otherwise.
+#
+class TestStreamSend_Sendfile(unittest.TestCase):
+    def setUp(self):
+        self.data = os.urandom(1 << 20)
+        self.filep = tempfile.TemporaryFile()
+        self.filep.write(self.data)
+        self.filep.seek(0)
+
+    def tearDown(self):
+        self.filep.close()
+
+    def _transfer(self, wrap, pieces=("headers",)):
+        left, right = socket.socketpair()
+        left.setblocking(False)
+        s = stream.Stream(self)
+        s.sock = wrap(left)
+        for octets in pieces:
+            s.start_send(octets)
+        s.start_send(self.filep)
+        received = []
+        while s.send_pending:
+            s.handle_write()
+            received.append(right.recv(1 << 20))
+        left.close()
+        right.close()
+        return "".join(received)
+
+    def test_sendfile(self):
+        """Make sure we use sendfile() with regular files"""
+        if not stream.SENDFILE:
+            return
+        regions = []
+        def wrap(sock):
+            wrapper = stream.SocketWrapper(sock)
+            sosendfile = wrapper.sosendfile
+            def counting_sosendfile(region):
+                regions.append(region)
+                return sosendfile(region)
+            wrapper.sosendfile = counting_sosendfile
+            return wrapper
+        self.assertEqual(self._transfer(wrap), "headers" + self.data)
+        self.assertTrue(regions)
+
+    def test_truncated(self):
+        """Make sure a file truncated while sending it is an error"""
+        if not stream.SENDFILE:
+            return
+        left, right = socket.socketpair()
+        left.setblocking(False)
+        s = stream.Stream(self)
+        s.sock = stream.SocketWrapper(left)
+        s.start_send(self.filep)
+        self.filep.truncate(1000)
+        s.handle_write()
+        self.assertEqual(right.recv(1 << 20), self.data[:1000])
+        self.assertRaises(RuntimeError, s.handle_write)
+        self.assertFalse(s.eof)
+        left.close()
+        right.close()
+
+    def test_fallback(self):
+        """Make sure we read the file when we can't use sendfile()"""
+        class Wrapper(object):
+            def __init__(self, sock):
+                self.sock = sock
+            def sosend(self, octets):
+                return stream.SocketWrapper(self.sock).sosend(octets)
+        self.assertEqual(self._transfer(Wrapper), "headers" + self.data)
+
+    def test_empty_string(self):
+        """Make sure we don't gather a file after an empty string"""
+        self.assertEqual(self._transfer(stream.SocketWrapper,
+                                        ("headers", "")),
+                         "headers" + self.data)
+
+    def test_empty(self):
+        """Make sure we skip a file that is at EOF"""
+        self.filep.seek(0, os.SEEK_END)
+        self.assertEqual(self._transfer(stream.SocketWrapper), "headers")
+
+    def set_writable(self, stream):
+        pass
+
+    def unset_writable(self, stream):
+        pass
+
+class TestStream_Timestamps(unittest.TestCase):
+    def setUp(self):
+        lsock = socket.socket()
+        lsock.bind(("127.0.0.1", 0))
+        lsock.listen(1)
+        self.right = socket.create_connection(lsock.getsockname())
+        self.left = lsock.accept()[0]
+        self.left.setblocking(False)
+        lsock.close()
+
+    def tearDown(self):
+        self.left.close()
+        self.right.close()
+
+    def _roundtrip(self, kernel):
+        conf = CONFIG.copy()
+        conf["net.stream.rx_timestamps"] = kernel
+        s = stream.Stream(self)
+        s.attach(self, self.left, conf)
+        s.start_timestamps()
+        # Linux may enable packet timestamps a little later
+        time.sleep(0.05)
+        s.start_send("ping")
+        s.handle_write()
+        self.assertEqual(self.right.recv(16), "ping")
+        self.right.sendall("pong")
+        time.sleep(0.1)
+        s.start_recv()
+        s.handle_read()
+        return s
+
+    def test_kernel(self):
+        """Make sure rx_time is the kernel timestamp of the packet"""
+        if not timestamping.available():
+            return
+        s = self._roundtrip(True)
+        self.assertTrue(s.sock.stamped)
+        self.assertTrue(s.tx_time <= s.rx_time <= utils.ticks() - 0.05)
+        s.stop_timestamps()
+        self.assertFalse(s.sock.stamped)
+
+    def test_kernel_pooled(self):
+        """Make sure timestamped reads borrow the buffer from the pool"""
+        if not timestamping.available():
+            return
+        saved = stream.BUFFER_POOL
+        stream.BUFFER_POOL = stream.BufferPool(stream.MAXBUF)
+        try:
+            received = []
+            s = stream.Stream(self)
+            s.recv_complete = received.append
+            conf = CONFIG.copy()
+            conf["net.stream.rx_timestamps"] = True
+            s.attach(self, self.left, conf)
+            s.start_timestamps()
+            for octets in ("ping", "pong"):
+                self.right.sendall(octets)
+                time.sleep(0.1)
+                s.start_recv()
+                s.handle_read()
+            self.assertEqual(received, ["ping", "pong"])
+            self.assertEqual(stream.BUFFER_POOL.allocated, 1)
+            self.assertEqual(len(stream.BUFFER_POOL.idle), 1)
+        finally:
+            stream.BUFFER_POOL = saved
+
+    def test_userspace(self):
+        """Make sure rx_time is taken at read time without kernel help"""
+        s = self._roundtrip(False)
+        self.assertFalse(s.sock.stamped)
+        self.assertTrue(s.rx_time - s.tx_time >= 0.1)
+
+    def set_readable(self, stream):
+        pass
+    def set_writable(self, stream):
+        pass
+    def unset_readable(self, stream):
+        pass
+    def unset_writable(self, stream):
+        pass
+
+class TestGenericProtocolStream_Zerocopy(unittest.TestCase):
+    def setUp(self):
+        lsock = socket.socket()
+        lsock.bind(("127.0.0.1", 0))
+        lsock.listen(1)
+        self.right = socket.create_connection(lsock.getsockname())
+        self.left = lsock.accept()[0]
+        self.left.setblocking(False)
+        lsock.close()
+        self.events = []
+
+    def tearDown(self):
+        self.left.close()
+        self.right.close()
+
+    def _stream(self, kind):
+        s = stream.GenericProtocolStream(self)
+        s.kind = kind
+        conf = CONFIG.copy()
+        conf["net.stream.zerocopy"] = True
+        conf["net.stream.duration"] = -1
+        s.attach(self, self.left, conf)
+        return s
+
+    def test_echo(self):
+        """Make sure echo with splice() sends back what it receives"""
+        if not stream.SPLICE:
+            return
+        s = self._stream("echo")
+        self.assertTrue(s.pipe)
+        self.right.sendall("abcdef")
+        s.handle_read()
+        self.assertEqual(s.pipe_bytes, 6)
+        self.assertEqual(self.events[-1], "set_writable")
+        s.handle_write()
+        self.assertEqual(s.pipe_bytes, 0)
+        self.assertEqual(self.events[-1], "set_readable")
+        self.assertEqual(self.right.recv(16), "abcdef")
+        s.handle_close()
+        self.assertEqual(s.pipe, None)
+
+    def test_discard(self):
+        """Make sure discard receives with MSG_TRUNC"""
+        if not sys.platform.startswith("linux"):
+            return
+        s = self._stream("discard")
+        self.assertEqual(s.recv_flags, socket.MSG_TRUNC)
+        self.right.sendall("A" * 1000)
+        s.handle_read()
+        self.assertEqual(s.bytes_recv_tot, 1000)
+
+    def test_chargen(self):
+        """Make sure chargen sends a regular file"""
+        if not stream.SENDFILE:
+            return
+        s = self._stream("chargen")
+        self.assertTrue(isinstance(s.buffer, file))
+        s.handle_write()
+        self.assertEqual(self.right.recv(16), "A" * 16)
+        s.handle_close()
+        self.assertTrue(s.buffer.closed)
+
+    def set_readable(self, stream):
+        self.events.append("set_readable")
+
+    def unset_readable(self, stream):
+        self.events.append("unset_readable")
+
+    def set_writable(self, stream):
+        self.events.append("set_writable")
+
+    def unset_writable(self, stream):
+        self.events.append("unset_writable")
+
+    def close(self, stream):
+        stream.handle_close()
+
+    def connection_lost(self, stream):
+        pass
+
+class TestInterleave(unittest.TestCase):
+    def runTest(self):
+        """Make sure we interleave families starting with IPv6"""
+        addrinfo = [(socket.AF_INET, 1), (socket.AF_INET, 2),
+                    (socket.AF_INET6, 3), (socket.AF_INET6, 4),
+                    (socket.AF_INET6, 5)]
+        self.assertEqual([ainfo[1] for ainfo in
+                          stream._interleave(addrinfo)], [3, 1, 4, 2, 5])
+
+class TestConnect(unittest.TestCase):
+    def setUp(self):
+        self.poller = Poller(1)
+        self.lsock = socket.socket()
+        self.lsock.bind(("127.0.0.1", 0))
+        self.lsock.listen(128)
+        self.address = self.lsock.getsockname()
+        self.conf = CONFIG.copy()
+        self.made = []
+        self.failed = []
+
+    def tearDown(self):
+        for sock, rtt in self.made:
+            sock.close()
+        self.lsock.close()
+
+    def _handler(self):
+        handler = stream.StreamHandler(self.poller)
+        handler.connection_made = lambda sock, rtt=0: \
+          self.made.append((sock, rtt))
+        handler.connection_failed = lambda connector, exception: \
+          self.failed.append(exception)
+        handler.configure(self.conf)
+        return handler
+
+    def test_concurrent(self):
+        """Make sure we connect in parallel up to max_connects"""
+        self.conf["net.stream.max_connects"] = 3
+        handler = self._handler()
+        handler.connect(self.address, count=4)
+        self.assertEqual(handler.connecting, 3)
+        self.poller.loop()
+        self.assertEqual(len(self.made), 4)
+        self.assertEqual(len(handler.rtts), 4)
+        self.assertEqual(handler.connecting, 0)
+
+    def test_next_on_failure(self):
+        """Make sure we try the next address when one fails"""
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        closed = sock.getsockname()
+        sock.close()
+
+        self.conf["net.stream.happy_eyeballs_delay"] = 10.0
+        handler = self._handler()
+        connector = stream.Connector(self.poller, handler)
+        connector.conf = self.conf
+        handler.connecting = 1
+        begin = utils.ticks()
+        connector._resolved(None, [
+          (socket.AF_INET, socket.SOCK_STREAM, 0, "", closed),
+          (socket.AF_INET, socket.SOCK_STREAM, 0, "", self.address),
+        ])
+        self.poller.loop()
+        self.assertTrue(utils.ticks() - begin < 5)
+        self.assertEqual(len(self.made), 1)
+        self.assertEqual(self.made[0][0].getpeername(), self.address)
+        self.assertFalse(self.failed)
+
+    def test_race(self):
+        """Make sure the first connection wins and the others are closed"""
+        handler = self._handler()
+        connector = stream.Connector(self.poller, handler)
+        connector.conf = self.conf
+        handler.connecting = 1
+        connector._resolved(None, [
+          (socket.AF_INET, socket.SOCK_STREAM, 0, "", self.address),
+          (socket.AF_INET, socket.SOCK_STREAM, 0, "", self.address),
+        ])
+        self.assertEqual(len(connector.attempts), 1)
+        self.assertTrue(connector.task)
+        self.poller.loop()
+        self.assertEqual(len(self.made), 1)
+        self.assertFalse(connector.attempts)
+        self.assertFalse(connector.addrinfo)
+
+    def test_all_fail(self):
+        """Make sure we report failure when all the addresses fail"""
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        closed = sock.getsockname()
+        sock.close()
+
+        handler = self._handler()
+        handler.connect(closed, count=2)
+        self.poller.loop()
+        self.assertEqual(len(self.failed), 2)
+        self.assertFalse(self.made)
+
+class TestListener_Batch(unittest.TestCase):
+    def setUp(self):
+        self.accepted = []
+        self.failed = []
+        self.conf = CONFIG.copy()
+        self.conf["net.stream.accept_batch"] = 3
+        self.listener = stream.Listener(self, self)
+        self.listener.conf = self.conf
+        self.listener.lsock = socket.socket()
+        self.listener.lsock.bind(("127.0.0.1", 0))
+        self.listener.lsock.listen(self.conf["net.stream.backlog"])
+        self.listener.lsock.setblocking(False)
+        address = self.listener.lsock.getsockname()
+        self.clients = [socket.create_connection(address) for _ in range(5)]
+
+    def tearDown(self):
+        for sock in self.accepted + self.clients:
+            sock.close()
+        self.listener.lsock.close()
+
+    def runTest(self):
+        """Make sure we accept up to accept_batch connections per wakeup"""
+        self.listener.handle_read()
+        self.assertEqual(len(self.accepted), 3)
+        self.listener.handle_read()
+        self.assertEqual(len(self.accepted), 5)
+        self.listener.handle_read()
+        self.assertEqual(len(self.accepted), 5)
+        self.assertFalse(self.failed)
+        self.assertTrue(stream.ACCEPT_STATS["accept_max_batch"] >= 3)
+
+    def connection_made(self, sock):
+        self.assertEqual(sock.gettimeout(), 0.0)
+        self.accepted.append(sock)
+
+    def accept_failed(self, listener, exception):
+        self.failed.append(exception)
+
+class TestListener_Listen(unittest.TestCase):
+    def setUp(self):
+        self.poller = Poller(1)
+        self.listening = []
+        self.failed = []
+
+    def tearDown(self):
+        for listener in self.listening:
+            listener.lsock.close()
+
+    def runTest(self):
+        """Make sure we are bound before the loop runs"""
+        conf = CONFIG.copy()
+        conf["net.stream.ipv6"] = False
+        listener = stream.Listener(self.poller, self)
+        listener.listen(("localhost", 0), conf)
+        self.assertFalse(self.failed)
+        self.assertEqual(self.listening, [listener])
+        self.assertEqual(listener.lsock.getsockname()[0], "127.0.0.1")
+        self.assertFalse(self.poller.outstanding)
+
+    def started_listening(self, listener):
+        self.listening.append(listener)
+
+    def bind_failed(self, listener, exception):
+        self.failed.append(exception)
+
+class TestNetstat(unittest.TestCase):
+    def runTest(self):
+        """Make sure we parse the TcpExt section of netstat"""
+        filep = tempfile.NamedTemporaryFile()
+        filep.write("TcpExt: SyncookiesSent ListenOverflows ListenDrops\n"
+                    "TcpExt: 0 7 9\n"
+                    "IpExt: InNoRoutes\n"
+                    "IpExt: 3\n")
+        filep.flush()
+        netstat = stream._read_netstat(filep.name)
+        self.assertEqual(netstat, {"SyncookiesSent": 0,
+          "ListenOverflows": 7, "ListenDrops": 9})
+        self.assertEqual(stream._read_netstat("/nonexistent"), {})
+        self.assertTrue("accept_rate" in stream.accept_stats())
+
+class TestSSLContext(unittest.TestCase):
+    def runTest(self):
+        """Make sure we create one SSL context per (certfile, side)"""
+        if not stream.ssl or not hasattr(stream.ssl, "SSLContext"):
+            return
+        context = stream.ssl_context(None, False)
+        self.assertTrue(context is stream.ssl_context(None, False))
+        self.assertTrue(context is not stream.ssl_context(None, True))
+        self.assertRaises(IOError, stream.ssl_context, "/nonexistent", True)
+        self.assertFalse(("/nonexistent", True) in stream.SSL_CONTEXTS)
+
+class TestStreamSend_Watermarks(unittest.TestCase):
+    def setUp(self):
+        self.stream = stream.Stream(self)
+        self.stream.sock = self
+        self.stream.high_watermark = 10
+        self.stream.low_watermark = 4
+        self.events = []
+        self.stream.send_paused = lambda: self.events.append("paused")
+        self.stream.send_resumed = lambda: self.events.append("resumed")
+        self.maxsend = 3
+
+    def runTest(self):
+        """Make sure we pause and resume producers"""
+        self.stream.start_send("A" * 6)
+        self.stream.start_send("B" * 6)
+        self.assertEqual(self.stream.send_queue_bytes(), 12)
+        self.assertTrue(self.stream.send_throttled)
+        self.assertEqual(self.events, ["paused"])
+
+        # Gathering does not change the count
+        self.stream.handle_write()
+        self.assertEqual(self.stream.send_queue_bytes(), 9)
+        self.assertEqual(self.events, ["paused"])
+
+        self.stream.handle_write()
+        self.stream.handle_write()
+        self.assertEqual(self.stream.send_queue_bytes(), 3)
+        self.assertFalse(self.stream.send_throttled)
+        self.assertEqual(self.events, ["paused", "resumed"])
+
+        self.stream.handle_write()
+        self.assertEqual(self.stream.send_queue_bytes(), 0)
+        self.assertEqual(self.stream.send_queue_len, 0)
+
+    def sosend(self, octets):
+        return stream.SUCCESS, min(len(octets), self.maxsend)
+
+    def set_writable(self, stream):
+        pass
+
+    def unset_writable(self, stream):
+        pass
+
+class TestStreamSend_Backpressure(unittest.TestCase):
+    def runTest(self):
+        """Make sure backpressure is off unless enabled"""
+        self.assertEqual(CONFIG["net.stream.high_watermark"], 0)
+        s = stream.Stream(self)
+        s.sock = self
+        s.send_pending = True
+        s.start_send("A" * stream.HIGH_WATERMARK)
+        self.assertFalse(s.send_throttled)
+        s.enable_backpressure()
+        s.start_send("B")
+        self.assertTrue(s.send_throttled)
+
+class TestGenericProtocolStream_EchoThrottle(unittest.TestCase):
+    def runTest(self):
+        """Make sure echo stops reading while the peer is slow"""
+        s = stream.GenericProtocolStream(self)
+        s.kind = "echo"
+        s.high_watermark = 4
+        s.send_pending = True
+        self.recv = 0
+        s.start_recv = self.start_recv
+        s.recv_complete("abcdef")
+        self.assertTrue(s.send_throttled)
+        self.assertEqual(self.recv, 0)
+        s.send_resumed()
+        self.assertEqual(self.recv, 1)
+
+    def start_recv(self):
+        self.recv += 1
+
 if __name__ == "__main__":
     unittest.main()
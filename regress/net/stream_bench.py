@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2012 Simone Basso <bassosimone@gmail.com>,
+#  NEXA Center for Internet & Society at Politecnico di Torino
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+''' Benchmark the stream I/O paths with chargen and discard '''
+
+import logging
+import resource
+import sys
+
+sys.path.insert(0, '.')
+
+from neubot.config import CONFIG
+from neubot.net.poller import Poller
+from neubot.net.stream import BUFFER_POOL
+from neubot.net.stream import GenericHandler
+from neubot.net.stream import GenericProtocolStream
+from neubot import utils
+
+# Duration of each run, in seconds
+DURATION = 3
+
+# Port used by the chargen server
+PORT = 12346
+
+def cpu_time():
+    ''' Return user plus system time '''
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def run(recv_into, continuous=False):
+    ''' Run chargen against discard for DURATION seconds '''
+    poller = Poller(1)
+
+    # Count the receive operations
+    counter = [0, 0]
+    recv_complete = GenericProtocolStream.recv_complete
+    def counting_recv_complete(self, octets):
+        ''' Count receive operations and received bytes '''
+        counter[0] += 1
+        counter[1] += len(octets)
+        recv_complete(self, octets)
+    GenericProtocolStream.recv_complete = counting_recv_complete
+
+    conf = CONFIG.copy()
+    conf["net.stream.recv_into"] = recv_into
+    conf["net.stream.continuous"] = continuous
+    conf["net.stream.duration"] = DURATION
+    conf["net.stream.proto"] = "chargen"
+    server = GenericHandler(poller)
+    server.configure(conf)
+    server.listen(("127.0.0.1", PORT))
+
+    conf = conf.copy()
+    conf["net.stream.proto"] = "discard"
+    client = GenericHandler(poller)
+    client.configure(conf)
+    client.connect(("127.0.0.1", PORT))
+
+    allocated = BUFFER_POOL.allocated
+    begin = cpu_time()
+    poller.sched(DURATION + 1, poller.break_loop)
+    poller.loop()
+    cpu = cpu_time() - begin
+    GenericProtocolStream.recv_complete = recv_complete
+
+    for stream in poller.readset.values():
+        poller.close(stream)
+
+    gbytes = counter[1] / float(1 << 30)
+    if recv_into:
+        allocations = BUFFER_POOL.allocated - allocated
+    else:
+        allocations = counter[0]
+    mbytes = max(counter[1] / float(1 << 20), 1e-9)
+    print('recv_into=%-5s continuous=%-5s %s, %d recvs, %d buffers '
+          'allocated, %.1f iterations/MB, %.2f CPU s/GB, maxrss %d KiB' % (
+          recv_into, continuous,
+          utils.speed_formatter(counter[1] / float(DURATION)), counter[0],
+          allocations, poller.stats.iterations / mbytes,
+          cpu / max(gbytes, 1e-9),
+          resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+def main():
+    ''' Benchmark the I/O paths '''
+    logging.getLogger().setLevel(logging.ERROR)
+    run(False)
+    run(True)
+    run(True, True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2012 Simone Basso <bassosimone@gmail.com>,
+#  NEXA Center for Internet & Society at Politecnico di Torino
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import socket
+import sys
+import unittest
+
+if __name__ == "__main__":
+    sys.path.insert(0, ".")
+
+from neubot.net import tcpinfo
+from neubot.net.poller import Poller
+
+class FakeSampler(object):
+    def __init__(self, series, retransmits_base=0):
+        self.series = series
+        self.retransmits_base = retransmits_base
+
+class TestSample(unittest.TestCase):
+    def runTest(self):
+        """Make sure we can sample TCP_INFO of a loopback socket"""
+        if not tcpinfo.available():
+            return
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        client = socket.create_connection(listener.getsockname())
+        server = listener.accept()[0]
+        client.sendall("A" * 65536)
+
+        poller = Poller(1)
+        sampler = tcpinfo.TCPInfoSampler(poller, client, 0.5)
+        sampler.start()
+        self.assertTrue(sampler.task)
+        sampler.stop()
+        self.assertEqual(sampler.task, None)
+
+        self.assertEqual(len(sampler.series), 2)
+        entry = sampler.series[-1]
+        self.assertEqual(len(entry), len(tcpinfo.FIELDS))
+        self.assertTrue(entry[1] > 0)
+        self.assertTrue(entry[3] > 0)
+
+        for sock in (client, server, listener):
+            sock.close()
+
+        # Sampling a closed socket must not raise
+        sampler.take()
+        self.assertEqual(len(sampler.series), 2)
+
+class TestSummarize(unittest.TestCase):
+    def runTest(self):
+        """Make sure we correctly summarize the time series"""
+        first = FakeSampler([
+                             (0.0, 0.010, 0.002, 10, 0, 100, 200),
+                             (0.5, 0.030, 0.004, 20, 2, 300, 400),
+                            ])
+        second = FakeSampler([
+                              (0.0, 0.020, 0.003, 40, 1, 1000, 2000),
+                             ])
+        summary = tcpinfo.summarize([first, second, FakeSampler([])],
+                                     "tcp_download_")
+        self.assertAlmostEqual(summary["tcp_download_rtt"], 0.020)
+        self.assertAlmostEqual(summary["tcp_download_rttvar"], 0.003)
+        self.assertEqual(summary["tcp_download_snd_cwnd"], 40)
+        self.assertEqual(summary["tcp_download_retransmits"], 3)
+        self.assertAlmostEqual(summary["tcp_download_delivery_rate"], 1200)
+        self.assertAlmostEqual(summary["tcp_download_pacing_rate"], 2300)
+
+class TestSummarize_Phase(unittest.TestCase):
+    def runTest(self):
+        """Make sure phases have their own keys and retransmits"""
+        sampler = FakeSampler([(0.0, 0.010, 0.002, 10, 7, 100, 200),
+                               (0.5, 0.010, 0.002, 10, 9, 100, 200)],
+                              retransmits_base=5)
+        summary = tcpinfo.summarize([sampler], "tcp_upload_")
+        self.assertEqual(summary["tcp_upload_retransmits"], 4)
+        self.assertAlmostEqual(summary["tcp_upload_rtt"], 0.010)
+        self.assertFalse("tcp_rtt" in summary)
+
+class TestReset(unittest.TestCase):
+    def runTest(self):
+        """Make sure reset keeps the retransmits baseline"""
+        sampler = tcpinfo.TCPInfoSampler(None, None, 1)
+        sampler.take = lambda: sampler.series.append((1.0, 0.010, 0.002,
+                                                      10, 3, 100, 200))
+        sampler.reset()
+        self.assertEqual(sampler.series, [])
+        self.assertEqual(sampler.retransmits_base, 3)
+
+class TestSummarize_Empty(unittest.TestCase):
+    def runTest(self):
+        """Make sure the summary of no samples is all zeroes"""
+        summary = tcpinfo.summarize([], "tcp_download_")
+        self.assertEqual(sorted(summary.keys()), sorted([
+          "tcp_download_rtt", "tcp_download_rttvar",
+          "tcp_download_snd_cwnd", "tcp_download_retransmits",
+          "tcp_download_delivery_rate", "tcp_download_pacing_rate"]))
+        self.assertFalse(any(summary.values()))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2012 Simone Basso <bassosimone@gmail.com>,
+#  NEXA Center for Internet & Society at Politecnico di Torino
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import socket
+import sys
+import unittest
+
+if __name__ == "__main__":
+    sys.path.insert(0, ".")
+
+from neubot.config import CONFIG
+from neubot.net import stream
+from neubot.net import tuning
+
+class FakeStream(object):
+    def __init__(self, tunings):
+        self.tunings = tunings
+
+class TestSettings(unittest.TestCase):
+    def runTest(self):
+        """Make sure the configuration overrides the profile"""
+        conf = CONFIG.copy()
+        self.assertEqual(tuning.settings(conf, "latency"),
+                         tuning.PROFILES["latency"])
+        conf["net.tuning.bulk.sndbuf"] = 65536
+        self.assertEqual(tuning.settings(conf, "bulk")["sndbuf"], 65536)
+        self.assertEqual(tuning.settings({}, "bulk"), tuning.PROFILES["bulk"])
+
+class TestApply(unittest.TestCase):
+    def setUp(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+    def tearDown(self):
+        self.sock.close()
+
+    def test_latency(self):
+        """Make sure the latency profile disables Nagle"""
+        description = tuning.apply(self.sock, "latency",
+                                   tuning.PROFILES["latency"])
+        self.assertTrue(description.startswith("latency("))
+        self.assertTrue(self.sock.getsockopt(socket.IPPROTO_TCP,
+                                             socket.TCP_NODELAY))
+        if sys.platform.startswith("linux"):
+            self.assertEqual(self.sock.getsockopt(socket.IPPROTO_TCP,
+                             tuning.TCP_NOTSENT_LOWAT), 16384)
+
+    def test_switch(self):
+        """Make sure switching to bulk restores Nagle and lowat"""
+        tuning.apply(self.sock, "latency", tuning.PROFILES["latency"])
+        tuning.apply(self.sock, "bulk", tuning.PROFILES["bulk"])
+        self.assertFalse(self.sock.getsockopt(socket.IPPROTO_TCP,
+                                              socket.TCP_NODELAY))
+        if sys.platform.startswith("linux"):
+            self.assertEqual(self.sock.getsockopt(socket.IPPROTO_TCP,
+                             tuning.TCP_NOTSENT_LOWAT), 0)
+
+    def test_congestion(self):
+        """Make sure we record the congestion control in use"""
+        if not sys.platform.startswith("linux"):
+            return
+        values = dict(tuning.PROFILES["bulk"], congestion="reno")
+        description = tuning.apply(self.sock, "bulk", values)
+        self.assertTrue("congestion=reno," in description)
+
+    def test_bad_congestion(self):
+        """Make sure an unknown congestion control is not fatal"""
+        values = dict(tuning.PROFILES["bulk"], congestion="nonexistent")
+        description = tuning.apply(self.sock, "bulk", values)
+        self.assertFalse("nonexistent" in description)
+
+class TestSummarize(unittest.TestCase):
+    def runTest(self):
+        """Make sure we describe each profile once"""
+        streams = [FakeStream({"latency": "latency(x)", "bulk": "bulk(y)"}),
+                   FakeStream({"bulk": "bulk(y)"}), FakeStream({})]
+        self.assertEqual(tuning.summarize(streams), "bulk(y); latency(x)")
+
+class TestStream_SetProfile(unittest.TestCase):
+    def runTest(self):
+        """Make sure the stream applies a profile only when it changes"""
+        calls = []
+        def apply(sock, name, values):
+            calls.append(name)
+            return name
+        s = stream.Stream(None)
+        s.sock = stream.SocketWrapper(None)
+        s.conf = {}
+        saved, tuning.apply = tuning.apply, apply
+        try:
+            s.set_profile("latency")
+            s.set_profile("latency")
+            s.set_profile("bulk")
+        finally:
+            tuning.apply = saved
+        self.assertEqual(calls, ["latency", "bulk"])
+        self.assertEqual(s.profile, "bulk")
+        self.assertEqual(s.tunings, {"latency": "latency", "bulk": "bulk"})
+
+if __name__ == "__main__":
+    unittest.main()
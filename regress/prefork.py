@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2012 Simone Basso <bassosimone@gmail.com>,
+#  NEXA Center for Internet & Society at Politecnico di Torino
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+''' Regression test for neubot/prefork.py '''
+
+import logging
+import os
+import signal
+import socket
+import sys
+import unittest
+
+if __name__ == '__main__':
+    sys.path.insert(0, '.')
+
+from neubot.net.poller import Poller
+from neubot.net.stream import StreamHandler
+from neubot.prefork import Supervisor
+
+CONF = {
+        "net.stream.accept_batch": 64,
+        "net.stream.backlog": 128,
+        "net.stream.ipv6": False,
+        "net.stream.rcvbuf": 0,
+        "net.stream.secure": False,
+        "net.stream.sndbuf": 0,
+       }
+
+class PidServer(StreamHandler):
+    ''' Tells the client the PID of the worker '''
+
+    def started_listening(self, listener):
+        ''' Remember the port we're listening at '''
+        self.port = listener.lsock.getsockname()[1]
+
+    def connection_made(self, sock, rtt=0):
+        ''' Send our PID and close '''
+        sock.setblocking(True)
+        sock.sendall(str(os.getpid()))
+        sock.close()
+
+def query(port):
+    ''' Return the PID of the worker that serves us '''
+    sock = socket.create_connection(("127.0.0.1", port), 5)
+    data = sock.recv(64)
+    sock.close()
+    return int(data)
+
+class TestSupervisor(unittest.TestCase):
+    ''' Make sure that the supervisor keeps the workers running '''
+
+    def run_for(self, supervisor, seconds):
+        ''' Run the supervisor loop for a while '''
+        supervisor.poller.sched(seconds, supervisor.poller.break_loop)
+        supervisor.poller.loop_forever()
+        supervisor.poller.again = True
+
+    def test_supervisor(self):
+        ''' Fork, serve, restart and aggregate stats '''
+        worker_poller = Poller(1)
+        server = PidServer(worker_poller)
+        server.configure(CONF)
+        server.listen(("127.0.0.1", 0))
+
+        supervisor = Supervisor(worker_poller, 2)
+        supervisor.interval = 0.1
+        supervisor.start()
+        try:
+            self.run_for(supervisor, 0.5)
+            self.assertEqual(len(supervisor.workers), 2)
+
+            # The workers serve the inherited listener
+            pid = query(server.port)
+            self.assertTrue(pid in supervisor.workers)
+
+            # We get the stats of all the workers
+            snap = supervisor.snap()
+            self.assertEqual(snap["workers"], 2)
+            self.assertEqual(len(snap["per_worker"]), 2)
+            self.assertTrue(snap["total"]["iterations"] > 0)
+            self.assertEqual(snap["total"]["readable"], 2)
+
+            # A worker that crashes is restarted
+            os.kill(pid, signal.SIGKILL)
+            self.run_for(supervisor, 1.5)
+            self.assertEqual(supervisor.restarts, 1)
+            self.assertEqual(len(supervisor.workers), 2)
+            self.assertFalse(pid in supervisor.workers)
+            self.assertTrue(query(server.port) in supervisor.workers)
+
+        finally:
+            supervisor.stop()
+        self.assertEqual(supervisor.workers, {})
+
+if __name__ == '__main__':
+    # Suppress annoying warnings
+    logging.getLogger().setLevel(logging.ERROR)
+
+    # Run tests
+    unittest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2012 Simone Basso <bassosimone@gmail.com>,
+#  NEXA Center for Internet & Society at Politecnico di Torino
+#
+# This file is part of Neubot <http://www.neubot.org/>.
+#
+# Neubot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Neubot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Neubot.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+''' Benchmark speedtest server capacity versus number of workers '''
+
+import logging
+import os
+import socket
+import sys
+
+sys.path.insert(0, '.')
+
+from neubot.config import CONFIG
+from neubot.net.poller import Poller
+from neubot.prefork import Supervisor
+from neubot.speedtest.server import SpeedtestServer
+from neubot import utils
+
+# Number of workers for each run
+WORKERS = (1, 2, 4)
+
+# Number of concurrent clients
+CLIENTS = 8
+
+# Duration of each run, in seconds
+DURATION = 3
+
+# Size of each download
+SIZE = 1 << 20
+
+REQUEST = ("GET /speedtest/download HTTP/1.1\r\n"
+           "Host: 127.0.0.1\r\n"
+           "Range: bytes=0-%d\r\n"
+           "\r\n") % (SIZE - 1)
+
+def client(port, wfd):
+    ''' Download for DURATION seconds and report the bytes '''
+    sock = socket.create_connection(("127.0.0.1", port))
+    total = 0
+    deadline = utils.ticks() + DURATION
+    while utils.ticks() < deadline:
+        sock.sendall(REQUEST)
+        # Skip headers: the body is exactly SIZE bytes
+        data = ""
+        while "\r\n\r\n" not in data:
+            data += sock.recv(65536)
+        count = len(data) - data.index("\r\n\r\n") - 4
+        while count < SIZE:
+            count += len(sock.recv(262144))
+        total += count
+    sock.close()
+    os.write(wfd, "%d\n" % total)
+
+def run(workers):
+    ''' Measure the goodput with the given number of workers '''
+    conf = CONFIG.copy()
+    poller = Poller(1)
+    server = SpeedtestServer(poller)
+    server.configure(conf)
+    lsock = socket.socket()
+    lsock.bind(("127.0.0.1", 0))
+    port = lsock.getsockname()[1]
+    lsock.close()
+    server.listen(("127.0.0.1", port))
+
+    supervisor = Supervisor(poller, workers)
+    supervisor.start()
+
+    rfd, wfd = os.pipe()
+    clients = []
+    for _ in range(CLIENTS):
+        pid = os.fork()
+        if pid == 0:
+            os.close(rfd)
+            try:
+                client(port, wfd)
+            finally:
+                os._exit(0)
+        clients.append(pid)
+    os.close(wfd)
+
+    for pid in clients:
+        os.waitpid(pid, 0)
+    total = sum(int(line) for line in os.fdopen(rfd).read().split())
+
+    supervisor.stop()
+    for listener in poller.readset.values():
+        poller.close(listener)
+    return total / float(DURATION)
+
+def main():
+    ''' Benchmark the speedtest server '''
+    logging.getLogger().setLevel(logging.ERROR)
+    print('%d cores, %d clients, %d seconds per run' % (
+          os.sysconf("SC_NPROCESSORS_ONLN"), CLIENTS, DURATION))
+    for workers in WORKERS:
+        print('%d workers: %s' % (workers,
+              utils.speed_formatter(run(workers))))
+
+if __name__ == '__main__':
+    main()